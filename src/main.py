@@ -1,21 +1,29 @@
 """
 This is the main file for the project.
 """
+import copy
 from typing import Dict, Any, Union
 
 from src.document_parsing import Chunker
 from src.models import OAEmbedding, EmbeddingModel
+from src.models import clients, rate_limiter, worker_pools
 from src.models.agents import Agents
+from src.models.endpoints import Endpoint
 from src.models.llmodel import LLModel
 from src.models.qna_pipline import QAPipeline
+from src.models.question_memo import QuestionMemo
+from src.models.response_cache import ResponseCache
 from src.models.st_embedding import STEmbedding
 from src.routines.cli_routine import cli_routine
 from src.routines.discord_routine import run_discord_routine
 from src.routines.embedding_routine import embedding_routine
 from src.routines.generate_answers_routine import generate_answers
-from src.vectordb.rating_storage import RatingStorage
+from src.vectordb.answer_cache_storage import AnswerCacheStorage
+from src.vectordb.async_rating_storage import AsyncRatingStorage
+from src.vectordb.async_vector_storage import AsyncVectorStorage
 from src.vectordb.vector_storage import VectorStorage
 from src.routines.server_routine import run_server
+from src.routines.stub_routine import run_stub_server
 
 import toml  # assuming you're using toml to load your config
 import argparse
@@ -62,6 +70,11 @@ def argparse_args():
     server_parser.add_argument("--port", type=int, help="Port for the Discord module")
     server_parser.add_argument("--address", type=str, help="Address for the Discord module")
 
+    # run-stub
+    stub_parser = subparsers.add_parser("run-stub", help="Run a local stand-in for the model APIs, configured by the [stub] section")
+    stub_parser.add_argument("--port", type=int, help="Port for the stub API")
+    stub_parser.add_argument("--address", type=str, help="Address for the stub API")
+
     # ✨ new subcommands
     gen_parser = subparsers.add_parser("generate-answers", help="Generate answers from CSV")
     gen_parser.add_argument(
@@ -104,20 +117,70 @@ def get_required_config(config, key, error_msg=None):
     return value
 
 
+def load_response_cache(config: Dict[str, Any]) -> ResponseCache | None:
+    """
+    Creates the response cache if the [response_cache] section is present in the config.
+    :param config:
+    :return: response cache or None if caching is not enabled
+    """
+    cache_config = config.get("response_cache")
+    if cache_config is None:
+        return None
+
+    return ResponseCache(
+        path=cache_config.get("path", "cache/responses.sqlite"),
+        ttl=cache_config.get("ttl"),
+        max_entries=cache_config.get("max_entries", 10_000),
+    )
+
+
 def load_llmodels(config: Dict[str, Dict[str, Union[str, float]]]) -> Dict[str, LLModel]:
     models = dict()
+    cache = load_response_cache(config)
+
+    # Limits belong to the endpoint and model, so every section (also those only used as fallbacks) sets up its limiter first
+    for model in config["model"]:
+        rate_limiter.configure(
+            config["model"][model]["base_url"],
+            config["model"][model]["model_name"],
+            max_in_flight=config["model"][model].get("max_in_flight"),
+            requests_per_minute=config["model"][model].get("requests_per_minute"),
+            tokens_per_minute=config["model"][model].get("tokens_per_minute"),
+        )
+
     for model in config["model"]:
         model_name = config["model"][model]["model_name"]
         endpoint = config["model"][model]["base_url"]
         api_key = config["model"][model]["api_key"]
         input_cost = config["model"][model].get("input_cost", 0)
         output_cost = config["model"][model].get("output_cost", 0)
+
+        # Fallbacks name other [model.*] sections serving the same model through a different endpoint
+        fallbacks = []
+        for fallback in config["model"][model].get("fallbacks", []):
+            if fallback not in config["model"]:
+                raise ValueError(f"Fallback {fallback} of model {model} is not defined in the config.")
+            fallback_config = config["model"][fallback]
+            fallbacks.append(Endpoint(
+                base_url=fallback_config["base_url"],
+                api_key=fallback_config["api_key"],
+                model_name=fallback_config["model_name"],
+            ))
+
         ll_model = LLModel(
             model_name=model_name,
             endpoint=endpoint,
             api_key=api_key,
             input_cost=input_cost,
             output_cost=output_cost,
+            cache=cache,
+            fallbacks=fallbacks,
+            timeout=config["model"][model].get("timeout"),
+            max_retries=config["model"][model].get("max_retries", 2),
+            retry_backoff=config["model"][model].get("retry_backoff", 0.5),
+            hedge_quantile=config["model"][model].get("hedge_quantile"),
+            context_budget=config["model"][model].get("context_budget"),
+            cached_input_cost=config["model"][model].get("cached_input_cost"),
         )
         models[model] = ll_model
 
@@ -174,6 +237,9 @@ def load_embedding_model(config: Dict[str, Any]) -> EmbeddingModel | None:
             prompt=prompt,
         )
 
+    model.query_cache_size = model_config.get("query_cache_size", model.query_cache_size)
+    model.max_query_batch = model_config.get("max_query_batch", model.max_query_batch)
+
     return model, model_name, strategy
 
 
@@ -201,13 +267,7 @@ def select_agent_models(models: Dict[str, LLModel], config: Dict) -> Agents:
         default_model_name = default_section.get(role)
         if default_model_name and default_model_name in models:
             original = models[default_model_name]
-            selected_models[role] = LLModel(
-                model_name=original.model_name,
-                api_key=original.api_key,
-                endpoint=original.endpoint,
-                input_cost=original.input_cost,
-                output_cost=original.output_cost,
-            )
+            selected_models[role] = copy.copy(original)
             print(f"Using default model for {role}: {default_model_name}")
         else:
             # Ask user to select a model for this role
@@ -221,13 +281,7 @@ def select_agent_models(models: Dict[str, LLModel], config: Dict) -> Agents:
                     choice = int(input(f"Enter number for {role}: "))
                     if 0 <= choice < len(model_names):
                         original = models[model_names[choice]]
-                        selected_models[role] = LLModel(
-                            model_name=original.model_name,
-                            api_key=original.api_key,
-                            endpoint=original.endpoint,
-                            input_cost=original.input_cost,
-                            output_cost=original.output_cost,
-                        )
+                        selected_models[role] = copy.copy(original)
                         break
                     else:
                         print(f"Please enter a number between 0 and {len(model_names) - 1}")
@@ -247,6 +301,21 @@ def main():
     # Load the config file
     config = load_config(args.config)
 
+    # The stub stands in for the model providers, it needs no models or database itself
+    if args.command == "run-stub":
+        stub_config = dict(config.get("stub", {}))
+        if args.port is not None:
+            stub_config["port"] = args.port
+        if args.address is not None:
+            stub_config["address"] = args.address
+        print(f"Running stub API on http://{stub_config.get('address', '127.0.0.1')}:{stub_config.get('port', 8090)}/v1")
+        run_stub_server(**stub_config)
+        return
+
+    # Shared HTTP clients have to be configured before any model creates them
+    clients.configure(**config.get("http", {}))
+    worker_pools.configure(**config.get("workers", {}))
+
     models = load_llmodels(config)
 
     embedding_model, model_name, strategy = load_embedding_model(config)
@@ -264,7 +333,34 @@ def main():
         connection_string=get_required_config(config, "POSTGRESQL_CONNECTION_STRING"),
     )
 
-    rating_storage = RatingStorage(
+    # Used by the server and the discord bot, its connection pool is opened once their event loop runs
+    async_storage = AsyncVectorStorage(
+        name=model_name,
+        dimension=embedding_model.get_dimension(),
+        connection_string=get_required_config(config, "POSTGRESQL_CONNECTION_STRING"),
+    )
+
+    answer_cache = None
+    answer_cache_config = config.get("answer_cache")
+    if answer_cache_config is not None:
+        answer_cache = AnswerCacheStorage(
+            name=f"{model_name}_answer_cache",
+            dimension=embedding_model.get_dimension(),
+            connection_string=get_required_config(config, "POSTGRESQL_CONNECTION_STRING"),
+            ratings_table="ratings" if answer_cache_config.get("rated_only", False) else None,
+        )
+
+    question_memo = None
+    question_memo_config = config.get("question_memo")
+    if question_memo_config is not None:
+        question_memo = QuestionMemo(
+            min_similarity=question_memo_config.get("similarity", 0.95),
+            ttl=question_memo_config.get("ttl", 3600),
+            max_entries=question_memo_config.get("max_entries", 1000),
+            version_check_interval=question_memo_config.get("version_check_interval", 60),
+        )
+
+    rating_storage = AsyncRatingStorage(
         name="ratings",
         connection_string=get_required_config(config, "POSTGRESQL_CONNECTION_STRING"),
     )
@@ -275,6 +371,18 @@ def main():
         vector_storage=storage,
         global_prompt=global_prompt,
         max_iterations=config.get("ITERATIONS", 5),
+        context_window=config.get("CONTEXT_WINDOW", 0),
+        mmr_lambda=config.get("MMR_LAMBDA"),
+        answer_cache=answer_cache,
+        answer_cache_similarity=(answer_cache_config or {}).get("similarity", 0.95),
+        max_concurrency=config.get("MAX_CONCURRENCY", 16),
+        speculative_retrieval=config.get("SPECULATIVE_RETRIEVAL", 0),
+        fast_path_similarity=config.get("FAST_PATH_SIMILARITY"),
+        draft_confidence=config.get("DRAFT_CONFIDENCE"),
+        question_memo=question_memo,
+        question_similarity=config.get("QUESTION_SIMILARITY", 0.95),
+        time_limit=config.get("TIME_LIMIT"),
+        cost_limit=config.get("COST_LIMIT"),
     )
 
     # Based on the command, pull in defaults from config if CLI args aren't provided
@@ -300,7 +408,9 @@ def main():
                           chunker=chunker,
                           embedding_model=embedding_model,
                           vector_storage=storage,
-                          mode=action)
+                          mode=action,
+                          near_duplicate_distance=config.get("NEAR_DUPLICATE_DISTANCE"),
+                          answer_cache=answer_cache)
 
 
     if args.command == "run-cli":
@@ -333,6 +443,7 @@ def main():
             max_questions_global=global_limit,
             guild_ids=guild_id,
             channel_ids=channel_id,
+            async_vector_storage=async_storage,
         )
 
     if args.command == "run-server":
@@ -345,6 +456,7 @@ def main():
             qan,
             address=address,
             port=port,
+            async_vector_storage=async_storage,
         )
 
     if args.command == "generate-answers":
@@ -0,0 +1,123 @@
+"""
+Process wide registry of OpenAI clients. Every model talking to the same endpoint with the same key shares one client,
+and with it one connection pool, so copies of models made per request reuse open (keep-alive) connections instead of
+opening new ones. Models asking for their own timeout or retries get a copy of the shared client made with
+``with_options``, which keeps using its connection pool.
+"""
+import asyncio
+import importlib.util
+import threading
+import weakref
+from typing import Optional
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+_settings = {
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 60.0,
+    # HTTP/2 multiplexes concurrent requests over one connection, it needs the optional h2 package
+    "http2": importlib.util.find_spec("h2") is not None,
+}
+
+_lock = threading.Lock()
+# Shared clients are keyed by (base_url, api_key), their copies with other options by (base_url, api_key, timeout, max_retries)
+_clients: dict[tuple, OpenAI] = {}
+# Async clients are bound to the event loop they were first used in, so they are kept per loop
+_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def configure(
+    max_connections: int = None,
+    max_keepalive_connections: int = None,
+    keepalive_expiry: float = None,
+    http2: bool = None,
+):
+    """
+    Set the connection pool settings of clients created from now on, call it before any model is created.
+    :param max_connections: Maximum number of connections per client.
+    :param max_keepalive_connections: Maximum number of idle connections kept open per client.
+    :param keepalive_expiry: Seconds an idle connection is kept open.
+    :param http2: Use HTTP/2, ignored if the h2 package is not installed.
+    """
+    with _lock:
+        if max_connections is not None:
+            _settings["max_connections"] = max_connections
+        if max_keepalive_connections is not None:
+            _settings["max_keepalive_connections"] = max_keepalive_connections
+        if keepalive_expiry is not None:
+            _settings["keepalive_expiry"] = keepalive_expiry
+        if http2 is not None:
+            if http2 and importlib.util.find_spec("h2") is None:
+                print("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+                http2 = False
+            _settings["http2"] = http2
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=_settings["max_connections"],
+        max_keepalive_connections=_settings["max_keepalive_connections"],
+        keepalive_expiry=_settings["keepalive_expiry"],
+    )
+
+
+def _options(timeout: Optional[float], max_retries: Optional[int]) -> dict:
+    options = {}
+    if timeout is not None:
+        options["timeout"] = timeout
+    if max_retries is not None:
+        options["max_retries"] = max_retries
+    return options
+
+
+def _with_options(clients: dict, base_url: str, api_key: str, timeout: Optional[float], max_retries: Optional[int]):
+    """
+    Get the copy of the shared client in ``clients`` with the given options, called with the lock held.
+    """
+    options = _options(timeout, max_retries)
+    if not options:
+        return clients[base_url, api_key]
+
+    key = (base_url, api_key, timeout, max_retries)
+    client = clients.get(key)
+    if client is None:
+        client = clients[base_url, api_key].with_options(**options)
+        clients[key] = client
+    return client
+
+
+def get_client(base_url: str, api_key: str, timeout: float = None, max_retries: int = None) -> OpenAI:
+    """
+    Get the shared client for an endpoint. Sync clients are thread-safe and used from any thread.
+    :param base_url: Endpoint URL.
+    :param api_key: API key.
+    :param timeout: Request timeout in seconds, the client default if None.
+    :param max_retries: Retries done by the client itself, the client default if None.
+    :return: Client.
+    """
+    with _lock:
+        if (base_url, api_key) not in _clients:
+            _clients[base_url, api_key] = OpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                http_client=DefaultHttpxClient(limits=_limits(), http2=_settings["http2"]),
+            )
+        return _with_options(_clients, base_url, api_key, timeout, max_retries)
+
+
+def get_async_client(base_url: str, api_key: str, timeout: float = None, max_retries: int = None) -> AsyncOpenAI:
+    """
+    Get the shared async client for an endpoint in the running event loop, see :func:`get_client`.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        if (base_url, api_key) not in clients:
+            clients[base_url, api_key] = AsyncOpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                http_client=DefaultAsyncHttpxClient(limits=_limits(), http2=_settings["http2"]),
+            )
+        return _with_options(clients, base_url, api_key, timeout, max_retries)
@@ -1,7 +1,89 @@
-from typing import List
+import asyncio
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import List, Optional
 import numpy as np
 from abc import ABC, abstractmethod
 
+from . import worker_pools
+from .usage import UsageLedger, UsageRecord
+
+
+class _QueryBatcher:
+    """
+    Collects single queries embedded with the same instruction in one event loop and embeds them together. A batch is
+    sent as soon as the previous one finished, so queries arriving while the model is busy share the next call and
+    a query arriving to an idle model is not delayed at all.
+    """
+
+    def __init__(self, model: "EmbeddingModel", instruction: Optional[str], max_batch: int):
+        self.model = model
+        self.instruction = instruction
+        self.max_batch = max_batch
+        self.pending: list[tuple[str, asyncio.Future, Optional[UsageLedger], str]] = []
+        self.task: Optional[asyncio.Task] = None
+
+    async def embed(self, text: str, ledger: Optional[UsageLedger], stage: str) -> np.array:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((text, future, ledger, stage))
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._drain())
+        return await future
+
+    async def _drain(self):
+        batch = []
+        try:
+            while self.pending:
+                batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+                batch = [entry for entry in batch if not entry[1].done()]
+                if not batch:
+                    continue
+
+                texts = list(dict.fromkeys(text for text, _, _, _ in batch))
+                started = time.monotonic()
+                batch_ledger = UsageLedger()
+                try:
+                    by_text = dict(zip(texts, await self.model.aembed(texts, self.instruction, ledger=batch_ledger)))
+                except Exception as e:
+                    by_text = {texts[0]: e} if len(texts) == 1 else await self._embed_one_by_one(texts, batch_ledger)
+
+                latency = time.monotonic() - started
+                # The tokens of the call are split evenly between the queries sharing it
+                tokens = sum(record.prompt_tokens for record in batch_ledger.records) // len(batch)
+                for text, future, ledger, stage in batch:
+                    if isinstance(by_text[text], Exception):
+                        if not future.done():
+                            future.set_exception(by_text[text])
+                        continue
+                    self.model.cache_query(text, self.instruction, by_text[text])
+                    if ledger is not None:
+                        ledger.record(UsageRecord(model=self.model.model_name, stage=stage, prompt_tokens=tokens, latency=latency))
+                    if not future.done():
+                        future.set_result(by_text[text])
+        except BaseException:
+            for _, future, _, _ in batch + self.pending:
+                future.cancel()
+            self.pending = []
+            raise
+        finally:
+            self.task = None
+
+    async def _embed_one_by_one(self, texts: list[str], ledger: UsageLedger) -> dict:
+        """
+        Embed the texts of a failed batch separately, so a single bad query (e.g. one too long for the model) fails
+        only its own requests and not the unrelated ones it was batched with.
+        :return: Embedding of every text, or the exception embedding it raised.
+        """
+        by_text = {}
+        for text in texts:
+            try:
+                by_text[text] = (await self.model.aembed([text], self.instruction, ledger=ledger))[0]
+            except Exception as e:
+                by_text[text] = e
+        return by_text
+
 
 class EmbeddingModel(ABC):
     """
@@ -15,6 +97,13 @@ class EmbeddingModel(ABC):
         self.model_name = None
         self.prompt = prompt
 
+        self.query_cache_size = 256
+        self.max_query_batch = 64
+        self._query_cache: OrderedDict[tuple, np.array] = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        # Batchers are bound to the event loop their queries wait in
+        self._batchers: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
     def apply_prompt(self, instruction: str, query: str) -> str:
         """
         Apply the prompt to the data.
@@ -42,6 +131,53 @@ class EmbeddingModel(ABC):
         """Embed a list of strings into a list of vectors."""
         pass
 
+    async def aembed(
+        self, data: List[str], instruction: str = None, ledger: UsageLedger = None, stage: str = "embedding"
+    ) -> List[np.array]:
+        """
+        Asyncio variant of :meth:`embed`. Runs :meth:`embed` in the shared embedding worker pool, models with an async API override it.
+        :param ledger: If provided, the latency of the call is recorded in it.
+        :param stage: Stage of the pipeline the call is recorded under.
+        """
+        started = time.monotonic()
+        result = await worker_pools.get(worker_pools.EMBEDDING).run(self.embed, data, instruction)
+        if ledger is not None:
+            ledger.record(UsageRecord(model=self.model_name, stage=stage, latency=time.monotonic() - started))
+        return result
+
+    async def aembed_query(
+        self, text: str, instruction: str = None, ledger: UsageLedger = None, stage: str = "embedding"
+    ) -> np.array:
+        """
+        Embed a single query. Recently embedded queries are answered from a small LRU cache, and queries embedded
+        concurrently (e.g. all questions of an iteration) are sent to the model together in one batched call.
+        :param text: Query to embed.
+        :param instruction: Instruction applied to the query, see :meth:`apply_prompt`.
+        :param ledger: If provided, the usage of the call is recorded in it, a batched call is split between its queries.
+        :param stage: Stage of the pipeline the call is recorded under.
+        :return: Embedding of the query.
+        """
+        with self._query_cache_lock:
+            vector = self._query_cache.get((instruction, text))
+            if vector is not None:
+                self._query_cache.move_to_end((instruction, text))
+                return vector
+
+        batchers = self._batchers.setdefault(asyncio.get_running_loop(), {})
+        if instruction not in batchers:
+            batchers[instruction] = _QueryBatcher(self, instruction, self.max_query_batch)
+        return await batchers[instruction].embed(text, ledger, stage)
+
+    def cache_query(self, text: str, instruction: Optional[str], vector: np.array):
+        """
+        Remember the embedding of a query for :meth:`aembed_query`, the least recently used query is forgotten once the cache is full.
+        """
+        with self._query_cache_lock:
+            self._query_cache[(instruction, text)] = vector
+            self._query_cache.move_to_end((instruction, text))
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+
     @abstractmethod
     def tokenize(self, data: str) -> List[int]:
         """Tokenize a list of strings into a list of tokens."""
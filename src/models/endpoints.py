@@ -0,0 +1,90 @@
+import asyncio
+import random
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+import openai
+
+
+@dataclass(frozen=True)
+class Endpoint:
+    """
+    One API serving a model. Equivalent endpoints of the same model (e.g. OpenAI and OpenRouter) can have different model names.
+    """
+
+    base_url: str
+    api_key: str
+    model_name: str
+
+
+# Errors worth trying again, possibly on a different endpoint. Anything else (bad request, authentication, ...) fails the same way everywhere.
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+
+def backoff_delay(attempt: int, base: float, cap: float = 30) -> float:
+    """
+    Delay before the next retry, exponential backoff with full jitter so that clients failing together do not retry together.
+    :param attempt: Number of the failed attempt, starting at 0.
+    :param base: Delay after the first failure, before jitter.
+    :param cap: Maximum delay.
+    :return: Seconds to wait.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after(error: openai.APIStatusError) -> Optional[float]:
+    """
+    Read how long the provider asked to wait from the headers of an error response.
+    :return: Seconds to wait, None if the provider did not say.
+    """
+    headers = error.response.headers if error.response is not None else {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        # retry-after can also be an HTTP date, which is not worth parsing here
+        pass
+    return None
+
+
+class LatencyTracker:
+    """
+    Keeps the latencies of the most recent successful requests, streams are recorded once they are exhausted. Used to
+    decide when a request is slow enough to hedge and how much time to reserve for the final answer.
+    Shared by all copies of a model and safe to use from multiple threads.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        """
+        :param window: Number of most recent latencies kept.
+        :param min_samples: Quantiles are not reported until this many latencies were recorded.
+        """
+        self.samples: deque[float] = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        :param q: Quantile between 0 and 1.
+        :return: The quantile of the recorded latencies in seconds, None if there are not enough of them yet.
+        """
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
@@ -0,0 +1,116 @@
+import json
+from typing import Any
+
+
+class JsonArrayStream:
+    """
+    Incremental parser of a JSON object as a model streams it, yielding the items of one of its array fields as soon
+    as each of them is complete, long before the whole object is.
+
+    Only the top level object is inspected, e.g. with ``field="questions"`` the stream ``{"satisfied": false,
+    "questions": [{"question_text": ...}, {...`` yields the first question once its closing brace arrives.
+    Scalar fields of the top level object are collected in :attr:`fields` as soon as each of them is complete, so fields
+    written before the array can be checked before its items are used.
+    The text is not validated, the complete content still has to be parsed once the stream ends.
+    """
+
+    def __init__(self, field: str):
+        """
+        :param field: Name of the array field of the top level object whose items are yielded.
+        """
+        self.field = field
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+        self.string_start = None
+        self.last_key = None
+        self.in_array = False
+        self.item_start = None
+
+        self.fields: dict[str, Any] = {}
+        self.value_key = None
+        self.value_start = None
+
+    def feed(self, text: str) -> list[Any]:
+        """
+        Add the next part of the stream.
+        :param text: Text delta.
+        :return: Items completed by this part, already decoded from JSON.
+        """
+        self.buffer += text
+        items = []
+        while self.position < len(self.buffer):
+            item = self._step(self.buffer[self.position])
+            self.position += 1
+            if item is not None:
+                items.append(json.loads(item))
+        return items
+
+    def _step(self, char: str):
+        """
+        Advance by one character.
+        :return: Raw JSON of an item completed by the character, None otherwise.
+        """
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif char == "\\":
+                self.escape = True
+            elif char == '"':
+                self.in_string = False
+                if self.depth == 1 and self.string_start is not None:
+                    # Any string directly in the top level object may be a key, it is confirmed by the following ':'
+                    self.last_key = self.buffer[self.string_start:self.position + 1]
+            return None
+
+        if self.in_array and self.depth == 2 and self.item_start is None and char not in " \t\r\n,]":
+            self.item_start = self.position
+
+        if char == '"':
+            self.in_string = True
+            self.string_start = self.position if self.depth == 1 else None
+        elif char == ":" and self.depth == 1:
+            self.last_key = json.loads(self.last_key) if self.last_key is not None else None
+            self.value_key = self.last_key
+            self.value_start = self.position + 1
+        elif char in "{[":
+            self.depth += 1
+            if char == "[" and self.depth == 2 and self.last_key == self.field:
+                self.in_array = True
+        elif char in "}]":
+            self.depth -= 1
+            if self.depth == 0:
+                self._take_value(self.position)
+            if self.in_array and self.depth == 2 and self.item_start is not None:
+                # A nested object or array item was closed
+                return self._take_item(self.position + 1)
+            if self.in_array and self.depth == 1:
+                # The array itself was closed, a trailing scalar item ends with it
+                self.in_array = False
+                return self._take_item(self.position) if self.item_start is not None else None
+        elif char == "," and self.in_array and self.depth == 2 and self.item_start is not None:
+            return self._take_item(self.position)
+        elif char == "," and self.depth == 1:
+            self._take_value(self.position)
+
+        return None
+
+    def _take_value(self, end: int):
+        if self.value_start is None:
+            return
+        value = self.buffer[self.value_start:end].strip()
+        self.value_start = None
+        # Arrays and objects are left out, the streamed array would be parsed again for nothing
+        if value and value[0] not in "[{":
+            try:
+                self.fields[self.value_key] = json.loads(value)
+            except ValueError:
+                pass
+
+    def _take_item(self, end: int) -> str:
+        item = self.buffer[self.item_start:end].strip()
+        self.item_start = None
+        return item
@@ -1,13 +1,26 @@
-from typing import Optional, Union, Type
-from openai import OpenAI
+import asyncio
+import time
+from contextlib import aclosing, closing
+from typing import Optional, Union, Type, Iterator, AsyncIterator, Callable, get_args
+import openai
+from openai import OpenAI, AsyncOpenAI
 from openai.types import CompletionUsage
 from pydantic import BaseModel
 
+from . import clients, rate_limiter, worker_pools
+from .endpoints import Endpoint, LatencyTracker, RETRYABLE_ERRORS, backoff_delay, retry_after
+from .json_stream import JsonArrayStream
+from .rate_limiter import RateLimiter
+from .response_cache import ResponseCache
+from .usage import UsageLedger, UsageRecord
+
 
 class LLModel:
 
     def __init__(
-        self, model_name: str, api_key: str, endpoint: str, system_prompt: str = None, output_cost: float = 0, input_cost: float = 0
+        self, model_name: str, api_key: str, endpoint: str, system_prompt: str = None, output_cost: float = 0, input_cost: float = 0,
+        cache: ResponseCache = None, fallbacks: list[Endpoint] = None, timeout: float = None, max_retries: int = 2,
+        retry_backoff: float = 0.5, hedge_quantile: float = None, context_budget: int = None, cached_input_cost: float = None,
     ):
         """
         Initialize the LLModel with model name, API key and endpoint.
@@ -17,6 +30,15 @@ class LLModel:
         :param system_prompt: System prompt to be used
         :param output_cost: Cost per token for output
         :param input_cost: Cost per token for input
+        :param cache: If provided, identical requests are answered from this cache instead of calling the API
+        :param fallbacks: Equivalent endpoints serving the same model, used for retries and hedged requests
+        :param timeout: Timeout of a single request in seconds, the client default is used if not set
+        :param max_retries: Number of times a failed request is retried, each retry goes to the next endpoint
+        :param retry_backoff: Base of the jittered exponential delay between retries in seconds
+        :param hedge_quantile: If set and there are fallbacks, async requests still running after this quantile of recent latencies
+            (e.g. 0.95) get a duplicate request on the next endpoint, the first response wins and the other request is cancelled
+        :param context_budget: Maximum number of tokens of research context sent to this model, unlimited if not set
+        :param cached_input_cost: Cost per token for input served from the provider's prompt cache, defaults to input_cost
         :return: None
         """
         self.model_name: str = model_name
@@ -28,18 +50,30 @@ class LLModel:
 
         self.output_cost: float = output_cost
         self.input_cost: float = input_cost
+        self.cached_input_cost: float = input_cost if cached_input_cost is None else cached_input_cost
 
-        self.client = OpenAI(
-            base_url=endpoint,
-            api_key=api_key,
-        )
+        self.cache: Optional[ResponseCache] = cache
+
+        self.endpoints: list[Endpoint] = [Endpoint(endpoint, api_key, model_name)] + list(fallbacks or [])
+        self.timeout: Optional[float] = timeout
+        self.max_retries: int = max_retries
+        self.retry_backoff: float = retry_backoff
+        self.hedge_quantile: Optional[float] = hedge_quantile
+        self.latency: LatencyTracker = LatencyTracker()
+        self.context_budget: Optional[int] = context_budget
+
+        # Clients are shared by every model using the same endpoint, retries are done by the model so they can move to another endpoint
+        self.clients: list[OpenAI] = [
+            clients.get_client(e.base_url, e.api_key, timeout=self.timeout, max_retries=0) for e in self.endpoints
+        ]
+        self.client = self.clients[0]
 
     def __copy__(self):
-        # shallow copy: shares the same client but new usage slot
+        # shallow copy without running __init__: shares the clients and latency statistics but new usage slot
         cls = self.__class__
-        new = cls(self.model_name, self.api_key, self.endpoint, self.system_prompt, self.output_cost, self.input_cost)
-
-        new.client = self.client
+        new = cls.__new__(cls)
+        new.__dict__.update(self.__dict__)
+        new.endpoints = list(self.endpoints)
         new.usage = None
         return new
 
@@ -48,15 +82,529 @@ class LLModel:
         prompt: str,
         image_urls: Optional[list[str]] = None,
         structure: Type[BaseModel] = None,
+        ledger: UsageLedger = None,
+        stage: str = "generation",
     ) -> Union[str, BaseModel]:
         """
         Generate a response from the model.
         :param image_urls: List of image URLs to be included in the prompt, the model needs to support vision.
         :param prompt: The input prompt for the model.
         :param structure: Forces the model to respond in specific structure, if provided. Otherwise the model will return string.
+        :param ledger: If provided, the usage of the call is recorded in it.
+        :param stage: Stage of the pipeline the call is recorded under.
         :return: Model response.
         """
+        started = time.monotonic()
+
+        cache_key, cached, usage = self._cache_lookup(prompt, image_urls, structure)
+        if cached is not None:
+            self._record(ledger, stage, usage, started, cached_response=True)
+            return self._parse_content(cached, structure)
+
+        settings = self._build_settings(prompt, image_urls, structure)
+
+        response = self._create(settings)
+
+        self.usage = response.usage
+        self._record(ledger, stage, response.usage, started)
+        content = response.choices[0].message.content
+
+        parsed = self._parse_content(content, structure)
+        self._cache_store(cache_key, content, response.usage)
+
+        return parsed
+
+    async def agenerate_response(
+        self,
+        prompt: str,
+        image_urls: Optional[list[str]] = None,
+        structure: Type[BaseModel] = None,
+        ledger: UsageLedger = None,
+        stage: str = "generation",
+        max_tokens: int = None,
+        timeout: float = None,
+    ) -> Union[str, BaseModel]:
+        """
+        Asyncio variant of :meth:`generate_response`.
+        :param prompt: The input prompt for the model.
+        :param image_urls: List of image URLs to be included in the prompt, the model needs to support vision.
+        :param structure: Forces the model to respond in specific structure, if provided. Otherwise the model will return string.
+        :param ledger: If provided, the usage of the call is recorded in it.
+        :param stage: Stage of the pipeline the call is recorded under.
+        :param max_tokens: If set, the response is cut after this many tokens, a cut response is not cached.
+        :param timeout: If set, timeout of every attempt of this call in seconds instead of the model's own.
+        :return: Model response.
+        """
+        started = time.monotonic()
+
+        cache_key, cached, usage = await self._acache_lookup(prompt, image_urls, structure)
+        if cached is not None:
+            self._record(ledger, stage, usage, started, cached_response=True)
+            return self._parse_content(cached, structure)
+
+        settings = self._build_settings(prompt, image_urls, structure, max_tokens, timeout)
+
+        response = await self._acreate(settings)
+
+        self.usage = response.usage
+        self._record(ledger, stage, response.usage, started)
+        content = response.choices[0].message.content
+
+        parsed = self._parse_content(content, structure)
+        if response.choices[0].finish_reason != "length":
+            await self._acache_store(cache_key, content, response.usage)
+
+        return parsed
+
+    def stream_response(
+        self,
+        prompt: str,
+        image_urls: Optional[list[str]] = None,
+        ledger: UsageLedger = None,
+        stage: str = "generation",
+    ) -> Iterator[str]:
+        """
+        Generate a text response from the model, yielding parts of the text as soon as the model produces them.
+        Usage of the request is available through :meth:`get_last_usage` once the generator is exhausted.
+        :param prompt: The input prompt for the model.
+        :param image_urls: List of image URLs to be included in the prompt, the model needs to support vision.
+        :param ledger: If provided, the usage of the call is recorded in it once the generator is exhausted.
+        :param stage: Stage of the pipeline the call is recorded under.
+        :return: Generator of text deltas.
+        """
+        started = time.monotonic()
+
+        cache_key, cached, usage = self._cache_lookup(prompt, image_urls)
+        if cached is not None:
+            self._record(ledger, stage, usage, started, cached_response=True)
+            yield cached
+            return
+
+        settings = self._build_settings(prompt, image_urls)
+        settings["stream"] = True
+        settings["stream_options"] = {"include_usage": True}
+
+        usage = None
+        parts = []
+        with closing(self._create(settings)) as stream:
+            for chunk in stream:
+                # The last chunk carries only the usage of the whole request
+                if chunk.usage is not None:
+                    usage = chunk.usage
+
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+
+        self.usage = usage
+        self._record(ledger, stage, usage, started)
+        self._cache_store(cache_key, "".join(parts), usage)
+
+    async def astream_response(
+        self,
+        prompt: str,
+        image_urls: Optional[list[str]] = None,
+        ledger: UsageLedger = None,
+        stage: str = "generation",
+        max_tokens: int = None,
+        timeout: float = None,
+    ) -> AsyncIterator[str]:
+        """
+        Asyncio variant of :meth:`stream_response`.
+        :param prompt: The input prompt for the model.
+        :param image_urls: List of image URLs to be included in the prompt, the model needs to support vision.
+        :param ledger: If provided, the usage of the call is recorded in it once the generator is exhausted.
+        :param stage: Stage of the pipeline the call is recorded under.
+        :param max_tokens: If set, the response is cut after this many tokens, a cut response is not cached.
+        :param timeout: If set, timeout of every attempt of this call in seconds instead of the model's own.
+        :return: Async generator of text deltas.
+        """
+        started = time.monotonic()
+
+        cache_key, cached, usage = await self._acache_lookup(prompt, image_urls)
+        if cached is not None:
+            self._record(ledger, stage, usage, started, cached_response=True)
+            yield cached
+            return
+
+        settings = self._build_settings(prompt, image_urls, max_tokens=max_tokens, timeout=timeout)
+        settings["stream"] = True
+        settings["stream_options"] = {"include_usage": True}
+
+        usage = None
+        finish_reason = None
+        parts = []
+        async with aclosing(await self._acreate(settings)) as stream:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    finish_reason = chunk.choices[0].finish_reason
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+
+        self.usage = usage
+        self._record(ledger, stage, usage, started)
+        if finish_reason != "length":
+            await self._acache_store(cache_key, "".join(parts), usage)
+
+    async def astream_structured(
+        self,
+        prompt: str,
+        structure: Type[BaseModel],
+        field: str,
+        on_item: Callable[[BaseModel], None],
+        image_urls: Optional[list[str]] = None,
+        ledger: UsageLedger = None,
+        stage: str = "generation",
+        skip_items: Callable[[dict], bool] = None,
+        timeout: float = None,
+    ) -> BaseModel:
+        """
+        Generate a structured response, streaming it so that every item of one of its list fields is handed to
+        ``on_item`` as soon as the model finished writing it, while the rest of the response is still being generated.
+        :param prompt: The input prompt for the model.
+        :param structure: Structure the model responds in.
+        :param field: Name of the list field of ``structure`` whose items are streamed, e.g. ``questions`` of :class:`Questions`.
+        :param on_item: Called with every item of the field, validated as the field's item type.
+        :param image_urls: List of image URLs to be included in the prompt, the model needs to support vision.
+        :param ledger: If provided, the usage of the call is recorded in it.
+        :param stage: Stage of the pipeline the call is recorded under.
+        :param skip_items: Called with the scalar fields of the response written so far (e.g. ``{"satisfied": True}``)
+            before every item, items are not handed to ``on_item`` while it returns True.
+        :param timeout: If set, timeout of every attempt of this call in seconds instead of the model's own.
+        :return: The whole response, its field holds the same items, ``on_item`` was called with the ones not skipped.
+        """
+        started = time.monotonic()
+        item_type = get_args(structure.model_fields[field].annotation)[0]
+
+        cache_key, cached, usage = await self._acache_lookup(prompt, image_urls, structure)
+        if cached is not None:
+            self._record(ledger, stage, usage, started, cached_response=True)
+            parsed = self._parse_content(cached, structure)
+            if skip_items is None or not skip_items(parsed.model_dump(exclude={field})):
+                for item in getattr(parsed, field):
+                    on_item(item)
+            return parsed
+
+        settings = self._build_settings(prompt, image_urls, structure, timeout=timeout)
+        settings["stream"] = True
+        settings["stream_options"] = {"include_usage": True}
+
+        parser = JsonArrayStream(field)
+        usage = None
+        parts = []
+        async with aclosing(await self._acreate(settings)) as stream:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    for item in parser.feed(chunk.choices[0].delta.content):
+                        if skip_items is not None and skip_items(parser.fields):
+                            continue
+                        try:
+                            item = item_type.model_validate(item)
+                        except ValueError:
+                            # An invalid item fails the validation of the whole response below
+                            continue
+                        on_item(item)
+
+        self.usage = usage
+        self._record(ledger, stage, usage, started)
+        content = "".join(parts)
+
+        parsed = self._parse_content(content, structure)
+        await self._acache_store(cache_key, content, usage)
+
+        return parsed
+
+    def usage_record(
+        self, usage: Optional[CompletionUsage], stage: str, latency: float = 0, cached_response: bool = False
+    ) -> UsageRecord:
+        """
+        Turn the usage of a call in to an immutable record.
+        :param usage: Usage reported for the call.
+        :param stage: Stage of the pipeline the call belongs to.
+        :param latency: Duration of the call in seconds.
+        :param cached_response: Whether the response came from the response cache.
+        :return: Usage record.
+        """
+        if usage is None:
+            return UsageRecord(model=self.model_name, stage=stage, latency=latency, cached_response=cached_response)
+
+        return UsageRecord(
+            model=self.model_name,
+            stage=stage,
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+            cached_tokens=self._cached_tokens(usage),
+            latency=latency,
+            cost=self.cost_of(usage),
+            cached_response=cached_response,
+        )
 
+    def _record(
+        self, ledger: Optional[UsageLedger], stage: str, usage: Optional[CompletionUsage], started: float, cached_response: bool = False
+    ):
+        if ledger is not None:
+            ledger.record(self.usage_record(usage, stage, time.monotonic() - started, cached_response))
+
+    def _get_async_clients(self) -> list[AsyncOpenAI]:
+        """
+        Get the shared async clients, one per endpoint, for the running event loop.
+        """
+        return [
+            clients.get_async_client(e.base_url, e.api_key, timeout=self.timeout, max_retries=0) for e in self.endpoints
+        ]
+
+    def _create(self, settings: dict):
+        """
+        Send a chat completion request, retrying failed attempts on the next endpoint after a jittered backoff.
+        Every attempt waits for its turn at the rate limiter of its endpoint, if the endpoint has one.
+        :param settings: Request built by :meth:`_build_settings`, its model name is replaced by the one of the endpoint used.
+        :return: The response, or if streaming was requested a generator of its chunks, see :meth:`_stream`.
+        """
+        tokens = self._estimate_tokens(settings)
+        for attempt in range(self.max_retries + 1):
+            index = attempt % len(self.endpoints)
+            limiter = self._limiter(index)
+            if limiter is not None:
+                limiter.acquire(tokens)
+
+            response = None
+            started = time.monotonic()
+            try:
+                response = self.clients[index].chat.completions.create(**settings, **self._endpoint_settings(index))
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._after_failure(e, attempt, index))
+                continue
+            finally:
+                if limiter is not None and (response is None or not settings.get("stream")):
+                    limiter.release(tokens, self._used_tokens(response))
+
+            if settings.get("stream"):
+                return self._stream(response, limiter, tokens, self.latency, started)
+            self.latency.record(time.monotonic() - started)
+            return response
+
+    async def _acreate_with_retries(self, settings: dict, first_endpoint: int = 0):
+        """
+        Asyncio variant of :meth:`_create`.
+        :param first_endpoint: Index of the endpoint the first attempt is sent to.
+        """
+        clients = self._get_async_clients()
+        tokens = self._estimate_tokens(settings)
+        for attempt in range(self.max_retries + 1):
+            index = (first_endpoint + attempt) % len(self.endpoints)
+            limiter = self._limiter(index)
+            if limiter is not None:
+                await limiter.aacquire(tokens)
+
+            response = None
+            started = time.monotonic()
+            try:
+                response = await clients[index].chat.completions.create(**settings, **self._endpoint_settings(index))
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._after_failure(e, attempt, index))
+                continue
+            finally:
+                if limiter is not None and (response is None or not settings.get("stream")):
+                    limiter.release(tokens, self._used_tokens(response))
+
+            if settings.get("stream"):
+                return self._astream(response, limiter, tokens, self.latency, started)
+            self.latency.record(time.monotonic() - started)
+            return response
+
+    @staticmethod
+    def _stream(
+        stream, limiter: Optional[RateLimiter], tokens: int, latency: LatencyTracker, started: float
+    ) -> Iterator:
+        """
+        Pass the chunks of a stream on, keeping its request counted by the rate limiter until the stream is exhausted
+        or closed. The usage carried by the last chunk corrects the estimated tokens.
+        :param stream: Stream returned by the client.
+        :param limiter: Limiter the request was acquired from, if any.
+        :param tokens: The estimate the request was acquired with.
+        :param latency: Tracker the time until the stream is exhausted is recorded in, a stream closed early is not recorded.
+        :param started: When the request was sent.
+        """
+        usage = None
+        try:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                yield chunk
+            latency.record(time.monotonic() - started)
+        finally:
+            try:
+                stream.close()
+            finally:
+                if limiter is not None:
+                    limiter.release(tokens, usage.total_tokens if usage is not None else None)
+
+    @staticmethod
+    async def _astream(
+        stream, limiter: Optional[RateLimiter], tokens: int, latency: LatencyTracker, started: float
+    ) -> AsyncIterator:
+        """
+        Asyncio variant of :meth:`_stream`.
+        """
+        usage = None
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                yield chunk
+            latency.record(time.monotonic() - started)
+        finally:
+            try:
+                await stream.close()
+            finally:
+                if limiter is not None:
+                    limiter.release(tokens, usage.total_tokens if usage is not None else None)
+
+    def _limiter(self, index: int) -> Optional[RateLimiter]:
+        endpoint = self.endpoints[index]
+        return rate_limiter.get(endpoint.base_url, endpoint.model_name)
+
+    def _after_failure(self, error: Exception, attempt: int, index: int) -> float:
+        """
+        Report a failed attempt and decide how long to wait before the next one.
+        A 429 response pauses the rate limiter of the endpoint for as long as the provider asked for.
+        :return: Seconds to wait.
+        """
+        print(f"Request to {self.endpoints[index].base_url} failed ({type(error).__name__}), retrying")
+        delay = backoff_delay(attempt, self.retry_backoff)
+
+        if isinstance(error, openai.RateLimitError):
+            wait = retry_after(error)
+            limiter = self._limiter(index)
+            if limiter is not None:
+                limiter.rate_limited(wait)
+            # With a single endpoint the next attempt goes to the same provider, so its retry-after is respected
+            if wait is not None and len(self.endpoints) == 1:
+                delay = max(delay, wait)
+
+        return delay
+
+    @staticmethod
+    def _estimate_tokens(settings: dict) -> int:
+        # Roughly 4 characters per token, the limiter is corrected with the real usage once the response arrives
+        characters = 0
+        for message in settings["messages"]:
+            content = message["content"]
+            if isinstance(content, str):
+                characters += len(content)
+            else:
+                characters += sum(len(part.get("text", "")) for part in content)
+        return characters // 4
+
+    @staticmethod
+    def _used_tokens(response) -> Optional[int]:
+        usage = getattr(response, "usage", None)
+        return usage.total_tokens if usage is not None else None
+
+    async def _acreate(self, settings: dict):
+        """
+        Send a chat completion request from the event loop. With hedging enabled, a request that takes longer than the
+        ``hedge_quantile`` of recent latencies is duplicated to the next endpoint and whichever answers first is used.
+        Streams are never hedged, as their tokens are passed on while they arrive.
+        """
+        delay = None
+        if self.hedge_quantile is not None and len(self.endpoints) > 1 and not settings.get("stream"):
+            delay = self.latency.quantile(self.hedge_quantile)
+
+        if delay is None:
+            return await self._acreate_with_retries(settings)
+
+        primary = asyncio.ensure_future(self._acreate_with_retries(settings))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                pending.add(asyncio.ensure_future(self._acreate_with_retries(settings, first_endpoint=1)))
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The losing request is cancelled, as is everything if the caller gets cancelled
+            for task in pending:
+                task.cancel()
+
+    def _endpoint_settings(self, index: int) -> dict:
+        return {"model": self.endpoints[index].model_name}
+
+    def _cache_lookup(
+        self,
+        prompt: str,
+        image_urls: Optional[list[str]] = None,
+        structure: Type[BaseModel] = None,
+    ) -> tuple[Optional[str], Optional[str], Optional[CompletionUsage]]:
+        """
+        Look the request up in the response cache. On a hit the original usage is replayed, so cost accounting stays the same as for the original request.
+        :return: Tuple (cache key, cached content, usage of the original request). The key is None if caching is disabled, the rest is None on a miss.
+        """
+        if self.cache is None:
+            return None, None, None
+
+        cache_key = ResponseCache.key(self.model_name, self.system_prompt, prompt, image_urls, structure)
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            return cache_key, None, None
+
+        content, usage = cached
+        self.usage = CompletionUsage.model_validate_json(usage) if usage else None
+        return cache_key, content, self.usage
+
+    def _cache_store(self, cache_key: Optional[str], content: str, usage: Optional[CompletionUsage]):
+        if cache_key is not None:
+            self.cache.set(cache_key, content, usage.model_dump_json() if usage else None)
+
+    async def _acache_lookup(
+        self,
+        prompt: str,
+        image_urls: Optional[list[str]] = None,
+        structure: Type[BaseModel] = None,
+    ) -> tuple[Optional[str], Optional[str], Optional[CompletionUsage]]:
+        """
+        Asyncio variant of :meth:`_cache_lookup`, the blocking cache is read in the shared storage worker pool.
+        """
+        if self.cache is None:
+            return None, None, None
+        return await worker_pools.get(worker_pools.STORAGE).run(self._cache_lookup, prompt, image_urls, structure)
+
+    async def _acache_store(self, cache_key: Optional[str], content: str, usage: Optional[CompletionUsage]):
+        if cache_key is not None:
+            await worker_pools.get(worker_pools.STORAGE).run(self._cache_store, cache_key, content, usage)
+
+    def _build_settings(
+        self,
+        prompt: str,
+        image_urls: Optional[list[str]] = None,
+        structure: Type[BaseModel] = None,
+        max_tokens: int = None,
+        timeout: float = None,
+    ) -> dict:
+        """
+        Build the chat completion request for the given prompt, images and output structure.
+        :param max_tokens: Limit of the response tokens, unlimited if None.
+        :param timeout: Timeout of every attempt of the request, the one of the client if None.
+        """
         images = []
         if image_urls is not None:
             for url in image_urls:
@@ -73,10 +621,14 @@ class LLModel:
         })
 
         settings = {
-            "model": self.model_name,
             "messages": messages,
         }
 
+        if max_tokens is not None:
+            settings["max_tokens"] = max_tokens
+        if timeout is not None:
+            settings["timeout"] = timeout
+
         if structure is not None:
             schema = structure.model_json_schema()
             schema["additionalProperties"] = False
@@ -90,24 +642,24 @@ class LLModel:
                 },
             }
 
-        response = self.client.chat.completions.create(
-            **settings,
-        )
-
-        self.usage = response.usage
+        return settings
 
+    def _parse_content(self, content: str, structure: Type[BaseModel] = None) -> Union[str, BaseModel]:
+        """
+        Turn the raw message content in to the requested structure, or return it as is if no structure was requested.
+        """
         if structure is not None:
             try:
-                return structure.model_validate_json(response.choices[0].message.content)
+                return structure.model_validate_json(content)
             except:
                 print("Failed to validate structure. Your chosen model most likely doesn't support structured output.")
                 print(f"Model name: {self.model_name} from {self.endpoint}")
-                print(f"Response: {response.choices[0].message.content}")
+                print(f"Response: {content}")
                 raise ValueError(
                     "Failed to validate structure. Your chosen model most likely doesn't support structured output."
                 )
         else:
-            return response.choices[0].message.content
+            return content
 
     def get_last_usage(self) -> Optional[CompletionUsage]:
         """
@@ -119,10 +671,31 @@ class LLModel:
     def get_cost(self) -> float:
         """
         Get the cost of the last usage.
+        Under concurrency the last usage may belong to another call, pass a :class:`UsageLedger` to the calls instead.
         :return: Cost information
         """
-        if self.usage is None:
+        return self.cost_of(self.usage)
+
+    def cost_of(self, usage: Optional[CompletionUsage]) -> float:
+        """
+        Get the cost of the given usage of this model.
+        :param usage: Usage of a call.
+        :return: Cost of the call.
+        """
+        if usage is None:
             return 0
 
-        return (self.usage.prompt_tokens / 1_000_000 ) * self.input_cost + (self.usage.completion_tokens / 1_000_000 ) * self.output_cost
+        # Input read from the provider's prompt cache is billed at a discount
+        cached_tokens = self._cached_tokens(usage)
+
+        return (
+            ((usage.prompt_tokens - cached_tokens) / 1_000_000) * self.input_cost
+            + (cached_tokens / 1_000_000) * self.cached_input_cost
+            + (usage.completion_tokens / 1_000_000) * self.output_cost
+        )
 
+    @staticmethod
+    def _cached_tokens(usage: CompletionUsage) -> int:
+        if usage.prompt_tokens_details is None:
+            return 0
+        return usage.prompt_tokens_details.cached_tokens or 0
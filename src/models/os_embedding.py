@@ -1,10 +1,13 @@
+import time
 from typing import Union, List
 
 import numpy as np
 import tiktoken
 
 from .embedding_model import EmbeddingModel
-from openai import OpenAI
+from .usage import UsageLedger, UsageRecord
+from openai import OpenAI, AsyncOpenAI
+from . import clients
 
 
 class OAEmbedding(EmbeddingModel):
@@ -34,7 +37,15 @@ class OAEmbedding(EmbeddingModel):
         self.l_dimension = dimension
         self.l_max_tokens = max_tokens
 
-        self.client = OpenAI(base_url=endpoint, api_key=api_key, *args, **kwargs)
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self._client_args = (args, kwargs)
+        # Timeout and retries are applied to a copy of the shared client, other custom client options can not be shared
+        self._shared_client = not args and set(kwargs) <= {"timeout", "max_retries"}
+        if self._shared_client:
+            self.client = clients.get_client(endpoint, api_key, **kwargs)
+        else:
+            self.client = OpenAI(base_url=endpoint, api_key=api_key, *args, **kwargs)
 
     def embed(self, data: List[str], instruction: str = None) -> List[np.array]:
         """
@@ -52,6 +63,40 @@ class OAEmbedding(EmbeddingModel):
 
         return [np.array(d.embedding) for d in response.data]
 
+    async def aembed(
+        self, data: List[str], instruction: str = None, ledger: UsageLedger = None, stage: str = "embedding"
+    ) -> List[np.array]:
+        """
+        Asyncio variant of :meth:`embed`.
+        :param data:
+        :param instruction:
+        :param ledger: If provided, the usage of the call is recorded in it.
+        :param stage: Stage of the pipeline the call is recorded under.
+        :return:
+        """
+
+        if not self._shared_client:
+            # Clients with custom options are not shared, these embed in a worker thread
+            return await super().aembed(data, instruction, ledger, stage)
+
+        if instruction:
+            data = [self.apply_prompt(instruction, d) for d in data]
+
+        started = time.monotonic()
+        response = await self._get_async_client().embeddings.create(model=self.model_name, input=data)
+        if ledger is not None:
+            ledger.record(UsageRecord(
+                model=self.model_name,
+                stage=stage,
+                prompt_tokens=response.usage.prompt_tokens if response.usage else 0,
+                latency=time.monotonic() - started,
+            ))
+
+        return [np.array(d.embedding) for d in response.data]
+
+    def _get_async_client(self) -> AsyncOpenAI:
+        return clients.get_async_client(self.endpoint, self.api_key, **self._client_args[1])
+
     def tokenize(self, data: str) -> list[int]:
         """
         Tokenize a list of strings into a list of tokens.
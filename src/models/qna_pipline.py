@@ -1,15 +1,38 @@
 from dataclasses import dataclass, field
-from typing import List
+from typing import List, Callable, Optional
+import asyncio
 import copy
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import inspect
+import time
 
-from src.models import EmbeddingModel
+from src.models import EmbeddingModel, worker_pools
 from src.models.agents import Agents
+from src.models.question_memo import QuestionMemo
+from src.models.request_context import RequestContext
+from src.models.research_context import ResearchContext
+from src.models.retrieval import maximal_marginal_relevance, claim, claim_windows
+from src.models.structured_output.draft_review import DraftReview
+from src.models.structured_output.fast_answer import FastAnswer
 from src.models.structured_output.questions import Questions
 from src.models.structured_output.terms import Terms
+from src.models.usage import UsageLedger, UsageRecord
+from src.vectordb.answer_cache_storage import AnswerCacheStorage
 from src.vectordb.vector import Vector
 from src.vectordb.vector_storage import VectorStorage
 
+CACHE_EMBED_PROMPT = "Given a user question, retrieve previously asked questions that ask for the same information."
+# Passages retrieved for the fast path when speculative retrieval is disabled
+FAST_PATH_PASSAGES = 5
+# Time and output tokens reserved for the final answer until the main model has enough latency samples. Requests
+# with less time get the share of it instead, so short time limits still leave time for research.
+FINAL_ANSWER_SECONDS = 10
+FINAL_ANSWER_SHARE = 0.3
+FINAL_ANSWER_TOKENS = 1000
+DRAFT_REVIEW_PROMPT = """
+You review a draft answer to a user query against findings researched after the draft was written.
+Decide whether the draft has to be rewritten to include or correct anything in the findings. Judge only the content, not the wording.
+""".strip()
+
 
 @dataclass
 class QAPipelineResult:
@@ -25,30 +48,177 @@ class QAPipelineResult:
     iterations: int = field(default_factory=int)
     cost: float = field(default_factory=float)
     final_answer: str = ""
+    cached: bool = False
+    usage: UsageLedger = field(default_factory=UsageLedger)
+    # "deadline" or "cost" if the research was cut short to stay within the limits of the request
+    stop_reason: str = ""
+
+    def to_dict(self) -> dict:
+        """
+        Convert the result in to a JSON serializable dictionary. Embeddings of the used context are left out.
+        """
+        return {
+            "terms": self.terms,
+            "satisfactions": [s.model_dump() for s in self.satisfactions],
+            "questions": self.questions,
+            "used_context": [
+                {
+                    "id": c.id,
+                    "file_name": c.file_name,
+                    "file_position": c.file_position,
+                    "content": c.content,
+                    "metadata": c.metadata,
+                } for c in self.used_context
+            ],
+            "iterations": self.iterations,
+            "cost": self.cost,
+            "final_answer": self.final_answer,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "QAPipelineResult":
+        """
+        Create a result from a dictionary created by :meth:`to_dict`.
+        """
+        return cls(
+            terms=data["terms"],
+            satisfactions=[Questions.model_validate(s) for s in data["satisfactions"]],
+            questions=data["questions"],
+            used_context=[Vector(vector=None, **c) for c in data["used_context"]],
+            iterations=data["iterations"],
+            cost=data["cost"],
+            final_answer=data["final_answer"],
+        )
 
 
-def process_question(q, embed_prompt, embedding_model, vector_storage, researcher_model):
+async def retrieve_text(text, embed_prompt, embedding_model, vector_storage, n=10, mmr_lambda=None, ledger=None, stage="retrieval"):
 
     """
-    Process a single question by embedding it, querying the vector storage, and generating a response using the researcher model.
-    :param q:
+    Embed a text and retrieve the passages relevant to it.
+    :param text:
     :param embed_prompt:
     :param embedding_model:
-    :param vector_storage:
+    :param vector_storage: Either :class:`VectorStorage` or :class:`AsyncVectorStorage`.
+    :param n: Number of passages to retrieve.
+    :param mmr_lambda: If set, 3 * n candidates are retrieved and n of them are picked with maximal marginal relevance using this lambda.
+    :param ledger: If provided, usage of the embedding and storage calls is recorded in it.
+    :param stage: Stage the calls are recorded under, the embedding is recorded as ``<stage>_embedding``.
+    :return: Ranked list of retrieved passages.
+    """
+
+    vec = (await embedding_model.aembed_query(
+        text, instruction=embed_prompt, ledger=ledger, stage=f"{stage}_embedding"
+    )).tolist()
+
+    return await retrieve_vector(vec, vector_storage, n, mmr_lambda, ledger, stage)
+
+
+async def retrieve_vector(vec, vector_storage, n=10, mmr_lambda=None, ledger=None, stage="retrieval"):
+
+    """
+    Retrieve the passages relevant to an already embedded text, see :func:`retrieve_text`.
+    :param vec: Embedding of the text.
+    :return: Ranked list of retrieved passages.
+    """
+
+    if mmr_lambda is None:
+        return await _call_storage(vector_storage.query, vec, n=n, ledger=ledger, stage=stage)
+
+    candidates = await _call_storage(vector_storage.query, vec, n=3 * n, ledger=ledger, stage=stage)
+    return maximal_marginal_relevance(vec, candidates, k=n, lambda_mult=mmr_lambda)
+
+
+async def retrieve_question(q, embed_prompt, embedding_model, vector_storage, n=10, mmr_lambda=None, ledger=None):
+
+    """
+    Embed a single question and retrieve the passages relevant to it, see :func:`retrieve_text`.
+    :param q:
+    :return: Ranked list of retrieved passages.
+    """
+
+    return await retrieve_text(
+        q.question_text + " " + " ".join(q.keywords), embed_prompt, embedding_model, vector_storage, n, mmr_lambda, ledger
+    )
+
+
+async def embed_question(q, embed_prompt, embedding_model, ledger=None):
+
+    """
+    Embed a single question the way :func:`retrieve_question` does.
+    Questions embedded at the same time, like the questions of one iteration, are sent to the model in one batch.
+    :param q:
+    :return: Embedding of the question.
+    """
+
+    return (await embedding_model.aembed_query(
+        q.question_text + " " + " ".join(q.keywords), instruction=embed_prompt, ledger=ledger, stage="retrieval_embedding"
+    )).tolist()
+
+
+async def format_passages(docs, vector_storage, context_window=0, ledger=None, claimed=None):
+
+    """
+    Turn retrieved passages in to the context text shown to a model, grouped by their source file.
+    :param docs: Retrieved passages, ordered by relevance.
+    :param vector_storage: Either :class:`VectorStorage` or :class:`AsyncVectorStorage`.
+    :param context_window: Number of neighbouring chunks on each side of a hit to include with it, 0 disables the expansion.
+    :param ledger: If provided, usage of the storage calls is recorded in it.
+    :param claimed: If provided, neighbouring chunks already used by other questions are left out, see :func:`claim_windows`.
+    :return: Tuple (passages including the neighbouring chunks, context text).
+    """
+
+    if context_window > 0:
+        windows = await _call_storage(
+            vector_storage.get_neighbours, [d.id for d in docs], k=context_window, ledger=ledger, stage="context_expansion"
+        )
+        if claimed is not None:
+            windows = claim_windows(windows, docs, claimed)
+        docs = [d for window in windows for d in window]
+        ctx = "\n".join("source:" + w[0].file_name + "\n" + "\n".join(d.content for d in w) for w in windows)
+    else:
+        ctx = "\n".join("source:" + d.file_name + "\n" + d.content for d in docs)
+
+    return docs, ctx
+
+
+async def process_question(q, docs, vector_storage, researcher_model, context_window=0, ledger=None, claimed=None, timeout=None):
+
+    """
+    Answer a single question from the passages retrieved for it using the researcher model.
+    :param q:
+    :param docs: Passages retrieved for the question.
+    :param vector_storage: Either :class:`VectorStorage` or :class:`AsyncVectorStorage`.
     :param researcher_model:
+    :param context_window: Number of neighbouring chunks on each side of a hit to include with it, 0 disables the expansion.
+    :param ledger: If provided, usage of the model and storage calls is recorded in it.
+    :param claimed: If provided, neighbouring chunks already used by other questions are left out, see :func:`format_passages`.
+    :param timeout: Timeout of the researcher model call in seconds, the model's own if None.
     :return:
     """
 
-    vec = embedding_model.embed([
-        q.question_text + " " + " ".join(q.keywords)
-    ], instruction=embed_prompt)[0].tolist()
-    docs = vector_storage.query(vec, n=10)
-    ctx = "\n".join("source:" + d.file_name + "\n" + d.content for d in docs)
-    ans = researcher_model.generate_response(
-        prompt=f"**Context:**\n{ctx}\n\nResearched Question: {q}"
-    ).strip()
-    cost = researcher_model.get_cost()
-    return q.question_text, ans, docs, cost
+    docs, ctx = await format_passages(docs, vector_storage, context_window, ledger, claimed)
+
+    ans = (await researcher_model.agenerate_response(
+        prompt=f"**Context:**\n{ctx}\n\nResearched Question: {q}", ledger=ledger, stage="research", timeout=timeout
+    )).strip()
+    return q.question_text, ans, docs
+
+
+async def _call_storage(method, *args, ledger: UsageLedger = None, stage: str = "storage", **kwargs):
+    """
+    Call a storage method that is either a coroutine (async storages) or blocking (psycopg2 storages, run in the shared storage worker pool).
+    If a ledger is provided, the latency of the call is recorded in it under the table name of the storage.
+    """
+    started = time.monotonic()
+    if inspect.iscoroutinefunction(method):
+        result = await method(*args, **kwargs)
+    else:
+        result = await worker_pools.get(worker_pools.STORAGE).run(method, *args, **kwargs)
+
+    if ledger is not None:
+        model = getattr(method.__self__, "table_name", type(method.__self__).__name__)
+        ledger.record(UsageRecord(model=model, stage=stage, latency=time.monotonic() - started))
+    return result
 
 
 class QAPipeline:
@@ -62,6 +232,18 @@ class QAPipeline:
         vector_storage: VectorStorage,
         global_prompt: str = "",
         max_iterations: int = 5,
+        context_window: int = 0,
+        mmr_lambda: float = None,
+        answer_cache: AnswerCacheStorage = None,
+        answer_cache_similarity: float = 0.95,
+        max_concurrency: int = 16,
+        speculative_retrieval: int = 0,
+        fast_path_similarity: float = None,
+        draft_confidence: float = None,
+        question_memo: QuestionMemo = None,
+        question_similarity: float = 0.95,
+        time_limit: float = None,
+        cost_limit: float = None,
     ):
         """
         Initialize the QAPipeline with agents, embedding model, vector storage, and optional global prompt.
@@ -70,82 +252,492 @@ class QAPipeline:
         :param vector_storage: Vector storage to be used for retrieving relevant passages.
         :param global_prompt:  Global context to be used in the pipeline.
         :param max_iterations:  Maximum number of iterations for the pipeline to run.
+        :param context_window: Number of neighbouring chunks on each side of every search hit that is passed to the researcher with it.
+        :param mmr_lambda: If set, search results are diversified with maximal marginal relevance, 1 favours relevance and 0 diversity.
+        :param answer_cache: If set, queries similar to an already answered one are answered with the cached result.
+        :param answer_cache_similarity: Minimal cosine similarity between two queries for the cached result to be used.
+        :param max_concurrency: Maximum number of questions of one iteration researched at the same time.
+        :param speculative_retrieval: Number of passages retrieved for the raw user query before the first researcher call, 0 disables it.
+        :param fast_path_similarity: If set, the main model first answers straight from the passages retrieved for the raw user query when the best of them
+            has at least this cosine similarity to it. The query is only researched iteratively if the similarity is lower or the model reports the passages as insufficient.
+        :param draft_confidence: If set, once the main researcher's confidence reaches this value the main model drafts the final answer while one more
+            iteration is researched. The draft is returned unless the query researcher model finds that the iteration changed something material.
+        :param question_memo: If set, researched questions are remembered in it across queries and a question researched before is answered from it.
+            It is cleared whenever the stored data changes.
+        :param question_similarity: Minimal cosine similarity of two questions for one to be answered with the research of the other within a query,
+            and for the later one to be dropped if both are asked in the same iteration.
+        :param time_limit: Default time limit of a query in seconds, for requests without their own deadline. Unlimited if None.
+        :param cost_limit: Default cost ceiling of a query, for requests without their own. Unlimited if None.
         """
         self.agents = agents
         self.embedding_model = embedding_model
         self.vector_storage = vector_storage
         self.global_prompt = global_prompt
         self.max_iterations = max_iterations
+        self.context_window = context_window
+        self.mmr_lambda = mmr_lambda
+        self.answer_cache = answer_cache
+        self.answer_cache_similarity = answer_cache_similarity
+        self.max_concurrency = max_concurrency
+        self.speculative_retrieval = speculative_retrieval
+        self.fast_path_similarity = fast_path_similarity
+        self.draft_confidence = draft_confidence
+        self.question_memo = question_memo
+        self.question_similarity = question_similarity
+        self.time_limit = time_limit
+        self.cost_limit = cost_limit
 
-    def run(self, user_query: str) -> QAPipelineResult:
+    def run(
+        self, user_query: str, on_token: Callable[[str], None] = None, request: RequestContext = None
+    ) -> QAPipelineResult:
 
         """
         Executes the full question-answering pipeline, returning the final answer and any relevant information.
+        Blocking wrapper around :meth:`arun` for code that does not run an event loop.
         :param user_query:
+        :param on_token: If provided, the final answer is streamed and this is called with every part of it as soon as the model produces it.
+        :param request: State of this query, see :meth:`arun`.
         :return:
         """
+        return asyncio.run(self.arun(user_query, on_token, request))
 
-        final_result = QAPipelineResult()
+    async def arun(
+        self, user_query: str, on_token: Callable[[str], None] = None, request: RequestContext = None
+    ) -> QAPipelineResult:
+
+        """
+        Executes the full question-answering pipeline inside the running event loop, see :meth:`run`.
+        Questions of one iteration are researched concurrently, at most ``max_concurrency`` of them at a time, each starting as soon as the
+        main researcher finished writing it.
+        With ``draft_confidence`` set, a final answer drafted during the last iteration is streamed to ``on_token`` in one part once it is accepted.
+
+        The pipeline itself is never modified, so one instance can answer any number of queries at once.
+        :param user_query:
+        :param on_token: If provided, the final answer is streamed and this is called with every part of it as soon as the model produces it.
+            Shorthand for ``RequestContext.on_token``, which takes precedence.
+        :param request: State of this query: usage ledger, iteration limit, deadline, cost ceiling, cancellation and the storage to retrieve from. A new one is created if not provided.
+            Research stops once the time or money left is only enough for the final answer, research still running at that
+            point is cancelled, and the final answer is written from what was gathered so far. The final answer gets at least
+            the time reserved for it, with a cost ceiling it is cut at the tokens the rest of the budget pays for.
+        :raises RequestCancelled: If the request gets cancelled.
+        :return:
+        """
+
+        if request is None:
+            request = RequestContext()
+        if request.deadline is None and self.time_limit is not None:
+            request.deadline = time.monotonic() + self.time_limit
+        if request.max_cost is None:
+            request.max_cost = self.cost_limit
+        on_token = request.on_token or on_token
+        max_iterations = request.max_iterations if request.max_iterations is not None else self.max_iterations
+
+        # Every call made for this query records its usage here, the cost of the query is their sum
+        ledger = request.ledger
 
         EMBED_PROMPT = "Given user query and keywords, retrieve relevant passages that best answer asked question."
-        qgen_prompt = ""
+        vector_storage = request.vector_storage or self.vector_storage  # assumed read-only
 
-        if self.global_prompt:
-            qgen_prompt += "Global Context: " + self.global_prompt + "\n\n"
+        # The raw query is searched right away, while the answer cache is checked, so the first researcher call already
+        # sees the most relevant passages instead of always asking for a search first. The fast path needs them as well.
+        speculative = None
+        passages = self.speculative_retrieval or (FAST_PATH_PASSAGES if self.fast_path_similarity is not None else 0)
+        if passages > 0:
+            speculative = asyncio.ensure_future(retrieve_text(
+                user_query,
+                EMBED_PROMPT,
+                self.embedding_model,
+                vector_storage,
+                n=passages,
+                mmr_lambda=self.mmr_lambda,
+                ledger=ledger,
+                stage="speculative_retrieval",
+            ))
 
-        for _ in range(self.max_iterations):
-            questions_struct: Questions = self.agents.main_researcher_model.generate_response(
-                prompt=qgen_prompt + f"'\noriginal_user_question': {user_query}", structure=Questions
+        try:
+            query_vector, cached = await self._within_research_time(
+                self._lookup_answer_cache(user_query, ledger), request, (None, None)
             )
+        except BaseException:
+            if speculative is not None:
+                speculative.cancel()
+            raise
+
+        if cached is not None:
+            if speculative is not None:
+                speculative.cancel()
+            final_result = QAPipelineResult.from_dict(cached)
+            final_result.cached = True
+            final_result.cost = ledger.total_cost()
+            final_result.usage = ledger
+            if on_token is not None:
+                on_token(final_result.final_answer)
+            return final_result
 
-            final_result.cost += self.agents.main_researcher_model.get_cost()
-            final_result.satisfactions.append(questions_struct)
+        final_result = QAPipelineResult(usage=ledger)
+        used = set()
 
-            if questions_struct.satisfied:
+        def use(docs: List[Vector]):
+            # Chunks stored once for several files are used once per file, so every file they come from is listed
+            for doc in docs:
+                if (doc.id, doc.file_name, doc.file_position) not in used:
+                    used.add((doc.id, doc.file_name, doc.file_position))
+                    final_result.used_context.append(doc)
+
+        # The context is sent to both the main researcher and the main model, so it has to fit the smaller budget
+        budgets = [m.context_budget for m in (self.agents.main_researcher_model, self.agents.main_model) if m.context_budget]
+        context = ResearchContext(
+            global_prompt=self.global_prompt,
+            token_budget=min(budgets) if budgets else None,
+            summarizer=self.agents.query_researcher_model,
+        )
+
+        if speculative is not None:
+            async def speculative_passages():
+                found = await speculative
+                return (found, *await format_passages(found, vector_storage, self.context_window, ledger))
+
+            hits, docs, ctx = await self._within_research_time(speculative_passages(), request, ([], [], ""))
+            if ctx:
+                context.add_passages(ctx)
+            use(docs)
+
+            # Simple queries whose answer is right in the best passages are answered with a single call. Otherwise the
+            # passages stay in the context and the research starts from them.
+            similarity = max((1 - d.distance for d in hits if d.distance is not None), default=0)
+            if self.fast_path_similarity is not None and similarity >= self.fast_path_similarity:
+                request.check()
+                fast_answer: Optional[FastAnswer] = await self._within_research_time(
+                    self.agents.main_model.agenerate_response(
+                        prompt=context.render(f"User Query: {user_query}"),
+                        structure=FastAnswer,
+                        ledger=ledger,
+                        stage="fast_path",
+                        timeout=self._call_timeout(request),
+                    ),
+                    request,
+                )
+                if fast_answer is not None and fast_answer.sufficient and fast_answer.answer.strip():
+                    final_result.final_answer = fast_answer.answer.strip()
+                    if on_token is not None:
+                        on_token(final_result.final_answer)
+                    final_result.cost = ledger.total_cost()
+                    await self._save_answer(user_query, query_vector, final_result)
+                    return final_result
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def bounded(coroutine):
+            async with semaphore:
+                return await coroutine
+
+        # Questions researched for this query, and across queries if a shared memo is set
+        memos = [QuestionMemo(self.question_similarity)]
+        if self.question_memo is not None:
+            if self.question_memo.version_due():
+                self.question_memo.check_version(
+                    await _call_storage(vector_storage.data_version, ledger=ledger, stage="question_memo")
+                )
+            memos.append(self.question_memo)
+
+        draft = None
+        research_cost = ledger.total_cost()
+        for _ in range(max_iterations):
+            request.check()
+            # Another iteration is expected to cost about as much as the previous ones did on average
+            iteration_cost = (ledger.total_cost() - research_cost) / final_result.iterations if final_result.iterations else 0
+            final_result.stop_reason = self._stop_reason(request, context, iteration_cost)
+            if final_result.stop_reason:
                 break
 
-            final_result.iterations += 1
-
-            embedding_model_copy = copy.copy(self.embedding_model)
-            researcher_model_copy = copy.copy(self.agents.query_researcher_model)
-            vector_storage = self.vector_storage  # assumed read-only
-
-            question_answers = {}
-            with ThreadPoolExecutor() as executor:
-                futures = [
-                    executor.submit(
-                        process_question,
-                        q,
-                        EMBED_PROMPT,
-                        embedding_model_copy,
-                        vector_storage,
-                        researcher_model_copy
+            claimed = set()
+            asked = QuestionMemo(self.question_similarity)
+            # Dropped questions keyed by their text, with the text of the question of this iteration they repeat
+            duplicates = {}
+
+            async def research(q):
+                # A question repeating another one of this iteration is dropped, a question researched before reuses that research
+                if (entry := asked.lookup(q.question_text)) is not None:
+                    duplicates[q.question_text] = entry.question
+                    return None
+                asked.save(q.question_text)
+                for memo in memos:
+                    if (entry := memo.lookup(q.question_text)) is not None:
+                        return q.question_text, entry.answer, entry.docs
+
+                vec = await embed_question(q, EMBED_PROMPT, self.embedding_model, ledger)
+                if (entry := asked.lookup(vector=vec)) is not None:
+                    duplicates[q.question_text] = entry.question
+                    return None
+                asked.save(q.question_text, vec)
+                for memo in memos:
+                    if (entry := memo.lookup(q.question_text, vec)) is not None:
+                        return q.question_text, entry.answer, entry.docs
+
+                docs = await retrieve_vector(vec, vector_storage, mmr_lambda=self.mmr_lambda, ledger=ledger)
+                # Questions of one iteration tend to retrieve the same passages, each is only sent to the first question that retrieved it
+                q_text, ans, docs = await process_question(
+                    q,
+                    claim(docs, claimed),
+                    vector_storage,
+                    self.agents.query_researcher_model,
+                    self.context_window,
+                    ledger,
+                    claimed,
+                    self._call_timeout(request),
+                )
+                for memo in memos:
+                    memo.save(q_text, vec, ans, docs)
+                return q_text, ans, docs
+
+            # Every question is researched as soon as the main researcher finished writing it, not after its whole response
+            research_tasks = []
+            try:
+                try:
+                    questions_struct: Questions = await asyncio.wait_for(
+                        self.agents.main_researcher_model.astream_structured(
+                            prompt=context.render(f"'original_user_question': {user_query}"),
+                            structure=Questions,
+                            field="questions",
+                            on_item=lambda q: research_tasks.append(asyncio.ensure_future(bounded(research(q)))),
+                            ledger=ledger,
+                            stage="question_generation",
+                            # 'satisfied' is written before the questions, those of a satisfied response are never researched
+                            skip_items=lambda fields: fields.get("satisfied") is True,
+                            timeout=self._call_timeout(request),
+                        ),
+                        self._research_time(request),
                     )
-                    for q in questions_struct.questions
-                ]
+                except asyncio.TimeoutError:
+                    final_result.stop_reason = "deadline"
+                    break
+
+                final_result.satisfactions.append(questions_struct)
 
-                for future in as_completed(futures):
-                    q_text, ans, docs, cost = future.result()
+                if questions_struct.satisfied:
+                    break
+
+                final_result.iterations += 1
+                request.check()
+
+                # Close enough to done: the final answer is drafted from the research so far while this last iteration runs
+                if (
+                    self.draft_confidence is not None
+                    and questions_struct.confidence is not None
+                    and questions_struct.confidence >= self.draft_confidence
+                ):
+                    draft = asyncio.ensure_future(self.agents.main_model.agenerate_response(
+                        prompt=context.render(f"User Query: {user_query}"),
+                        ledger=ledger,
+                        stage="draft_answer",
+                        timeout=self._call_timeout(request),
+                    ))
+
+                # Questions not researched by the deadline are given up, the finished ones are kept
+                if research_tasks:
+                    _, pending = await asyncio.wait(research_tasks, timeout=self._research_time(request))
+                    if pending:
+                        final_result.stop_reason = "deadline"
+                answers = [task.result() for task in research_tasks if task.done() and not task.cancelled()]
+
+                question_answers = {}
+                for q_text, ans, docs in filter(None, answers):
                     question_answers[q_text] = ans
                     final_result.questions[q_text] = ans
-                    final_result.used_context.extend(docs)
-                    final_result.cost += cost
 
-            qgen_prompt += "\n\n".join(f"---\nQuestion: {q}\nAnswer: {a}\n---" for q, a in question_answers.items())
+                    use(docs)
+
+                # Every asked question gets an answer in the result, a dropped one shares the answer of the question it repeats
+                for duplicate, original in duplicates.items():
+                    final_result.questions[duplicate] = final_result.questions.get(original, "")
+                # Questions given up at the deadline are left without an answer
+                for q in questions_struct.questions:
+                    final_result.questions.setdefault(q.question_text, "")
+
+                context.add_iteration(question_answers)
+                await context.compact(ledger, self._research_time(request))
+            except BaseException:
+                if draft is not None:
+                    draft.cancel()
+                raise
+            finally:
+                # Research of questions that turned out not to be needed, finished tasks are not affected
+                for task in research_tasks:
+                    task.cancel()
+
+            if draft is not None or final_result.stop_reason:
+                break
 
-        final_context = f"{qgen_prompt}\n\nUser Query: {user_query}"
-        final_answer = self.agents.main_model.generate_response(prompt=final_context).strip()
+        final_answer = None
+        if draft is not None:
+            try:
+                request.check()
+                draft_answer = (await draft).strip()
+            except BaseException:
+                draft.cancel()
+                raise
+            # Without time left to review the draft it is kept, it was written from almost all of the research
+            if draft_answer and not await self._within_research_time(
+                self._changes_draft(user_query, draft_answer, question_answers, ledger, self._call_timeout(request)), request, False
+            ):
+                final_answer = draft_answer
+                if on_token is not None:
+                    on_token(final_answer)
 
-        final_result.cost += self.agents.main_model.get_cost()
+        if final_answer is None:
+            request.check()
+            final_context = context.render(f"User Query: {user_query}")
+            # The answer may use what is left of the cost ceiling, and the time left but at least the time reserved for it
+            limits = {
+                "max_tokens": self._final_answer_tokens(request, context, final_context),
+                "timeout": self._call_timeout(request),
+            }
+            if on_token is None:
+                final_answer = (await self.agents.main_model.agenerate_response(
+                    prompt=final_context, ledger=ledger, stage="final_answer", **limits
+                )).strip()
+            else:
+                parts = []
+                async for delta in self.agents.main_model.astream_response(
+                    prompt=final_context, ledger=ledger, stage="final_answer", **limits
+                ):
+                    on_token(delta)
+                    parts.append(delta)
+                final_answer = "".join(parts).strip()
+
+        final_result.cost = ledger.total_cost()
         final_result.final_answer = final_answer
 
+        await self._save_answer(user_query, query_vector, final_result)
         return final_result
 
-    def __copy__(self):
-        return QAPipeline(
-            agents=copy.copy(self.agents),
-            embedding_model=copy.copy(self.embedding_model),
-            vector_storage=self.vector_storage,
-            global_prompt=self.global_prompt,
-            max_iterations=self.max_iterations,
+    async def _changes_draft(
+        self, user_query: str, draft_answer: str, question_answers: dict[str, str], ledger: UsageLedger, timeout: float = None
+    ) -> bool:
+        """
+        Ask the query researcher model whether research done after the draft was written changes the answer.
+        :param question_answers: Answers of the iteration researched while the draft was written, keyed by the question text.
+        :param timeout: Timeout of the review call in seconds, the model's own if None.
+        :return: True if the draft has to be regenerated.
+        """
+        if not question_answers:
+            return False
+
+        reviewer = copy.copy(self.agents.query_researcher_model)
+        reviewer.system_prompt = DRAFT_REVIEW_PROMPT
+        findings = "\n\n".join(f"Question: {q}\nAnswer: {a}" for q, a in question_answers.items())
+        review: DraftReview = await reviewer.agenerate_response(
+            prompt=f"User Query: {user_query}\n\nDraft Answer:\n{draft_answer}\n\nNew Findings:\n{findings}",
+            structure=DraftReview,
+            ledger=ledger,
+            stage="draft_review",
+            timeout=timeout,
+        )
+        return review.material
+
+    def _final_answer_time(self, request: RequestContext) -> float:
+        """
+        :return: Seconds reserved for writing the final answer, the 90th percentile latency of the main model once it is known.
+        """
+        known = self.agents.main_model.latency.quantile(0.9)
+        if known is not None:
+            return known
+
+        time_limit = request.time_limit()
+        if time_limit is None:
+            return FINAL_ANSWER_SECONDS
+        return min(FINAL_ANSWER_SECONDS, FINAL_ANSWER_SHARE * time_limit)
+
+    def _final_answer_cost(self, context: ResearchContext) -> float:
+        """
+        :return: Estimated cost of writing the final answer from the given context.
+        """
+        main_model = self.agents.main_model
+        return (context.tokens() * main_model.input_cost + FINAL_ANSWER_TOKENS * main_model.output_cost) / 1_000_000
+
+    def _final_answer_tokens(self, request: RequestContext, context: ResearchContext, prompt: str) -> Optional[int]:
+        """
+        :param prompt: Prompt of the final answer.
+        :return: Most tokens the final answer can have without going over the cost ceiling, None if there is no ceiling.
+        """
+        main_model = self.agents.main_model
+        remaining_cost = request.remaining_cost()
+        if remaining_cost is None or not main_model.output_cost:
+            return None
+
+        input_cost = context.count((main_model.system_prompt or "") + prompt) * main_model.input_cost / 1_000_000
+        return max(1, int((remaining_cost - input_cost) * 1_000_000 / main_model.output_cost))
+
+    def _call_timeout(self, request: RequestContext) -> Optional[float]:
+        """
+        :return: Timeout of a model call started now: the time left until the deadline, but at least the time reserved
+            for the final answer. None if the request has no deadline.
+        """
+        remaining = request.remaining()
+        if remaining is None:
+            return None
+        return max(remaining, self._final_answer_time(request))
+
+    def _research_time(self, request: RequestContext) -> Optional[float]:
+        """
+        :return: Seconds left for research before the final answer has to be started, None if the request has no deadline.
+        """
+        remaining = request.remaining()
+        if remaining is None:
+            return None
+        return max(0.0, remaining - self._final_answer_time(request))
+
+    async def _within_research_time(self, awaitable, request: RequestContext, default=None):
+        """
+        Await a step of the research, giving up on it once only the time reserved for the final answer is left.
+        :return: Result of the step, ``default`` if it ran out of time.
+        """
+        try:
+            return await asyncio.wait_for(awaitable, self._research_time(request))
+        except asyncio.TimeoutError:
+            return default
+
+    def _stop_reason(self, request: RequestContext, context: ResearchContext, iteration_cost: float) -> str:
+        """
+        Decide whether there is enough time and money left for another iteration and the final answer.
+        :param iteration_cost: Expected cost of the next iteration.
+        :return: "deadline" or "cost" if research has to stop, an empty string otherwise.
+        """
+        research_time = self._research_time(request)
+        if research_time is not None and research_time <= 0:
+            return "deadline"
+
+        remaining_cost = request.remaining_cost()
+        if remaining_cost is not None and remaining_cost <= iteration_cost + self._final_answer_cost(context):
+            return "cost"
+
+        return ""
+
+    async def _save_answer(self, user_query: str, query_vector: Optional[list[float]], final_result: QAPipelineResult):
+        # Answers cut short by the limits of one request are not worth reusing for others
+        if self.answer_cache is None or query_vector is None:
+            return
+        if final_result.final_answer and not final_result.stop_reason:
+            await worker_pools.get(worker_pools.STORAGE).run(
+                self.answer_cache.save,
+                user_query,
+                query_vector,
+                final_result.to_dict(),
+                [c.file_name for c in final_result.used_context],
+            )
+
+    async def _lookup_answer_cache(self, user_query: str, ledger: UsageLedger) -> tuple[Optional[list[float]], Optional[dict]]:
+        """
+        Look for an already answered query similar to this one.
+        :return: Tuple (embedding of the query, cached result). Both are None if there is no answer cache, the result is None on a miss.
+        """
+        if self.answer_cache is None:
+            return None, None
+
+        query_vector = (await self.embedding_model.aembed_query(
+            user_query, instruction=CACHE_EMBED_PROMPT, ledger=ledger, stage="answer_cache"
+        )).tolist()
+        cached = await _call_storage(
+            self.answer_cache.lookup, query_vector, self.answer_cache_similarity, ledger=ledger, stage="answer_cache"
         )
+        return query_vector, cached
@@ -0,0 +1,147 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+from src.vectordb.vector import Vector
+
+
+def normalize_question(text: str) -> str:
+    """
+    Normalize a question so trivially different phrasings (case, punctuation, spacing) share a key.
+    """
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+@dataclass
+class MemoEntry:
+    """
+    A researched question with its answer and the passages it was answered from.
+    """
+
+    question: str
+    answer: Optional[str]
+    docs: List[Vector] = field(default_factory=list)
+    vector: Optional[np.ndarray] = None
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class QuestionMemo:
+    """
+    Remembers researched questions, so a question asked again, literally or in other words, reuses the earlier answer
+    instead of repeating its embedding, retrieval and researcher calls.
+
+    Questions are found by their normalized text, or by the cosine similarity of their embedding to the embeddings of
+    all remembered questions, computed in one matrix product. Safe to share between threads and requests.
+    """
+
+    def __init__(
+        self,
+        min_similarity: float = 0.95,
+        ttl: float = None,
+        max_entries: int = None,
+        version_check_interval: float = 60,
+    ):
+        """
+        :param min_similarity: Minimal cosine similarity of two question embeddings for them to count as the same question.
+        :param ttl: Seconds an answer is reused for, forever if None.
+        :param max_entries: Maximum number of remembered questions, the oldest ones are forgotten first. Unlimited if None.
+        :param version_check_interval: Seconds between checks of the stored data version, see :meth:`check_version`.
+        """
+        self.min_similarity = min_similarity
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version_check_interval = version_check_interval
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, MemoEntry] = OrderedDict()
+        self._keys: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._version = None
+        self._version_checked_at = None
+
+    def lookup(self, question: str = None, vector=None) -> Optional[MemoEntry]:
+        """
+        Find a remembered question.
+        :param question: Question text, matched after normalization.
+        :param vector: Embedding of the question, if given a remembered question similar enough to it matches as well.
+        :return: The remembered entry, None if the question was not asked before.
+        """
+        with self._lock:
+            self._expire()
+
+            entry = self._entries.get(normalize_question(question)) if question is not None else None
+            if entry is None and vector is not None:
+                entry = self._most_similar(vector)
+            return entry
+
+    def save(self, question: str, vector=None, answer: Optional[str] = None, docs: List[Vector] = None):
+        """
+        Remember a question, replacing an earlier entry of the same normalized text.
+        :param question: Question text.
+        :param vector: Embedding of the question, questions without one are only found by their text.
+        :param answer: Answer to the question.
+        :param docs: Passages the answer was written from.
+        """
+        key = normalize_question(question)
+        if vector is not None:
+            vector = np.asarray(vector, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1)
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = MemoEntry(question, answer, list(docs or []), vector)
+            while self.max_entries is not None and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def version_due(self) -> bool:
+        """
+        :return: True if the stored data version should be checked again with :meth:`check_version`.
+        """
+        with self._lock:
+            return self._version_checked_at is None or time.monotonic() - self._version_checked_at >= self.version_check_interval
+
+    def check_version(self, version):
+        """
+        Forget everything if the stored data changed since the last check, answers may depend on passages that were embedded again.
+        :param version: Current version of the stored data, e.g. from :meth:`VectorStorage.data_version`.
+        """
+        with self._lock:
+            if self._version is not None and version != self._version:
+                self._entries.clear()
+                self._matrix = None
+            self._version = version
+            self._version_checked_at = time.monotonic()
+
+    def _expire(self):
+        if self.ttl is None:
+            return
+        # Entries are kept in insertion order, so the expired ones are at the start
+        deadline = time.monotonic() - self.ttl
+        while self._entries and next(iter(self._entries.values())).created_at < deadline:
+            self._entries.popitem(last=False)
+            self._matrix = None
+
+    def _most_similar(self, vector) -> Optional[MemoEntry]:
+        if self._matrix is None:
+            self._keys = [key for key, entry in self._entries.items() if entry.vector is not None]
+            self._matrix = np.stack([self._entries[key].vector for key in self._keys]) if self._keys else np.empty((0, 0))
+        if not self._keys:
+            return None
+
+        vector = np.asarray(vector, dtype=np.float32)
+        similarities = self._matrix @ (vector / (np.linalg.norm(vector) or 1))
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.min_similarity:
+            return None
+        return self._entries[self._keys[best]]
@@ -0,0 +1,248 @@
+"""
+Process wide request limiting per endpoint and model. All models, copies, threads and event loops calling the same
+endpoint and model share one :class:`RateLimiter`, so together they stay within the provider limits instead of
+running in to 429 responses.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+
+class _Waiter:
+    """
+    A caller waiting for its turn. Can be woken from any thread, whether it waits in a thread or in an event loop.
+    """
+
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+        self.event = threading.Event()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.future: Optional[asyncio.Future] = None
+
+    def wake(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._resolve)
+        else:
+            self.event.set()
+
+    def _resolve(self):
+        if self.future is not None and not self.future.done():
+            self.future.set_result(None)
+
+    def wait(self, timeout: Optional[float]):
+        self.event.wait(timeout)
+        self.event.clear()
+
+    async def await_wake(self, timeout: Optional[float]):
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(self.future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.future = None
+
+
+class RateLimiter:
+    """
+    Limits the requests to one endpoint and model to a maximum number in flight, requests per minute and tokens per minute.
+    Requests and tokens are token buckets refilled continuously, so a full minute's budget can be used in a burst.
+    Callers are served strictly in the order they arrived.
+    """
+
+    # A waiter re-checks at least this often, as a safety net against missed wake ups
+    MAX_SLEEP = 1.0
+
+    def __init__(self, max_in_flight: int = None, requests_per_minute: float = None, tokens_per_minute: float = None):
+        """
+        :param max_in_flight: Maximum number of requests running at the same time, unlimited if None.
+        :param requests_per_minute: Maximum number of requests started per minute, unlimited if None.
+        :param tokens_per_minute: Maximum number of tokens used per minute, unlimited if None.
+        """
+        self.max_in_flight = max_in_flight
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+        self._lock = threading.Lock()
+        self._queue: deque[_Waiter] = deque()
+        self._in_flight = 0
+        self._requests = float(requests_per_minute or 0)
+        self._tokens = float(tokens_per_minute or 0)
+        self._refilled_at = time.monotonic()
+        self._blocked_until = 0.0
+
+        self._granted = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._rate_limited = 0
+
+    def acquire(self, tokens: int = 0) -> float:
+        """
+        Block until the request may be sent.
+        :param tokens: Estimated number of tokens of the request.
+        :return: Seconds waited.
+        """
+        waiter = _Waiter(tokens)
+        started = time.monotonic()
+        with self._lock:
+            self._queue.append(waiter)
+
+        try:
+            while (delay := self._try_grant(waiter)) != 0:
+                waiter.wait(delay)
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+        return self._granted_after(started)
+
+    async def aacquire(self, tokens: int = 0) -> float:
+        """
+        Asyncio variant of :meth:`acquire`, waits without blocking the event loop.
+        """
+        waiter = _Waiter(tokens)
+        started = time.monotonic()
+        with self._lock:
+            self._queue.append(waiter)
+
+        try:
+            while (delay := self._try_grant(waiter)) != 0:
+                await waiter.await_wake(delay)
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+        return self._granted_after(started)
+
+    def release(self, tokens: int = 0, used_tokens: int = None):
+        """
+        Mark a request acquired with :meth:`acquire` as finished.
+        :param tokens: The estimate the request was acquired with.
+        :param used_tokens: Tokens the request actually used, the token budget is corrected by the difference.
+        """
+        with self._lock:
+            self._in_flight -= 1
+            if used_tokens is not None and self.tokens_per_minute:
+                self._tokens += tokens - used_tokens
+            self._wake_head()
+
+    def rate_limited(self, retry_after: float = None):
+        """
+        Report a 429 response, no request is let through until the provider's retry-after (or a few seconds) passed.
+        :param retry_after: Seconds the provider asked to wait.
+        """
+        with self._lock:
+            self._rate_limited += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + (retry_after or 5))
+
+    def stats(self) -> dict:
+        """
+        :return: Current queue depth and in flight requests, and wait time statistics since the start.
+        """
+        with self._lock:
+            return {
+                "queue_depth": len(self._queue),
+                "in_flight": self._in_flight,
+                "granted": self._granted,
+                "average_wait": self._total_wait / self._granted if self._granted else 0,
+                "max_wait": self._max_wait,
+                "rate_limited": self._rate_limited,
+            }
+
+    def _try_grant(self, waiter: _Waiter) -> Optional[float]:
+        """
+        Grant the request if it is first in line and there is capacity.
+        :return: 0 if granted, otherwise how long to wait before checking again (None to wait for a wake up).
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            if self._queue[0] is not waiter:
+                return self.MAX_SLEEP
+            if now < self._blocked_until:
+                return min(self._blocked_until - now, self.MAX_SLEEP)
+            if self.max_in_flight is not None and self._in_flight >= self.max_in_flight:
+                return self.MAX_SLEEP
+
+            if self.requests_per_minute and self._requests < 1:
+                return min((1 - self._requests) / self.requests_per_minute * 60, self.MAX_SLEEP)
+
+            # A request larger than the whole budget only waits for a full bucket instead of forever
+            tokens = min(waiter.tokens, self.tokens_per_minute or 0)
+            if self.tokens_per_minute and self._tokens < tokens:
+                return min((tokens - self._tokens) / self.tokens_per_minute * 60, self.MAX_SLEEP)
+
+            if self.requests_per_minute:
+                self._requests -= 1
+            if self.tokens_per_minute:
+                self._tokens -= waiter.tokens
+            self._in_flight += 1
+            self._queue.popleft()
+            self._wake_head()
+            return 0
+
+    def _refill(self, now: float):
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _wake_head(self):
+        if self._queue:
+            self._queue[0].wake()
+
+    def _abandon(self, waiter: _Waiter):
+        with self._lock:
+            if waiter in self._queue:
+                self._queue.remove(waiter)
+                self._wake_head()
+
+    def _granted_after(self, started: float) -> float:
+        waited = time.monotonic() - started
+        with self._lock:
+            self._granted += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        return waited
+
+
+_lock = threading.Lock()
+_limiters: dict[tuple[str, str], RateLimiter] = {}
+
+
+def configure(base_url: str, model_name: str, **limits) -> Optional[RateLimiter]:
+    """
+    Create the limiter of an endpoint and model, if any limit is set. An already configured limiter is kept.
+    :param base_url: Endpoint URL.
+    :param model_name: Model name at that endpoint.
+    :param limits: ``max_in_flight``, ``requests_per_minute`` and ``tokens_per_minute``, see :class:`RateLimiter`.
+    :return: The limiter, None if no limit is set.
+    """
+    limits = {k: v for k, v in limits.items() if v is not None}
+    with _lock:
+        if (base_url, model_name) not in _limiters and limits:
+            _limiters[(base_url, model_name)] = RateLimiter(**limits)
+        return _limiters.get((base_url, model_name))
+
+
+def get(base_url: str, model_name: str) -> Optional[RateLimiter]:
+    """
+    :return: The limiter of the endpoint and model, None if it is not limited.
+    """
+    with _lock:
+        return _limiters.get((base_url, model_name))
+
+
+def stats() -> dict:
+    """
+    :return: Statistics of every limiter, keyed by "model@endpoint".
+    """
+    with _lock:
+        limiters = dict(_limiters)
+    return {f"{model}@{url}": limiter.stats() for (url, model), limiter in limiters.items()}
@@ -0,0 +1,79 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from src.vectordb.async_vector_storage import AsyncVectorStorage
+from .usage import UsageLedger
+
+
+class RequestCancelled(Exception):
+    """
+    Raised inside the pipeline once the request it is answering was cancelled.
+    """
+
+
+@dataclass
+class RequestContext:
+    """
+    Mutable state of a single query. The pipeline and its models are shared by all queries and never modified while
+    answering, everything that belongs to one query lives here. Creating one is a handful of allocations.
+    """
+
+    max_iterations: Optional[int] = None
+    deadline: Optional[float] = None
+    max_cost: Optional[float] = None
+    on_token: Optional[Callable[[str], None]] = None
+    ledger: UsageLedger = field(default_factory=UsageLedger)
+    cancelled: threading.Event = field(default_factory=threading.Event)
+    created: float = field(default_factory=time.monotonic)
+    # Opened in the event loop the query runs in (server, discord bot), used for retrieval instead of the pipeline's storage
+    vector_storage: Optional[AsyncVectorStorage] = None
+
+    @classmethod
+    def with_timeout(cls, seconds: float, **kwargs) -> "RequestContext":
+        """
+        Create a context whose deadline is the given number of seconds from now.
+        """
+        return cls(deadline=time.monotonic() + seconds, **kwargs)
+
+    def cancel(self):
+        """
+        Cancel the request, the pipeline stops at its next checkpoint. Safe to call from any thread.
+        """
+        self.cancelled.set()
+
+    def remaining(self) -> Optional[float]:
+        """
+        :return: Seconds left until the deadline, None if there is no deadline.
+        """
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def time_limit(self) -> Optional[float]:
+        """
+        :return: Seconds the request was given from its creation until the deadline, None if there is no deadline.
+        """
+        if self.deadline is None:
+            return None
+        return self.deadline - self.created
+
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def remaining_cost(self) -> Optional[float]:
+        """
+        :return: Spend left until the cost ceiling, None if there is no ceiling.
+        """
+        if self.max_cost is None:
+            return None
+        return self.max_cost - self.ledger.total_cost()
+
+    def check(self):
+        """
+        :raises RequestCancelled: If the request was cancelled.
+        """
+        if self.cancelled.is_set():
+            raise RequestCancelled("The request was cancelled.")
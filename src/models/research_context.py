@@ -0,0 +1,198 @@
+import asyncio
+import copy
+from dataclasses import dataclass
+from typing import List, Optional
+
+import tiktoken
+
+from .llmodel import LLModel
+from .usage import UsageLedger
+
+COMPACTION_PROMPT = """
+You condense research notes. You get question and answer pairs gathered while researching a user question.
+Rewrite them as one dense summary that keeps every specific fact (names, numbers, dates, sources, definitions) and drops
+repetition, filler and statements that nothing relevant was found. Do not add any information that is not in the notes.
+""".strip()
+
+
+@dataclass
+class Segment:
+    """
+    One block of the research context, either a researched question with its answer or a summary of earlier ones.
+    """
+
+    text: str
+    tokens: int
+    iteration: int
+    question: Optional[str] = None
+
+
+class ResearchContext:
+    """
+    The research gathered for a user query, as sent to the main researcher every iteration and to the main model at the end.
+
+    Without a budget the context simply grows by every question and answer pair. With a budget, :meth:`compact` keeps
+    it under that many tokens by, in this order, dropping repeated questions, summarizing the pairs of earlier
+    iterations with the summarizer model, truncating the oldest answers and finally dropping the oldest segments.
+    """
+
+    MIN_ANSWER_TOKENS = 128
+    # Rough length of a token, used to estimate the size of the context when it has no budget
+    CHARS_PER_TOKEN = 4
+
+    def __init__(
+        self,
+        global_prompt: str = "",
+        token_budget: int = None,
+        summarizer: LLModel = None,
+        encoding: str = "cl100k_base",
+    ):
+        """
+        :param global_prompt: Global context, always kept in full at the start.
+        :param token_budget: Maximum number of tokens of the rendered context, unlimited if None.
+        :param summarizer: Cheap model used to summarize older research, if None older research is only truncated.
+        :param encoding: Tiktoken encoding used to count tokens, only loaded if there is a budget.
+        """
+        self.header = "Global Context: " + global_prompt + "\n\n" if global_prompt else ""
+        self.token_budget = token_budget
+        self.encoding_name = encoding
+        self._encoding = None
+        self.segments: List[Segment] = []
+        self.iteration = 0
+
+        self.summarizer = None
+        if summarizer is not None:
+            # Own copy, so the prompt of the agent it comes from stays untouched
+            self.summarizer = copy.copy(summarizer)
+            self.summarizer.system_prompt = COMPACTION_PROMPT
+
+        self.header_tokens = self.count(self.header)
+
+    @property
+    def encoding(self) -> tiktoken.Encoding:
+        # Loading an encoding may download it, which is only worth it if there is a budget to keep
+        if self._encoding is None:
+            self._encoding = tiktoken.get_encoding(self.encoding_name)
+        return self._encoding
+
+    def count(self, text: str) -> int:
+        """
+        :return: Number of tokens of the text. Without a budget it is only estimated from its length, which is enough
+            to estimate the cost of the final answer.
+        """
+        if self.token_budget is None:
+            return -(-len(text) // self.CHARS_PER_TOKEN)
+        return len(self.encoding.encode(text))
+
+    def add_iteration(self, question_answers: dict[str, str]):
+        """
+        Add the questions researched in one iteration with their answers.
+        :param question_answers: Answers keyed by the question text.
+        """
+        self.iteration += 1
+        for question, answer in question_answers.items():
+            self.segments.append(self._pair(question, answer, self.iteration))
+
+    def add_passages(self, passages: str):
+        """
+        Add passages retrieved for the user query itself, before any question was researched.
+        :param passages: Formatted passages.
+        """
+        text = f"---\nPassages found for the user query:\n{passages}\n---"
+        self.segments.append(Segment(text=text, tokens=self.count(text), iteration=self.iteration))
+
+    def tokens(self) -> int:
+        """
+        :return: Number of tokens of the rendered context, estimated without a budget.
+        """
+        return self.header_tokens + sum(s.tokens for s in self.segments)
+
+    def render(self, question: str = "") -> str:
+        """
+        Render the context as a prompt. The research is appended after everything else, so the prompt of one iteration
+        is a byte for byte prefix of the prompt of the next one and providers can serve it from their prompt cache.
+        :param question: Text placed between the global context and the research, usually the user query.
+        :return: The prompt.
+        """
+        return self.header + question + "".join("\n\n" + s.text for s in self.segments)
+
+    async def compact(self, ledger: UsageLedger = None, timeout: float = None):
+        """
+        Bring the context under the token budget, if it is over it.
+        :param ledger: If provided, usage of the summarization is recorded in it.
+        :param timeout: Seconds the summarization may take, older research is only truncated if it takes longer. Unlimited if None.
+        """
+        if self.token_budget is None or self.tokens() <= self.token_budget:
+            return
+
+        self._deduplicate()
+        if self.tokens() <= self.token_budget:
+            return
+
+        older = [s for s in self.segments if s.iteration < self.iteration]
+        if self.summarizer is not None and (len(older) > 1 or (older and older[0].question is not None)):
+            try:
+                await asyncio.wait_for(self._summarize(older, ledger), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        self._truncate()
+
+    def _pair(self, question: str, answer: str, iteration: int) -> Segment:
+        text = f"---\nQuestion: {question}\nAnswer: {answer}\n---"
+        return Segment(text=text, tokens=self.count(text), iteration=iteration, question=question)
+
+    def _summary(self, summary: str, iteration: int) -> Segment:
+        text = f"---\nSummary of earlier research:\n{summary}\n---"
+        return Segment(text=text, tokens=self.count(text), iteration=iteration)
+
+    def _deduplicate(self):
+        # The same question asked again keeps only its latest answer, which was researched with more context
+        latest = {}
+        for index, segment in enumerate(self.segments):
+            if segment.question is not None:
+                latest[" ".join(segment.question.lower().split())] = index
+
+        self.segments = [
+            s for index, s in enumerate(self.segments)
+            if s.question is None or latest[" ".join(s.question.lower().split())] == index
+        ]
+
+    async def _summarize(self, older: List[Segment], ledger: UsageLedger = None):
+        notes = "\n\n".join(s.text for s in older)
+        limit = max(self.MIN_ANSWER_TOKENS, (self.token_budget - self.header_tokens) // 2)
+
+        summary = (await self.summarizer.agenerate_response(
+            prompt=f"**Research notes:**\n{notes}\n\nWrite the summary in at most {limit} tokens.",
+            ledger=ledger,
+            stage="compaction",
+        )).strip()
+
+        summary = self._truncate_text(summary, limit)
+        summarized = {id(s) for s in older}
+        self.segments = [self._summary(summary, older[-1].iteration)] + [s for s in self.segments if id(s) not in summarized]
+
+    def _truncate(self):
+        # Oldest answers are shortened first, then dropped, the newest segment is cut as a last resort
+        for index, segment in enumerate(self.segments):
+            if self.tokens() <= self.token_budget:
+                return
+            if segment.tokens > self.MIN_ANSWER_TOKENS:
+                self.segments[index] = self._shortened(segment, self.MIN_ANSWER_TOKENS)
+
+        while self.tokens() > self.token_budget and len(self.segments) > 1:
+            self.segments.pop(0)
+
+        if self.segments and self.tokens() > self.token_budget:
+            self.segments[0] = self._shortened(self.segments[0], max(0, self.token_budget - self.header_tokens))
+
+    def _shortened(self, segment: Segment, max_tokens: int) -> Segment:
+        text = self._truncate_text(segment.text, max_tokens)
+        return Segment(text=text, tokens=self.count(text), iteration=segment.iteration, question=segment.question)
+
+    def _truncate_text(self, text: str, max_tokens: int) -> str:
+        tokens = self.encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        # The marker takes a few tokens itself, so some room is left for it
+        return self.encoding.decode(tokens[:max(0, max_tokens - 4)]) + " [...]"
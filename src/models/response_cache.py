@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+
+class ResponseCache:
+    """
+    Persistent cache of model responses, stored in a local SQLite file so it survives restarts and can be shared by processes.
+
+    Entries expire after ``ttl`` seconds and once there are more than ``max_entries`` of them, the least recently used ones are removed.
+    """
+
+    def __init__(self, path: str, ttl: float = None, max_entries: int = 10_000):
+        """
+        Initialize the cache, creating the database file if needed.
+        :param path: Path to the SQLite file.
+        :param ttl: Number of seconds an entry is valid for, if None entries never expire.
+        :param max_entries: Maximum number of entries kept in the cache.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL;")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                content TEXT,
+                usage TEXT,
+                created_at REAL,
+                accessed_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_responses_accessed_at ON responses (accessed_at);
+            """
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def key(
+        model_name: str,
+        system_prompt: Optional[str],
+        prompt: str,
+        image_urls: Optional[list[str]] = None,
+        structure: Type[BaseModel] = None,
+    ) -> str:
+        """
+        Build the cache key of a request from everything that influences the response.
+        :return: Hex digest identifying the request.
+        """
+        schema = structure.model_json_schema() if structure is not None else None
+        payload = json.dumps(
+            [model_name, system_prompt, prompt, image_urls or [], schema],
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[str, Optional[str]]]:
+        """
+        Get a cached response.
+        :param key: Key from :meth:`key`.
+        :return: Tuple (content, usage as JSON) or None if there is no valid entry.
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT content, usage, created_at FROM responses WHERE key = ?;", (key,)
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            if self.ttl is not None and row[2] < now - self.ttl:
+                self.connection.execute("DELETE FROM responses WHERE key = ?;", (key,))
+                self.connection.commit()
+                return None
+
+            self.connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?;", (now, key))
+            self.connection.commit()
+
+        return row[0], row[1]
+
+    def set(self, key: str, content: str, usage: Optional[str] = None) -> None:
+        """
+        Store a response, replacing any previous entry with the same key, and evict expired and least recently used entries.
+        :param key: Key from :meth:`key`.
+        :param content: Raw text content of the response.
+        :param usage: Usage of the original request as JSON, replayed on cache hits.
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, content, usage, created_at, accessed_at) VALUES (?, ?, ?, ?, ?);",
+                (key, content, usage, now, now),
+            )
+
+            if self.ttl is not None:
+                self.connection.execute("DELETE FROM responses WHERE created_at < ?;", (now - self.ttl,))
+
+            self.connection.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?);",
+                (self.max_entries,),
+            )
+            self.connection.commit()
+
+    def clear(self) -> None:
+        """
+        Remove all entries from the cache.
+        """
+        with self.lock:
+            self.connection.execute("DELETE FROM responses;")
+            self.connection.commit()
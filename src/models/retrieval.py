@@ -0,0 +1,92 @@
+import json
+from typing import List
+
+import numpy as np
+
+from src.vectordb.vector import Vector
+
+
+def embedding_matrix(vectors: List[Vector]) -> np.ndarray:
+    """
+    Stack the embeddings of the given vectors into a row-normalized matrix.
+    Embeddings read from the database come back as pgvector text ("[0.1,0.2,...]") and are parsed here.
+    :param vectors: Vectors with their embeddings loaded.
+    :return: Matrix of shape (len(vectors), dimension) with unit length rows.
+    """
+    rows = [json.loads(v.vector) if isinstance(v.vector, str) else v.vector for v in vectors]
+    matrix = np.asarray(rows, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def maximal_marginal_relevance(
+    query: List[float],
+    candidates: List[Vector],
+    k: int,
+    lambda_mult: float = 0.5,
+) -> List[Vector]:
+    """
+    Select k candidates that are relevant to the query while being different from each other.
+    Each step picks the candidate maximizing ``lambda * sim(query, c) - (1 - lambda) * max(sim(c, selected))``.
+
+    :param query: Query embedding the candidates were retrieved with.
+    :param candidates: Retrieved vectors, they need to include their embeddings.
+    :param k: Number of vectors to select.
+    :param lambda_mult: 1 ranks purely by relevance, 0 purely by diversity.
+    :return: Selected vectors in selection order.
+    """
+    if len(candidates) <= 1 or k <= 0:
+        return candidates[:k]
+
+    matrix = embedding_matrix(candidates)
+    query = np.asarray(query, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1)
+
+    relevance = matrix @ query
+    similarity = matrix @ matrix.T
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+
+    while len(selected) < min(k, len(candidates)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+
+    return [candidates[i] for i in selected]
+
+
+def claim(docs: List[Vector], claimed: set[int]) -> List[Vector]:
+    """
+    Make sure every chunk is used by only one of the questions of an iteration, as their results arrive one by one.
+    A chunk stays with the first question that claimed it.
+    A question that would be left without any context keeps its best ranked chunk, even if it is shared.
+
+    :param docs: Ranked retrieval results of one question.
+    :param claimed: Ids of the chunks already used by other questions of the iteration, updated in place.
+    :return: The results without chunks claimed before.
+    """
+    kept = [doc for doc in docs if doc.id not in claimed]
+    if not kept and docs:
+        kept = docs[:1]
+    claimed.update(doc.id for doc in kept)
+    return kept
+
+
+def claim_windows(windows: List[List[Vector]], hits: List[Vector], claimed: set[int]) -> List[List[Vector]]:
+    """
+    Variant of :func:`claim` for hits expanded with their neighbouring chunks. Neighbours already used by other
+    questions of the iteration are dropped from the windows, the hits themselves were claimed by :func:`claim` before.
+
+    :param windows: Windows of consecutive chunks around the hits, see :meth:`VectorStorage.get_neighbours`.
+    :param hits: Hits the windows were expanded from.
+    :param claimed: Ids of the chunks already used by questions of the iteration, updated in place.
+    :return: The windows without chunks claimed by other questions, every window keeps its hits.
+    """
+    hit_ids = {doc.id for doc in hits}
+    kept = [[doc for doc in window if doc.id in hit_ids or doc.id not in claimed] for window in windows]
+    kept = [window for window in kept if window]
+    claimed.update(doc.id for window in kept for doc in window)
+    return kept
@@ -29,6 +29,10 @@ class STEmbedding(EmbeddingModel):
         # Share the same SentenceTransformer instance
         new.model_name = self.model_name
         new.model = self.model
+        # Share the recent query embeddings and batching as well
+        new._query_cache = self._query_cache
+        new._query_cache_lock = self._query_cache_lock
+        new._batchers = self._batchers
         return new
 
     def embed(self, data, instruction=None):
@@ -0,0 +1,20 @@
+from pydantic import BaseModel, Field
+
+
+class DraftReview(BaseModel):
+    """
+    Decides whether research gathered after a draft answer was written changes what the answer should say.
+    """
+    reasoning: str = Field(
+        ...,
+        description="Compare the new findings with the draft answer. Point out every fact in the findings that the draft is missing, "
+                    "contradicts or states less precisely, and whether it matters for answering the user query."
+    )
+    material: bool = Field(
+        ...,
+        description="True if the draft answer would have to change to include or correct anything from the new findings. "
+                    "False if the findings only repeat the draft, are irrelevant to the user query or report that nothing was found."
+    )
+
+    class Config:
+        extra = "forbid"
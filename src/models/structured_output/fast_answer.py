@@ -0,0 +1,19 @@
+from pydantic import BaseModel, Field
+
+
+class FastAnswer(BaseModel):
+    """
+    Single shot answer written straight from the passages retrieved for the user query, with a flag telling whether they were enough.
+    """
+    answer: str = Field(
+        ...,
+        description="The final answer to the user query, written only from the provided passages."
+    )
+    sufficient: bool = Field(
+        ...,
+        description="True only if the passages fully and unambiguously answer every part of the user query. "
+                    "False if anything needed for a complete answer is missing, unclear or would need further research, the query is then researched in depth instead."
+    )
+
+    class Config:
+        extra = "forbid"
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 
 # 1. Define the structure for a single question with keywords
 class Question(BaseModel):
@@ -16,6 +16,13 @@ class Question(BaseModel):
     class Config:
         extra = "forbid"
 
+def _all_required(schema: dict):
+    # Strict structured output needs every field to be required and has no defaults, the model still writes the optional ones
+    schema["required"] = list(schema["properties"])
+    for field in schema["properties"].values():
+        field.pop("default", None)
+
+
 class Questions(BaseModel):
     """
     Represents reasoning structure for evaluating the sufficiency of context in answering a user question and allowing for follow-up questions.
@@ -32,6 +39,12 @@ class Questions(BaseModel):
         ...,
         description="Indicates whether the provided context is sufficient to accurately and completely answer the original user question."
     )
+    # Results cached before the confidence was asked for do not have it
+    confidence: Optional[float] = Field(
+        None,
+        description="Number between 0 and 1, how likely the context already contains everything needed for a complete answer, even if 'satisfied' is False. "
+                    "0 means key information is missing, 1 means at most minor details would still be checked."
+    )
     reasoning: str = Field(
         ...,
         description="Review satisfied_reason to identify any missing or unclear information, especially undefined terms from the original_user_question. "
@@ -43,4 +56,7 @@ class Questions(BaseModel):
     questions: List[Question] = Field(  # <-- Changed from List[str]
         ...,
         description="If 'satisfied' is False, provide a list of structured questions. Each item should contain the specific question ('question_text') and relevant search 'keywords', aimed at acquiring the missing information identified in 'reasoning'." # <-- Updated description
-    )
\ No newline at end of file
+    )
+
+    class Config:
+        json_schema_extra = staticmethod(_all_required)
\ No newline at end of file
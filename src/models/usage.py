@@ -0,0 +1,84 @@
+import threading
+from dataclasses import dataclass
+from typing import List
+
+
+@dataclass(frozen=True)
+class UsageRecord:
+    """
+    Usage of a single model call (or storage call, which has no tokens and no cost).
+    Records are immutable, so they can be handed between threads and tasks freely.
+    """
+
+    model: str
+    stage: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    latency: float = 0
+    cost: float = 0
+    cached_response: bool = False
+
+
+@dataclass
+class StageUsage:
+    """
+    Aggregated usage of all calls made in one stage of the pipeline.
+    """
+
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cost: float = 0
+    total_latency: float = 0
+    max_latency: float = 0
+
+    def add(self, record: UsageRecord):
+        self.calls += 1
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.cached_tokens += record.cached_tokens
+        self.cost += record.cost
+        self.total_latency += record.latency
+        self.max_latency = max(self.max_latency, record.latency)
+
+
+class UsageLedger:
+    """
+    Collects the usage records of one request. Safe to record into from any number of threads and tasks at once.
+    """
+
+    def __init__(self):
+        self._records: List[UsageRecord] = []
+        self._lock = threading.Lock()
+
+    def record(self, record: UsageRecord):
+        with self._lock:
+            self._records.append(record)
+
+    @property
+    def records(self) -> List[UsageRecord]:
+        """
+        :return: Copy of all records in the order they were recorded.
+        """
+        with self._lock:
+            return list(self._records)
+
+    def total_cost(self) -> float:
+        return sum(r.cost for r in self.records)
+
+    def by_stage(self) -> dict[str, StageUsage]:
+        """
+        :return: Aggregated usage keyed by stage, in the order the stages were first seen.
+        """
+        stages = {}
+        for record in self.records:
+            stages.setdefault(record.stage, StageUsage()).add(record)
+        return stages
+
+    def to_dict(self) -> dict:
+        """
+        :return: JSON serializable per stage aggregates.
+        """
+        return {stage: vars(usage).copy() for stage, usage in self.by_stage().items()}
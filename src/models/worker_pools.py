@@ -0,0 +1,132 @@
+"""
+Process wide worker thread pools for the blocking calls the pipeline makes from the event loop: local embedding models
+and psycopg2 storages. The pools live as long as the process and are shared by all requests and event loops, so the
+number of worker threads is fixed by the configuration instead of growing with the load.
+
+Model calls do not need a pool, they are async and limited per endpoint by :mod:`rate_limiter`.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+EMBEDDING = "embedding"
+STORAGE = "storage"
+
+_sizes = {
+    EMBEDDING: 4,
+    STORAGE: 8,
+}
+
+
+class WorkerPool:
+    """
+    A fixed size thread pool that keeps track of its queue and utilization. Jobs are started in the order they were
+    submitted, a single request cannot take over the pool as its fan-out is bounded by ``QAPipeline.max_concurrency``.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        """
+        :param name: Name of the pool, used for its threads.
+        :param max_workers: Number of worker threads.
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+
+        self._lock = threading.Lock()
+        self._created_at = time.monotonic()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._busy = 0.0
+
+    async def run(self, function, *args, **kwargs):
+        """
+        Run a blocking function in the pool without blocking the event loop.
+        Cancelling the caller drops the job if it has not started yet, a started job runs to completion.
+        :return: Result of the function.
+        """
+        submitted = time.monotonic()
+
+        def job():
+            started = time.monotonic()
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+                self._total_wait += started - submitted
+                self._max_wait = max(self._max_wait, started - submitted)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._completed += 1
+                    self._busy += time.monotonic() - started
+
+        with self._lock:
+            self._queued += 1
+        future = self.executor.submit(job)
+        future.add_done_callback(self._dropped)
+        return await asyncio.wrap_future(future)
+
+    def _dropped(self, future: Future):
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+
+    def stats(self) -> dict:
+        """
+        :return: Current queue depth and busy workers, and wait time and utilization since the start.
+        """
+        with self._lock:
+            elapsed = time.monotonic() - self._created_at
+            return {
+                "max_workers": self.max_workers,
+                "active": self._active,
+                "queued": self._queued,
+                "completed": self._completed,
+                "average_wait": self._total_wait / self._completed if self._completed else 0,
+                "max_wait": self._max_wait,
+                "utilization": self._busy / (elapsed * self.max_workers) if elapsed > 0 else 0,
+            }
+
+
+_lock = threading.Lock()
+_pools: dict[str, WorkerPool] = {}
+
+
+def configure(**sizes: int):
+    """
+    Set the number of worker threads of pools created from now on, call it before the pipeline runs.
+    :param sizes: Number of workers keyed by pool name, e.g. ``embedding=4, storage=8``.
+    """
+    with _lock:
+        _sizes.update({name: size for name, size in sizes.items() if size is not None})
+
+
+def get(name: str) -> WorkerPool:
+    """
+    Get the shared pool of the given name, it is created on first use.
+    Pools without a configured size get as many workers as ``ThreadPoolExecutor`` does by default.
+    :param name: Pool name, :data:`EMBEDDING` or :data:`STORAGE`.
+    :return: Pool.
+    """
+    with _lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = WorkerPool(name, _sizes.get(name) or min(32, (os.cpu_count() or 1) + 4))
+            _pools[name] = pool
+    return pool
+
+
+def stats() -> dict:
+    """
+    :return: Statistics of every pool created so far, keyed by name.
+    """
+    with _lock:
+        pools = dict(_pools)
+    return {name: pool.stats() for name, pool in pools.items()}
@@ -43,7 +43,9 @@ def cli_routine(
         if user_input.lower() == "exit":
             break
 
-        answer = qna.run(user_input)
+        print(colored_text("Final Answer: ", "green"), end="", flush=True)
+        answer = qna.run(user_input, on_token=lambda delta: print(colored_text(delta, "green"), end="", flush=True))
+        print()
 
         for contex in answer.used_context:
             print(colored_text(f"\nSource: {contex.file_name}", "blue"))
@@ -55,9 +57,13 @@ def cli_routine(
             for question in desision.questions:
                 print(colored_text(f"Question: {question.question_text}", "magenta"))
                 print(colored_text(f"Keywords: {question.keywords}", "yellow"))
-                print(colored_text(f"Answer: {answer.questions[question.question_text]}", "white"))
+                print(colored_text(f"Answer: {answer.questions.get(question.question_text, '')}", "white"))
 
         print(colored_text(f"Cost: ${answer.cost}", "red"))
+        for stage, usage in answer.usage.by_stage().items():
+            print(colored_text(
+                f"  {stage}: {usage.calls} calls, {usage.prompt_tokens} in ({usage.cached_tokens} cached), "
+                f"{usage.completion_tokens} out, ${usage.cost:.6f}, {usage.total_latency:.2f}s total, {usage.max_latency:.2f}s max",
+                "red",
+            ))
         print(colored_text(f"Iterations: {len(answer.satisfactions)}", "green"))
-
-        print(colored_text(f"Final Answer: {answer.final_answer}", "green"))
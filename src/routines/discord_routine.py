@@ -1,9 +1,9 @@
 from idlelib.rpc import response_queue
 
 import discord
-import asyncio
-import copy
-from src.vectordb.rating_storage import RatingStorage
+from src.models.request_context import RequestContext
+from src.vectordb.async_rating_storage import AsyncRatingStorage
+from src.vectordb.async_vector_storage import AsyncVectorStorage
 
 
 class RatingView(discord.ui.View):
@@ -16,7 +16,7 @@ class RatingView(discord.ui.View):
         answer: str,
         iteration: int,
         cost: float,
-        storage: RatingStorage,
+        storage: AsyncRatingStorage,
         author_id: int,
         replied_message: discord.Message
     ):
@@ -53,7 +53,7 @@ class RatingView(discord.ui.View):
 
     async def record_rating(self, score: int, interaction: discord.Interaction):
         try:
-            self.storage.save_query(
+            await self.storage.save_query(
                 query_text=self.question,
                 answer=self.answer,
                 iteration=self.iteration,
@@ -72,18 +72,20 @@ class DiscordQABot(discord.Client):
     def __init__(
         self,
         qna_pipeline,
-        rating_storage: RatingStorage,
+        rating_storage: AsyncRatingStorage,
         bot_token: str,
         max_questions_per_user: int = None,
         max_questions_global: int = None,
         guild_ids=None,
-        channel_ids=None
+        channel_ids=None,
+        async_vector_storage: AsyncVectorStorage = None,
     ):
         intents = discord.Intents.default()
         intents.message_content = True
         super().__init__(intents=intents)
         self.qna_pipeline = qna_pipeline
         self.storage = rating_storage
+        self.async_vector_storage = async_vector_storage
         # Normalize guild_ids to ints
         self.guild_ids = set(map(int, guild_ids)) if guild_ids else set()
         # Normalize channel_ids to ints
@@ -93,6 +95,18 @@ class DiscordQABot(discord.Client):
         self.max_questions_global = max_questions_global
         self.question_count = 0
 
+    async def setup_hook(self):
+        # The rating storage pool is bound to the bot's event loop, so it can only be opened once the loop runs
+        await self.storage.open()
+        if self.async_vector_storage is not None:
+            await self.async_vector_storage.open()
+
+    async def close(self):
+        await self.storage.close()
+        if self.async_vector_storage is not None:
+            await self.async_vector_storage.close()
+        await super().close()
+
     async def on_ready(self):
         print(f'Logged in as {self.user}')
 
@@ -142,14 +156,8 @@ class DiscordQABot(discord.Client):
             return
 
         thinking_msg = await message.reply("Thinking...")
-        local_qna = copy.copy(self.qna_pipeline)
-        loop = asyncio.get_running_loop()
-
         try:
-            result = await loop.run_in_executor(
-                None,
-                lambda: local_qna.run(user_query)
-            )
+            result = await self.qna_pipeline.arun(user_query, request=RequestContext(vector_storage=self.async_vector_storage))
             await thinking_msg.delete()
 
             response_text = f"{result.final_answer}\n"
@@ -187,18 +195,19 @@ class DiscordQABot(discord.Client):
 
 def run_discord_routine(
     qna_pipeline,
-    rating_storage: RatingStorage,
+    rating_storage: AsyncRatingStorage,
     bot_token: str,
     max_questions_per_user: int = None,
     max_questions_global: int = None,
     guild_ids=None,
-    channel_ids=None
+    channel_ids=None,
+    async_vector_storage: AsyncVectorStorage = None,
 ):
     """
     Run a discord bot that when tagged will answer users questions using the QAPipeline. Provides users with option to rate the answer.
     :param qna_pipeline:
         QAPipeline instance to be used for answering questions.
-    :param rating_storage:  Storage instance to save user ratings.
+    :param rating_storage:  Storage instance to save user ratings, opened by the bot once its event loop is running.
     :param bot_token:
         Discord bot token for authentication.
     :param max_questions_per_user:
@@ -209,6 +218,8 @@ def run_discord_routine(
         List of guild IDs where the bot will be active.
     :param channel_ids:
         List of channel IDs where the bot will be active.
+    :param async_vector_storage:
+        If provided, it is opened by the bot and every query retrieves through it.
     :return: Keeps running until interrupted.
     """
     client = DiscordQABot(
@@ -218,6 +229,7 @@ def run_discord_routine(
         max_questions_per_user=max_questions_per_user,
         max_questions_global=max_questions_global,
         guild_ids=guild_ids,
-        channel_ids=channel_ids
+        channel_ids=channel_ids,
+        async_vector_storage=async_vector_storage,
     )
     client.run(bot_token)
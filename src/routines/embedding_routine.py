@@ -1,11 +1,14 @@
 import os
 from datetime import datetime, timezone
 from typing import Literal, Any, Generator, Type
+
+import numpy as np
 from tqdm import tqdm
 
-from src.document_parsing import Document, Chunker
+from src.document_parsing import Document, Chunker, Chunk
 from src.document_parsing.document_parser import DocumentParser
 from src.models import EmbeddingModel
+from src.vectordb.answer_cache_storage import AnswerCacheStorage
 from src.vectordb.vector import Vector
 from src.vectordb.vector_storage import VectorStorage
 
@@ -16,6 +19,8 @@ def embedding_routine(
     embedding_model: EmbeddingModel,
     vector_storage: VectorStorage,
     mode: Literal["create", "update"] = "create",
+    near_duplicate_distance: float = None,
+    answer_cache: AnswerCacheStorage = None,
 ):
     """
     This is a routine that loads all markdown documents from given directory and its subdirectories, creates chunks using the chunker and embeds those chunks and saves them in to the vector storage.
@@ -24,7 +29,9 @@ def embedding_routine(
     :param chunker: Inicialized chunker object
     :param embedding_model: The embedding model to use for embedding the chunks
     :param vector_storage: The vector storage to use for storing the vectors
-    :param mode: The mode in which to run the routine. If "create" it will empty existing vector storage and embed all files again. If "update" only new or edited files will be embedded.
+    :param mode: The mode in which to run the routine. If "create" it will embed all files again in to a new table and swap it for the existing one once done. If "update" only new or edited files will be embedded.
+    :param near_duplicate_distance: Chunks whose embedding is within this cosine distance of an already stored chunk with the same content apart from whitespace and case are stored as a reference to it. If not set only identical chunks are merged.
+    :param answer_cache: Cached answers depending on files that get embedded again are removed from it. In create mode it is cleared completely.
     :return:
 
     Note: This function processes data one by one, making it save to use with large quantities of data, even if it's somewhat slower because of it.
@@ -33,8 +40,11 @@ def embedding_routine(
     if mode not in ["create", "update"]:
         raise ValueError("Mode must be either 'create' or 'update'.")
 
+    # In create mode everything is loaded in to a shadow table that replaces the live one at the end,
+    # so anything answering from the live table keeps working for the whole rebuild
+    target_storage = vector_storage
     if mode == "create":
-        vector_storage.clear_table()
+        target_storage = vector_storage.create_shadow()
 
     number_of_files = sum(len(files) for _, _, files in os.walk(data_path))
     pbar = tqdm(total=number_of_files, desc="Processing files", unit="file")
@@ -52,19 +62,14 @@ def embedding_routine(
                 document_updated_at = document.updated_at.replace(tzinfo=timezone.utc)
                 if file_updated_at < document_updated_at:
                     vector_storage.delete_file(document.file_name)
+                    if answer_cache is not None:
+                        answer_cache.invalidate_files([document.file_name])
                 else:
                     pbar.update(1)
                     continue
 
         chunks = chunker.chunk(document)
-        contents = [chunk.content for chunk in chunks]
-        embeddings = embedding_model.embed(contents)
-        vectors = [
-            Vector.from_chunk(chunk, embedding.tolist())
-            for chunk, embedding in zip(chunks, embeddings)
-        ]
-
-        vector_storage.batch_insert(vectors)
+        _store_chunks(chunks, embedding_model, target_storage, near_duplicate_distance)
 
         pbar.update(1)
 
@@ -73,6 +78,92 @@ def embedding_routine(
     pbar.update(pbar.total - pbar.n)
     pbar.close()
 
+    if mode == "create":
+        vector_storage.swap(target_storage)
+        if answer_cache is not None:
+            answer_cache.clear_table()
+
+
+def _store_chunks(
+    chunks: list[Chunk],
+    embedding_model: EmbeddingModel,
+    vector_storage: VectorStorage,
+    near_duplicate_distance: float = None,
+):
+    """
+    Embeds and stores chunks of a single document, storing every distinct content only once.
+
+    Chunks whose content is already stored (matched by hash, before embedding) or that are close enough to a stored chunk
+    or to an earlier new chunk of the document (matched by embedding, with the same content apart from whitespace and case)
+    are saved only as references to the stored chunk.
+
+    :param chunks: Chunks of a document.
+    :param embedding_model: The embedding model to use for embedding new chunks.
+    :param vector_storage: The vector storage the chunks are saved to.
+    :param near_duplicate_distance: Maximum cosine distance for chunks to be considered duplicates, None disables the check.
+    """
+    hashes = [VectorStorage.content_hash(chunk.content) for chunk in chunks]
+    stored = vector_storage.find_by_hashes(hashes)
+
+    # Only the first occurrence of content that isn't stored yet gets embedded
+    new_chunks = {}
+    for chunk, content_hash in zip(chunks, hashes):
+        if content_hash not in stored and content_hash not in new_chunks:
+            new_chunks[content_hash] = chunk
+
+    new_hashes = list(new_chunks.keys())
+    embeddings = []
+    if new_hashes:
+        embeddings = [e.tolist() for e in embedding_model.embed([new_chunks[h].content for h in new_hashes])]
+
+    near_duplicates = {}
+    if near_duplicate_distance is not None:
+        contents = [new_chunks[h].content for h in new_hashes]
+        for index, vector_id in vector_storage.find_near_duplicates(embeddings, contents, near_duplicate_distance).items():
+            near_duplicates[new_hashes[index]] = vector_id
+
+    # Near duplicates among the new chunks themselves point at the first of them that gets inserted
+    batch_duplicates = {}
+    if near_duplicate_distance is not None and len(embeddings) > 1:
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        distances = 1 - matrix @ matrix.T
+        normalized = [VectorStorage.normalized_content(new_chunks[h].content) for h in new_hashes]
+        kept = []
+        for index, content_hash in enumerate(new_hashes):
+            if content_hash in near_duplicates:
+                continue
+            original = next(
+                (i for i in kept if distances[i, index] <= near_duplicate_distance and normalized[i] == normalized[index]), None
+            )
+            if original is None:
+                kept.append(index)
+            else:
+                batch_duplicates[content_hash] = new_hashes[original]
+
+    inserted = {
+        content_hash for content_hash in new_hashes if content_hash not in near_duplicates and content_hash not in batch_duplicates
+    }
+    vectors = [
+        Vector.from_chunk(new_chunks[content_hash], embedding)
+        for content_hash, embedding in zip(new_hashes, embeddings)
+        if content_hash in inserted
+    ]
+    vector_storage.batch_insert(vectors)
+
+    stored.update(near_duplicates)
+    stored.update(vector_storage.find_by_hashes(list(inserted)))
+    stored.update({content_hash: stored[original] for content_hash, original in batch_duplicates.items()})
+
+    # Every chunk except the inserted first occurrences points at the stored copy of its content
+    references = [
+        (stored[content_hash], chunk)
+        for chunk, content_hash in zip(chunks, hashes)
+        if not (content_hash in inserted and new_chunks[content_hash] is chunk)
+    ]
+    vector_storage.batch_insert_references(references)
+
 
 def _document_generator(path: str) -> Generator[Document, None, None]:
     """
@@ -1,7 +1,7 @@
+import asyncio
 import csv
 import copy
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from tqdm import tqdm
 from src.models.qna_pipline import QAPipeline
@@ -25,10 +25,11 @@ def save_csv(path: str, data: list[dict]):
             writer.writerow(row)
 
 
-def process_question(entry, qan : QAPipeline):
+async def process_question(entry, qan : QAPipeline, semaphore: asyncio.Semaphore):
     try:
 
-        answ = qan.run(user_query=entry["query"])
+        async with semaphore:
+            answ = await qan.arun(user_query=entry["query"])
         entry["answer"] = answ.final_answer
 
         parts = []
@@ -64,22 +65,29 @@ def generate_answers(
 ):
     questions = load_csv(path)
 
-    results = []
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
-            executor.submit(
-                process_question,
-                entry=copy.deepcopy(entry),  # Avoid shared mutation
-                qan=copy.copy(qan)
-            )
-            for entry in questions
-        ]
-
-        for f in tqdm(as_completed(futures), total=len(futures), desc="Generating answers", unit="q"):
-            results.append(f.result())
+    results = asyncio.run(_answer_all(questions, qan, max_workers))
 
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
     out_file = path.rsplit(".", 1)[0] + f"_answers_{timestamp}.csv"
     save_csv(out_file, results)
 
     return out_file
+
+
+async def _answer_all(questions: list[dict], qan: QAPipeline, max_workers: int) -> list[dict]:
+    # All questions are answered on one event loop, at most max_workers of them at a time
+    semaphore = asyncio.Semaphore(max_workers)
+    tasks = [
+        asyncio.ensure_future(process_question(
+            entry=copy.deepcopy(entry),  # Avoid shared mutation
+            qan=qan,  # Shared, all per query state lives in the request context
+            semaphore=semaphore,
+        ))
+        for entry in questions
+    ]
+
+    results = []
+    for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Generating answers", unit="q"):
+        results.append(await task)
+
+    return results
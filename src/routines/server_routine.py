@@ -1,10 +1,61 @@
 import asyncio
-import copy
+import json
+import time
 
 from aiohttp import web
-from src.models.qna_pipline import QAPipeline
+from src.models import rate_limiter, worker_pools
+from src.models.qna_pipline import QAPipeline, QAPipelineResult
+from src.models.request_context import RequestContext
+from src.vectordb.async_vector_storage import AsyncVectorStorage
 _qan : QAPipeline = None
 
+def _result_to_json(answer: QAPipelineResult) -> dict:
+    """
+    Converts the pipeline result in to the JSON response returned by the server.
+    :param answer:
+    :return:
+    """
+    return {
+        "terms": {term: explanation for term, explanation in answer.terms.items()},
+        "satisfactions": [
+            {
+                "satisfied_reason": s.satisfied_reason,
+                "reasoning": s.reasoning,
+                "questions": [
+                    {
+                        "question": q.question_text,
+                        "keywords": q.keywords,
+                        "answer": answer.questions.get(q.question_text, "")
+                    } for q in s.questions
+                ]
+            } for s in answer.satisfactions
+        ],
+        "cost": answer.cost,
+        "usage": answer.usage.to_dict(),
+        "iterations": answer.iterations,
+        "used_context":[
+            {
+                "file_name": c.file_name,
+                "metadata": c.metadata,
+            } for c in answer.used_context
+        ],
+        "final_answer": answer.final_answer,
+        "cached": answer.cached,
+        "stop_reason": answer.stop_reason,
+    }
+
+
+def _request_context(data: dict, **kwargs) -> RequestContext:
+    """
+    Creates the context of a query from the optional limits in the request body, ``timeout`` in seconds and ``max_cost``.
+    Without them the pipeline's default limits apply.
+    """
+    context = RequestContext(max_iterations=data.get("iterations", 5), max_cost=data.get("max_cost"), **kwargs)
+    if data.get("timeout") is not None:
+        context.deadline = time.monotonic() + data["timeout"]
+    return context
+
+
 async def handle_request(request):
     """
     Processes incoming request and answers it using the QA pipeline, if the request is valid.
@@ -15,62 +66,119 @@ async def handle_request(request):
     try:
         data = await request.json()
         user_query = data.get("query")
-        iterations = data.get("iterations", 5)
 
         if not user_query:
             return web.json_response({"error": "Missing 'query' field"}, status=400)
 
 
-        copy_qan : QAPipeline = copy.copy(_qan)
-
-        copy_qan.max_iterations = iterations
-        answer = await asyncio.to_thread(copy_qan.run, user_query)
-
-        response_data = {
-            "terms": {term: explanation for term, explanation in answer.terms.items()},
-            "satisfactions": [
-                {
-                    "satisfied_reason": s.satisfied_reason,
-                    "reasoning": s.reasoning,
-                    "questions": [
-                        {
-                            "question": q.question_text,
-                            "keywords": q.keywords,
-                            "answer": answer.questions[q.question_text]
-                        } for q in s.questions
-                    ]
-                } for s in answer.satisfactions
-            ],
-            "cost": answer.cost,
-            "iterations": answer.iterations,
-            "used_context":[
-                {
-                    "file_name": c.file_name,
-                    "metadata": c.metadata,
-                } for c in answer.used_context
-            ],
-            "final_answer": answer.final_answer
-        }
-
-        return web.json_response(response_data)
+        answer = await _qan.arun(user_query, request=_request_context(data, vector_storage=request.app["vector_storage"]))
+
+        return web.json_response(_result_to_json(answer))
 
     except Exception as e:
         return web.json_response({"error": str(e)}, status=500)
 
-def run_server(qan : QAPipeline, address="127.0.0.1", port=8080):
+async def handle_stream_request(request):
     """
-    Starts server that listens for incoming requests and processes them using the QA pipeline.
-    :param agents:  Agents object containing all the models.
-    :param embedding_model:  Embedding model used for vectorization.
-    :param vector_storage:  Vector storage object used for storing and retrieving vectors.
-    :param address: Web server address.
-    :param port: Web server port.
+    Same as :func:`handle_request`, but streams the final answer as server-sent events while it is being generated.
+    Every part of the answer is sent as a ``token`` event, followed by a single ``result`` event with the full response.
+    :param request:
     :return:
     """
 
+    try:
+        data = await request.json()
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+    user_query = data.get("query")
+
+    if not user_query:
+        return web.json_response({"error": "Missing 'query' field"}, status=400)
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+
+    # The pipeline runs as a separate task, tokens are handed over to the response through the queue
+    tokens: asyncio.Queue = asyncio.Queue()
+
+    task = asyncio.ensure_future(
+        _qan.arun(user_query, request=_request_context(
+            data, on_token=tokens.put_nowait, vector_storage=request.app["vector_storage"]
+        ))
+    )
+    task.add_done_callback(lambda _: tokens.put_nowait(None))
+
+    try:
+        while (delta := await tokens.get()) is not None:
+            await response.write(_sse("token", delta))
+    finally:
+        # The client went away, nobody is waiting for the answer anymore
+        if not task.done():
+            task.cancel()
+
+    try:
+        await response.write(_sse("result", _result_to_json(task.result())))
+    except Exception as e:
+        await response.write(_sse("error", {"error": str(e)}))
+
+    await response.write_eof()
+    return response
+
+
+async def handle_stats(request):
+    """
+    Returns queue depth, in flight requests and wait times of the rate limiters of all model endpoints, and the
+    utilization of the worker pools running blocking embedding and storage calls.
+    :param request:
+    :return:
+    """
+    return web.json_response({"rate_limits": rate_limiter.stats(), "worker_pools": worker_pools.stats()})
+
+
+def _sse(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+def create_app(qan: QAPipeline, async_vector_storage: AsyncVectorStorage = None) -> web.Application:
+    """
+    Creates the web application answering queries with the QA pipeline, see :func:`run_server`.
+    :param qan: QA pipeline answering the queries.
+    :param async_vector_storage: If provided, it is opened once the application starts and every query retrieves through it.
+    :return: Application.
+    """
+
     global _qan
     _qan = qan
 
     app = web.Application()
     app.router.add_post("/query", handle_request)
-    web.run_app(app, host=address, port=port)
+    app.router.add_post("/query/stream", handle_stream_request)
+    app.router.add_get("/stats", handle_stats)
+    app["vector_storage"] = async_vector_storage
+
+    if async_vector_storage is not None:
+        # The connection pool is bound to the server's event loop, so it can only be opened once the loop runs
+        async def open_storage(_app):
+            await async_vector_storage.open()
+
+        async def close_storage(_app):
+            await async_vector_storage.close()
+
+        app.on_startup.append(open_storage)
+        app.on_cleanup.append(close_storage)
+
+    return app
+
+
+def run_server(qan : QAPipeline, address="127.0.0.1", port=8080, async_vector_storage: AsyncVectorStorage = None):
+    """
+    Starts server that listens for incoming requests and processes them using the QA pipeline.
+    All queries are answered concurrently on the server's event loop.
+    :param qan: QA pipeline answering the queries.
+    :param address: Web server address.
+    :param port: Web server port.
+    :param async_vector_storage: If provided, it is opened once the server starts and every query retrieves through it.
+    :return:
+    """
+    web.run_app(create_app(qan, async_vector_storage), host=address, port=port)
@@ -0,0 +1,303 @@
+"""
+Local stand-in for an OpenAI compatible API, used to benchmark the pipeline and the server without real model providers.
+
+Serves chat completions (plain, ``json_schema`` structured output and streaming) and embeddings. Responses, token
+counts, latencies and injected errors are derived from a hash of the request and the seed, so the same run always
+produces the same numbers. Latencies and errors also depend on how often the same request was sent before, so retries
+and hedged duplicates are drawn independently of the first attempt.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+_WORDS = (
+    "the context describes how research questions about the documents are answered using retrieved passages "
+    "and keywords from the source files with specific details numbers dates names and definitions"
+).split()
+
+_DEFAULT_LATENCY = {"distribution": "lognormal", "median": 0.8, "sigma": 0.5}
+_DEFAULT_EMBEDDING_LATENCY = {"distribution": "lognormal", "median": 0.05, "sigma": 0.3}
+
+
+def _rng(settings: dict, payload, purpose: str, attempts: Counter = None) -> random.Random:
+    """
+    :param attempts: If given, sends of every request are counted in it and the count is part of the seed, so each
+        attempt of the same request gets its own draw.
+    """
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+    if attempts is None:
+        return random.Random(f"{settings['seed']}:{purpose}:{digest}")
+
+    attempts[purpose, digest] += 1
+    return random.Random(f"{settings['seed']}:{purpose}:{digest}:{attempts[purpose, digest]}")
+
+
+def _sample_latency(rng: random.Random, spec: dict) -> float:
+    """
+    Sample a latency in seconds from a distribution spec, e.g. ``{"distribution": "lognormal", "median": 0.8, "sigma": 0.5}``.
+    Supported distributions: fixed (value), uniform (low, high), exponential (mean), lognormal (median, sigma).
+    """
+    distribution = spec.get("distribution", "fixed")
+    if distribution == "fixed":
+        return spec.get("value", 0)
+    if distribution == "uniform":
+        return rng.uniform(spec.get("low", 0), spec.get("high", 1))
+    if distribution == "exponential":
+        return rng.expovariate(1 / spec.get("mean", 1))
+    if distribution == "lognormal":
+        return rng.lognormvariate(math.log(spec.get("median", 1)), spec.get("sigma", 0.5))
+    raise ValueError(f"Unknown latency distribution: {distribution}")
+
+
+def _words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(max(1, count)))
+
+
+def _instance(schema: dict, defs: dict, rng: random.Random, settings: dict):
+    """
+    Generate a value matching a JSON schema, as produced by pydantic for structured output.
+    """
+    if "$ref" in schema:
+        return _instance(defs[schema["$ref"].split("/")[-1]], defs, rng, settings)
+    if "anyOf" in schema:
+        options = [s for s in schema["anyOf"] if s.get("type") != "null"] or schema["anyOf"]
+        return _instance(options[0], defs, rng, settings)
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: _instance(prop, defs, rng, settings) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        count = rng.randint(settings["min_items"], settings["max_items"])
+        return [_instance(schema.get("items", {}), defs, rng, settings) for _ in range(count)]
+    if kind == "boolean":
+        return rng.random() < settings["true_probability"]
+    if kind == "integer":
+        return rng.randint(0, 100)
+    if kind == "number":
+        # Numbers in the structured outputs are scores between 0 and 1
+        return rng.random()
+    if kind == "null":
+        return None
+    return _words(rng, rng.randint(3, 20))
+
+
+def _prompt_tokens(messages: list) -> int:
+    characters = 0
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            characters += len(content)
+        else:
+            characters += sum(len(part.get("text", "")) for part in content)
+    return max(1, characters // 4)
+
+
+async def _inject_error(settings: dict, rng: random.Random):
+    """
+    Sleep for the sampled latency or fail, as configured by the error rates.
+    :return: An error response, or None if the request should succeed.
+    """
+    roll = rng.random()
+    if roll < settings["rate_limit_rate"]:
+        return web.json_response(
+            {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_error"}},
+            status=429,
+            headers={"retry-after": str(settings["retry_after"])},
+        )
+    roll -= settings["rate_limit_rate"]
+    if roll < settings["error_rate"]:
+        return web.json_response({"error": {"message": "Internal error (stub)", "type": "server_error"}}, status=500)
+    roll -= settings["error_rate"]
+    if roll < settings["timeout_rate"]:
+        await asyncio.sleep(settings["timeout_seconds"])
+    return None
+
+
+async def handle_chat_completion(request):
+    settings = request.app["settings"]
+    body = await request.json()
+    rng = _rng(settings, body, "chat")
+    attempt_rng = _rng(settings, body, "chat_attempt", request.app["attempts"])
+
+    error = await _inject_error(settings, attempt_rng)
+    if error is not None:
+        return error
+
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        schema = response_format["json_schema"]["schema"]
+        content = json.dumps(_instance(schema, schema.get("$defs", {}), rng, settings))
+    else:
+        low, high = settings["completion_tokens"]
+        content = _words(rng, rng.randint(low, high))
+
+    # Responses longer than the requested limit are cut like a provider does, structured output becomes invalid
+    finish_reason = "stop"
+    max_tokens = body.get("max_completion_tokens") or body.get("max_tokens")
+    if max_tokens is not None and len(content) // 4 > max_tokens:
+        content = content[:max_tokens * 4]
+        finish_reason = "length"
+
+    usage = {
+        "prompt_tokens": _prompt_tokens(body.get("messages", [])),
+        "completion_tokens": max(1, len(content) // 4),
+        "prompt_tokens_details": {"cached_tokens": 0},
+    }
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+    completion_id = "chatcmpl-stub-" + hashlib.sha1(content.encode("utf-8")).hexdigest()[:12]
+    model = body.get("model", "stub")
+    latency = _sample_latency(attempt_rng, settings["latency"])
+
+    if not body.get("stream"):
+        await asyncio.sleep(latency)
+        return web.json_response({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+            "usage": usage,
+        })
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    # Sampled latency is the time to the first token, every next token takes token_delay
+    await asyncio.sleep(latency)
+    await response.prepare(request)
+
+    def chunk(delta: dict, finish_reason=None, chunk_usage=None) -> bytes:
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+            "usage": chunk_usage,
+        }
+        return f"data: {json.dumps(data)}\n\n".encode("utf-8")
+
+    await response.write(chunk({"role": "assistant", "content": ""}))
+    for i, word in enumerate(content.split(" ")):
+        await response.write(chunk({"content": word if i == 0 else " " + word}))
+        await asyncio.sleep(settings["token_delay"])
+    await response.write(chunk({}, finish_reason=finish_reason))
+
+    if (body.get("stream_options") or {}).get("include_usage"):
+        await response.write(chunk(None, chunk_usage=usage))
+
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+
+async def handle_embeddings(request):
+    settings = request.app["settings"]
+    body = await request.json()
+    rng = _rng(settings, body, "embedding_attempt", request.app["attempts"])
+
+    error = await _inject_error(settings, rng)
+    if error is not None:
+        return error
+
+    inputs = body.get("input", [])
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    dimension = body.get("dimensions") or settings["dimension"]
+
+    data = []
+    for index, text in enumerate(inputs):
+        # Every text always gets the same unit vector, no matter what it is sent with
+        text_rng = _rng(settings, text, "vector")
+        vector = [text_rng.gauss(0, 1) for _ in range(dimension)]
+        norm = math.sqrt(sum(v * v for v in vector)) or 1
+        data.append({"object": "embedding", "index": index, "embedding": [v / norm for v in vector]})
+
+    tokens = sum(max(1, len(str(text)) // 4) for text in inputs)
+    await asyncio.sleep(_sample_latency(rng, settings["embedding_latency"]))
+    return web.json_response({
+        "object": "list",
+        "data": data,
+        "model": body.get("model", "stub"),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    })
+
+
+async def handle_models(request):
+    return web.json_response({"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]})
+
+
+def create_stub_app(
+    seed: int = 0,
+    latency: dict = None,
+    embedding_latency: dict = None,
+    token_delay: float = 0.01,
+    completion_tokens: list[int] = (50, 300),
+    dimension: int = 1024,
+    true_probability: float = 0.5,
+    min_items: int = 1,
+    max_items: int = 3,
+    error_rate: float = 0,
+    rate_limit_rate: float = 0,
+    retry_after: float = 1,
+    timeout_rate: float = 0,
+    timeout_seconds: float = 120,
+):
+    """
+    Create the stub API application, see :func:`run_stub_server`.
+    :param seed: Seed of all generated content, latencies and errors.
+    :param latency: Latency distribution of chat completions (time to first token when streaming), see :func:`_sample_latency`.
+    :param embedding_latency: Latency distribution of embedding requests.
+    :param token_delay: Seconds between streamed tokens.
+    :param completion_tokens: Range of the number of words of plain text responses.
+    :param dimension: Dimension of embeddings, unless the request asks for a specific one.
+    :param true_probability: Probability of generated booleans being true, for ``Questions`` the chance of being satisfied.
+    :param min_items: Minimal number of items of generated arrays.
+    :param max_items: Maximal number of items of generated arrays.
+    :param error_rate: Share of requests failing with 500.
+    :param rate_limit_rate: Share of requests failing with 429.
+    :param retry_after: Retry-after sent with 429 responses, in seconds.
+    :param timeout_rate: Share of requests taking ``timeout_seconds`` longer, to exercise client timeouts.
+    :param timeout_seconds: Extra delay of requests chosen by ``timeout_rate``.
+    :return: The application, not started yet.
+    """
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app["settings"] = {
+        "seed": seed,
+        "latency": latency or _DEFAULT_LATENCY,
+        "embedding_latency": embedding_latency or _DEFAULT_EMBEDDING_LATENCY,
+        "token_delay": token_delay,
+        "completion_tokens": list(completion_tokens),
+        "dimension": dimension,
+        "true_probability": true_probability,
+        "min_items": min_items,
+        "max_items": max_items,
+        "error_rate": error_rate,
+        "rate_limit_rate": rate_limit_rate,
+        "retry_after": retry_after,
+        "timeout_rate": timeout_rate,
+        "timeout_seconds": timeout_seconds,
+    }
+    app["attempts"] = Counter()
+
+    app.router.add_post("/v1/chat/completions", handle_chat_completion)
+    app.router.add_post("/v1/embeddings", handle_embeddings)
+    app.router.add_get("/v1/models", handle_models)
+    return app
+
+
+def run_stub_server(address: str = "127.0.0.1", port: int = 8090, **settings):
+    """
+    Starts the stub API, models and embedding models pointed at ``http://<address>:<port>/v1`` work without real providers.
+    :param address: Address to listen on.
+    :param port: Port to listen on.
+    :param settings: Seed, latencies and error rates of the stub, see :func:`create_stub_app`.
+    """
+    web.run_app(create_stub_app(**settings), host=address, port=port)
@@ -0,0 +1,143 @@
+import json
+from typing import Optional
+
+import psycopg2
+
+from src.vectordb.rating_storage import RatingStorage
+
+
+class AnswerCacheStorage:
+    """
+    AnswerCacheStorage keeps past user queries with their embedding and the full pipeline result, so paraphrased
+    questions can be answered without running the pipeline again.
+
+    Every entry remembers which files its answer was built from, :meth:`invalidate_files` removes the entries
+    that depend on files that were embedded again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        dimension: int,
+        host: str = None,
+        port: int = None,
+        user: str = None,
+        password: str = None,
+        database: str = None,
+        connection_string: str = None,
+        ratings_table: str = None,
+    ):
+        """
+        :param name: Name of the cache table.
+        :param dimension: Dimension of the query embeddings.
+        :param ratings_table: If set, only queries that have a positive rating in this :class:`RatingStorage` table are returned from :meth:`lookup`. The table is created if it does not exist yet.
+        """
+        if connection_string:
+            self.connection = psycopg2.connect(connection_string)
+        elif host and port and user and password and database:
+            self.connection = psycopg2.connect(
+                host=host, port=port, user=user, password=password, database=database
+            )
+        else:
+            raise ValueError(
+                "Invalid arguments. Either connection_string or host, port, user, password, and database must be provided."
+            )
+
+        self.table_name = name
+        self.dimension = dimension
+        self.ratings_table = ratings_table
+
+        self._create_table()
+
+    def _create_table(self) -> None:
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {self.table_name} (
+            id SERIAL PRIMARY KEY,
+            query TEXT,
+            embedding vector({self.dimension}),
+            result JSONB,
+            file_names TEXT[],
+            created_at TIMESTAMPTZ DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS idx_{self.table_name}_file_names ON {self.table_name} USING GIN (file_names);
+        """
+        if self.ratings_table:
+            # Ratings are otherwise only created by the Discord bot, lookups must not fail before it first ran
+            query += RatingStorage._create_table_query(self.ratings_table)
+        self._execute(query)
+
+    def _execute(self, query: str, params: tuple = None, fetch: bool = False) -> Optional[tuple]:
+        """
+        Run a statement in its own transaction.
+        :param fetch: Whether to return the first row of the result.
+        :return: The first row if fetch is set, None otherwise.
+        """
+        row = None
+        try:
+            # Cursors are created per call, the storage is shared by all threads answering queries
+            with self.connection.cursor() as cursor:
+                cursor.execute(query, params)
+                if fetch:
+                    row = cursor.fetchone()
+            self.connection.commit()
+        except Exception:
+            # A failed statement leaves the shared connection in an aborted transaction, failing every later call
+            self.connection.rollback()
+            raise
+        return row
+
+    def lookup(self, vector: list[float], min_similarity: float) -> Optional[dict]:
+        """
+        Find the most similar cached query.
+        :param vector: Embedding of the incoming query.
+        :param min_similarity: Minimal cosine similarity of the cached query for it to be used.
+        :return: The cached result as saved by :meth:`save`, or None if no query is similar enough.
+        """
+        rated = ""
+        if self.ratings_table:
+            rated = f"WHERE EXISTS (SELECT 1 FROM {self.ratings_table} AS rating WHERE rating.query = cache.query AND rating.score = 1)"
+
+        query = f"""
+        SELECT result, 1 - (embedding <=> %s::vector) AS similarity
+        FROM {self.table_name} AS cache
+        {rated}
+        ORDER BY embedding <=> %s::vector
+        LIMIT 1;
+        """
+        row = self._execute(query, (vector, vector), fetch=True)
+
+        if row is None or row[1] < min_similarity:
+            return None
+        return row[0]
+
+    def save(self, query_text: str, vector: list[float], result: dict, file_names: list[str]) -> None:
+        """
+        Cache the result of a query.
+        :param query_text: The user query.
+        :param vector: Embedding of the query.
+        :param result: JSON serializable pipeline result.
+        :param file_names: Files the answer was built from.
+        """
+        query = f"""
+        INSERT INTO {self.table_name} (query, embedding, result, file_names)
+        VALUES (%s, %s::vector, %s, %s);
+        """
+        self._execute(query, (query_text, vector, json.dumps(result), sorted(set(file_names))))
+
+    def invalidate_files(self, file_names: list[str]) -> None:
+        """
+        Remove every cached answer that was built from any of the given files.
+        :param file_names: Files that changed.
+        """
+        if not file_names:
+            return
+
+        query = f"DELETE FROM {self.table_name} WHERE file_names && %s::text[];"
+        self._execute(query, (list(file_names),))
+
+    def clear_table(self) -> bool:
+        """
+        Remove all entries from the cache.
+        """
+        self._execute(f"TRUNCATE TABLE {self.table_name};")
+        return True
@@ -0,0 +1,38 @@
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+
+
+def create_pool(
+    host: str = None,
+    port: int = None,
+    user: str = None,
+    password: str = None,
+    database: str = None,
+    connection_string: str = None,
+    min_size: int = 1,
+    max_size: int = 10,
+) -> AsyncConnectionPool:
+    """
+    Create an unopened psycopg 3 connection pool for use from asyncio code.
+    The pool is bound to the event loop it is opened in, so it has to be opened from inside that loop with ``await pool.open()``.
+
+    :param host: Database host.
+    :param port: Database port.
+    :param user: Database user.
+    :param password: Database password.
+    :param database: Database name.
+    :param connection_string: Full connection string, takes priority over the individual parameters.
+    :param min_size: Minimum number of connections kept open by the pool.
+    :param max_size: Maximum number of connections the pool is allowed to open.
+    :return: Unopened connection pool.
+    """
+    if connection_string:
+        conninfo = connection_string
+    elif host and port and user and password and database:
+        conninfo = make_conninfo(host=host, port=port, user=user, password=password, dbname=database)
+    else:
+        raise ValueError(
+            "Invalid arguments. Provide either connection_string or host, port, user, password, and database."
+        )
+
+    return AsyncConnectionPool(conninfo, min_size=min_size, max_size=max_size, open=False)
@@ -0,0 +1,130 @@
+from typing import Optional, List, Tuple
+
+from src.vectordb.async_pool import create_pool
+
+
+class AsyncRatingStorage:
+    """
+    Asyncio variant of :class:`RatingStorage`, storing queries, their answers, iteration count, cost, score and timestamp.
+    Uses the same table layout, so ratings saved by either class are visible to the other.
+
+    The connection pool has to be opened from inside the running event loop with :meth:`open` before use.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        host: str = None,
+        port: int = None,
+        user: str = None,
+        password: str = None,
+        database: str = None,
+        connection_string: str = None,
+        min_size: int = 1,
+        max_size: int = 5,
+    ):
+        self.pool = create_pool(
+            host=host,
+            port=port,
+            user=user,
+            password=password,
+            database=database,
+            connection_string=connection_string,
+            min_size=min_size,
+            max_size=max_size,
+        )
+        self.table_name = name
+
+    async def open(self) -> "AsyncRatingStorage":
+        """
+        Open the connection pool and make sure the table exists.
+        :return: self, so it can be chained after the constructor.
+        """
+        await self.pool.open()
+        await self._create_table()
+        return self
+
+    async def close(self):
+        """
+        Close the connection pool.
+        """
+        await self.pool.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _create_table(self) -> None:
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {self.table_name} (
+            id SERIAL PRIMARY KEY,
+            query TEXT,
+            answer TEXT,
+            iteration INTEGER,
+            cost FLOAT,
+            score INTEGER CHECK (score IN (0, 1)),
+            recorded_at TIMESTAMPTZ DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS idx_{self.table_name}_query ON {self.table_name} (query);
+        """
+        async with self.pool.connection() as connection:
+            await connection.execute(query)
+
+    async def save_query(self, query_text: str, answer: str, iteration: int, cost: float, score: int) -> None:
+        """
+        Insert a new query record.
+        :param query_text: The query string.
+        :param answer: The answer text.
+        :param iteration: Iteration number.
+        :param cost: Associated cost.
+        :param score: Score (0 or 1).
+        """
+        if score not in (0, 1):
+            raise ValueError("Score must be either 0 or 1.")
+
+        query = f"""
+        INSERT INTO {self.table_name} (query, answer, iteration, cost, score, recorded_at)
+        VALUES (%s, %s, %s, %s, %s, now());
+        """
+        async with self.pool.connection() as connection:
+            await connection.execute(query, (query_text, answer, iteration, cost, score))
+
+    async def get_query(self, query_text: str) -> Optional[Tuple[str, int, float, int, str]]:
+        """
+        Retrieve the most recent entry for a given query.
+        :param query_text: The query string.
+        :return: Tuple (answer, iteration, cost, score, recorded_at) or None if not found.
+        """
+        query = f"""
+        SELECT answer, iteration, cost, score, recorded_at FROM {self.table_name}
+        WHERE query = %s
+        ORDER BY recorded_at DESC
+        LIMIT 1;
+        """
+        async with self.pool.connection() as connection:
+            cursor = await connection.execute(query, (query_text,))
+            result = await cursor.fetchone()
+        return result if result else None
+
+    async def list_queries(self) -> List[str]:
+        """
+        List all distinct query strings stored in the table.
+        :return: List of query strings.
+        """
+        query = f"SELECT DISTINCT query FROM {self.table_name};"
+        async with self.pool.connection() as connection:
+            cursor = await connection.execute(query)
+            return [row[0] for row in await cursor.fetchall()]
+
+    async def delete_query(self, query_text: str) -> bool:
+        """
+        Delete all records matching a query string.
+        :param query_text: The query string to remove.
+        :return: True if deletion succeeded.
+        """
+        query = f"DELETE FROM {self.table_name} WHERE query = %s;"
+        async with self.pool.connection() as connection:
+            await connection.execute(query, (query_text,))
+        return True
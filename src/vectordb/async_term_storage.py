@@ -0,0 +1,117 @@
+from typing import List, Optional
+
+from src.vectordb.async_pool import create_pool
+
+
+class AsyncTermStorage:
+    """
+    Asyncio variant of :class:`TermStorage`, a key/value store for terms and their contexts.
+    Uses the same table layout, so terms saved by either class are visible to the other.
+
+    The connection pool has to be opened from inside the running event loop with :meth:`open` before use.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        host: str = None,
+        port: int = None,
+        user: str = None,
+        password: str = None,
+        database: str = None,
+        connection_string: str = None,
+        min_size: int = 1,
+        max_size: int = 5,
+    ):
+        self.pool = create_pool(
+            host=host,
+            port=port,
+            user=user,
+            password=password,
+            database=database,
+            connection_string=connection_string,
+            min_size=min_size,
+            max_size=max_size,
+        )
+        self.table_name = name
+
+    async def open(self) -> "AsyncTermStorage":
+        """
+        Open the connection pool and make sure the table exists.
+        :return: self, so it can be chained after the constructor.
+        """
+        await self.pool.open()
+        await self._create_table()
+        return self
+
+    async def close(self):
+        """
+        Close the connection pool.
+        """
+        await self.pool.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _create_table(self) -> None:
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {self.table_name} (
+            term TEXT PRIMARY KEY,
+            context TEXT,
+            updated_at TIMESTAMPTZ DEFAULT now()
+        );
+        """
+        async with self.pool.connection() as connection:
+            await connection.execute(query)
+
+    async def save_term(self, term: str, context: str) -> None:
+        """
+        Insert or update a term and its context.
+        :param term: The unique key identifying the term.
+        :param context: The associated context text.
+        """
+        query = f"""
+        INSERT INTO {self.table_name} (term, context)
+        VALUES (%s, %s)
+        ON CONFLICT (term) DO UPDATE
+        SET context = EXCLUDED.context,
+            updated_at = now();
+        """
+        async with self.pool.connection() as connection:
+            await connection.execute(query, (term, context))
+
+    async def get_context(self, term: str) -> Optional[str]:
+        """
+        Retrieve the context for a given term.
+        :param term: The term key.
+        :return: The context string, or None if not found.
+        """
+        query = f"SELECT context FROM {self.table_name} WHERE term = %s;"
+        async with self.pool.connection() as connection:
+            cursor = await connection.execute(query, (term,))
+            result = await cursor.fetchone()
+        return result[0] if result else None
+
+    async def list_terms(self) -> List[str]:
+        """
+        List all terms stored in the table.
+        :return: List of term keys.
+        """
+        query = f"SELECT term FROM {self.table_name};"
+        async with self.pool.connection() as connection:
+            cursor = await connection.execute(query)
+            return [row[0] for row in await cursor.fetchall()]
+
+    async def delete_term(self, term: str) -> bool:
+        """
+        Delete a term and its context.
+        :param term: The term key to remove.
+        :return: True if deletion succeeded.
+        """
+        query = f"DELETE FROM {self.table_name} WHERE term = %s;"
+        async with self.pool.connection() as connection:
+            await connection.execute(query, (term,))
+        return True
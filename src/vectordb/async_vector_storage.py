@@ -0,0 +1,208 @@
+from typing import Literal
+
+from psycopg.types.json import Jsonb
+
+from src.vectordb.async_pool import create_pool
+from src.vectordb.vector import Vector
+from src.vectordb.vector_storage import VectorStorage
+
+
+class AsyncVectorStorage:
+    """
+    Asyncio variant of :class:`VectorStorage`, meant to be used directly from event loop code (server, discord bot).
+
+    Works on the same table layout as :class:`VectorStorage`, so both can be used on the same table at the same time.
+    Connections come from a pool that has to be opened from inside the running event loop with :meth:`open`
+    (or by using the storage as ``async with``) before any other method is called.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        dimension: int,
+        host: str = None,
+        port: int = None,
+        user: str = None,
+        password: str = None,
+        database: str = None,
+        connection_string: str = None,
+        min_size: int = 1,
+        max_size: int = 10,
+    ):
+        self.pool = create_pool(
+            host=host,
+            port=port,
+            user=user,
+            password=password,
+            database=database,
+            connection_string=connection_string,
+            min_size=min_size,
+            max_size=max_size,
+        )
+        self.table_name = name
+        self.dimension = dimension
+
+    async def open(self) -> "AsyncVectorStorage":
+        """
+        Open the connection pool, make sure the table exists and has the expected dimension.
+        :return: self, so it can be chained after the constructor.
+        """
+        await self.pool.open()
+        await self._create_table()
+
+        actual_dimension = await self._vector_size()
+        if actual_dimension != self.dimension:
+            raise ValueError(
+                f"Dimension of the {self.table_name} table must be {actual_dimension} not {self.dimension} as specified the first time the table was created."
+            )
+
+        return self
+
+    async def close(self):
+        """
+        Close the connection pool.
+        """
+        await self.pool.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _fetchall(self, query: str, params: tuple = None) -> list[tuple]:
+        async with self.pool.connection() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(query, params)
+                return await cursor.fetchall()
+
+    async def _execute(self, query: str, params: tuple = None):
+        async with self.pool.connection() as connection:
+            await connection.execute(query, params)
+
+    async def _vector_size(self) -> int | None:
+        query = f"""
+                SELECT attname, atttypmod
+                FROM pg_attribute
+                WHERE attrelid = '{self.table_name}'::regclass
+                AND attname = 'embedding';
+                """
+
+        results = await self._fetchall(query)
+        if results:
+            return results[0][1]
+        return None
+
+    async def _create_table(self):
+        await self._execute(VectorStorage._create_table_query(self.table_name, self.dimension))
+        await self._execute(VectorStorage._create_indexes_query(self.table_name))
+
+    async def insert(self, vector: Vector):
+        """
+        Insert a new vector into the database.
+        :param vector: The vector to be stored, ID and updated_at fields are ignored.
+        :return:
+        """
+        query = f"""
+                INSERT INTO {self.table_name} (embedding, file_name, file_position, content, content_hash, metadata)
+                VALUES (%s::vector, %s, %s, %s, %s, %s);
+                """
+
+        await self._execute(
+            query,
+            (
+                vector.vector,
+                vector.file_name,
+                vector.file_position,
+                vector.content,
+                VectorStorage.content_hash(vector.content),
+                Jsonb(vector.metadata),
+            ),
+        )
+
+    async def batch_insert(self, entries: list[Vector]):
+        """
+        Insert multiple vectors in a single transaction.
+        :param entries: List of Vector objects to insert. Note that ID and updated_at fields are ignored.
+        """
+        if not entries:
+            return
+
+        query = f"""
+            INSERT INTO {self.table_name}
+            (embedding, file_name, file_position, content, content_hash, metadata)
+            VALUES (%s::vector, %s, %s, %s, %s, %s)
+        """
+
+        data = [
+            (
+                entry.vector,
+                entry.file_name,
+                entry.file_position,
+                entry.content,
+                VectorStorage.content_hash(entry.content),
+                Jsonb(entry.metadata),
+            )
+            for entry in entries
+        ]
+
+        async with self.pool.connection() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.executemany(query, data)
+
+    async def query(
+        self,
+        vector: list[float],
+        n: int = 10,
+        distance: Literal[
+            "l2", "inner_product", "cosine", "l1", "hamming", "jaccard"
+        ] = "cosine",
+    ) -> list[Vector]:
+        """
+        Find the n closest vectors to the given vector, see :meth:`VectorStorage.query`.
+        :param vector: The vector to search for.
+        :param n: Number of results to return.
+        :param distance: Distance function to order by.
+        :return: List of closest vectors.
+        """
+
+        results = await self._fetchall(VectorStorage._search_query(self.table_name, distance), (vector, n, n))
+        return [VectorStorage._parse(result) for result in results]
+
+    async def get_neighbours(self, ids: list[int], k: int = 1) -> list[list[Vector]]:
+        """
+        Fetch the chunks surrounding each of the given chunks in a single query, see :meth:`VectorStorage.get_neighbours`.
+        :param ids: IDs of the chunks to expand, ordered by relevance.
+        :param k: How many neighbouring chunks to include on each side.
+        :return: List of windows of consecutive chunks, ordered by the most relevant id they contain.
+        """
+        if not ids:
+            return []
+
+        results = await self._fetchall(VectorStorage._neighbours_query(self.table_name), (list(ids), k, k))
+        return VectorStorage._merge_windows([VectorStorage._parse(result) for result in results], ids)
+
+    async def data_version(self) -> str:
+        """
+        Get a cheap fingerprint of the stored data, see :meth:`VectorStorage.data_version`.
+        :return: Opaque version string.
+        """
+        results = await self._fetchall(VectorStorage._data_version_query(self.table_name))
+        return results[0][0]
+
+    async def get_file(self, file_name: str) -> list[Vector]:
+        """
+        Get all chunks of a file, including the ones stored only as references, see :meth:`VectorStorage.get_file`.
+        :param file_name: Name of the file.
+        :return: Chunks ordered by their position in the file.
+        """
+        results = await self._fetchall(VectorStorage._get_file_query(self.table_name), (file_name, file_name))
+        return [VectorStorage._parse(result) for result in results]
+
+    async def delete_file(self, file_name: str) -> bool:
+        async with self.pool.connection() as connection:
+            async with connection.transaction():
+                for query in VectorStorage._delete_file_queries(self.table_name):
+                    await connection.execute(query, {"file_name": file_name})
+
+        return True
@@ -40,9 +40,10 @@ class RatingStorage:
         # Ensure table exists
         self._create_table()
 
-    def _create_table(self) -> None:
-        query = f"""
-        CREATE TABLE IF NOT EXISTS {self.table_name} (
+    @staticmethod
+    def _create_table_query(table_name: str) -> str:
+        return f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
             id SERIAL PRIMARY KEY,
             query TEXT,
             answer TEXT,
@@ -51,9 +52,11 @@ class RatingStorage:
             score INTEGER CHECK (score IN (0, 1)),
             recorded_at TIMESTAMPTZ DEFAULT now()
         );
-        CREATE INDEX IF NOT EXISTS idx_{self.table_name}_query ON {self.table_name} (query);
+        CREATE INDEX IF NOT EXISTS idx_{table_name}_query ON {table_name} (query);
         """
-        self.cursor.execute(query)
+
+    def _create_table(self) -> None:
+        self.cursor.execute(self._create_table_query(self.table_name))
         self.connection.commit()
 
     def save_query(self, query_text: str, answer: str, iteration: int, cost: float, score: int) -> None:
@@ -18,6 +18,7 @@ class Vector:
     metadata: dict
     id: Optional[int] = None
     updated_at: Optional[datetime] = None
+    distance: Optional[float] = None
 
     @classmethod
     def from_chunk(cls, chunk: Chunk, vector: List[float]) -> "Vector":
@@ -1,4 +1,6 @@
+import hashlib
 import json
+import time
 from typing import Literal
 
 import psycopg2
@@ -15,8 +17,39 @@ class VectorStorage:
 
     If the same table name is used it is persisted between different instances of the class. You need to set the same dimension every time, for the same table name.
     You can use :meth:`delete_table` to remove the table from the database, and thus resting it.
+
+    To rebuild the table without downtime, fill a table from :meth:`create_shadow` and replace the live table with it using :meth:`swap`.
+
+    Chunks with the same content are stored and embedded only once. Every other occurrence is kept as a reference
+    in the ``<table>_refs`` table, pointing at the stored chunk, see :meth:`batch_insert_references`. Searches and
+    neighbouring chunks return references like stored chunks, with the file and position of the reference.
     """
 
+    DISTANCE_OPERATORS = {
+        "l2": "<->",
+        "inner_product": "<#>",
+        "cosine": "<=>",
+        "l1": "<+>",
+        "hamming": "<~>",
+        "jaccard": "<%>",
+    }
+
+    # How long :meth:`swap` waits for readers to release the live table per attempt, and how often it tries
+    SWAP_LOCK_TIMEOUT = "2s"
+    SWAP_ATTEMPTS = 30
+
+    # Secondary indexes, keyed by the suffix of their name (idx_<table>_<suffix>)
+    INDEXES = {
+        "file": "(file_name, file_position)",
+        "hash": "(content_hash)",
+    }
+
+    # Secondary indexes of the references table (idx_<table>_refs_<suffix>)
+    REFS_INDEXES = {
+        "file": "(file_name, file_position)",
+        "vector": "(vector_id)",
+    }
+
     def __init__(
         self,
         name: str,
@@ -39,7 +72,6 @@ class VectorStorage:
                 "Invalid arguments. Either connection_string or host, port, user, password, and database must be provided."
             )
 
-        self.cursor = self.connection.cursor()
         self.table_name = name
         self.dimension = dimension
 
@@ -51,6 +83,28 @@ class VectorStorage:
                 f"Dimension of the {self.table_name} table must be {actual_dimension} not {self.dimension} as specified the first time the table was created."
             )
 
+    def _fetchall(self, query: str, params=None) -> list[tuple]:
+        # Cursors are created per call, the storage is shared by the threads of the storage worker pool
+        with self.connection.cursor() as cursor:
+            try:
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+            except Exception:
+                self.connection.rollback()
+                raise
+        # Reads end their transaction too, an idle one keeps the table locked and blocks :meth:`swap` of another process
+        self.connection.commit()
+        return rows
+
+    def _execute(self, query: str, params=None):
+        with self.connection.cursor() as cursor:
+            try:
+                cursor.execute(query, params)
+            except Exception:
+                self.connection.rollback()
+                raise
+        self.connection.commit()
+
     def _vector_size(self) -> int | None:
         query = f"""
                 SELECT attname, atttypmod
@@ -59,32 +113,67 @@ class VectorStorage:
                 AND attname = 'embedding';
                 """
 
-        self.cursor.execute(query)
-        result = self.cursor.fetchone()
-        if result:
-            return result[1]
+        results = self._fetchall(query)
+        if results:
+            return results[0][1]
         return None
 
-    def _create_table(self):
-        query = f"""
-                CREATE TABLE IF NOT EXISTS {self.table_name} (
+    @property
+    def refs_table_name(self) -> str:
+        return f"{self.table_name}_refs"
+
+    @staticmethod
+    def _create_table_query(table_name: str, dimension: int) -> str:
+        return f"""
+                CREATE TABLE IF NOT EXISTS {table_name} (
                 id SERIAL PRIMARY KEY,
-                embedding vector({self.dimension}),
+                embedding vector({dimension}),
                 file_name text,
                 file_position integer,
                 content text,
+                content_hash text,
+                metadata jsonb,
+                updated_at timestamp with time zone DEFAULT now()
+                );
+                ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS content_hash text;
+                CREATE TABLE IF NOT EXISTS {table_name}_refs (
+                id SERIAL PRIMARY KEY,
+                vector_id integer REFERENCES {table_name} (id) ON DELETE CASCADE,
+                file_name text,
+                file_position integer,
                 metadata jsonb,
                 updated_at timestamp with time zone DEFAULT now()
                 );
                 """
 
-        self.cursor.execute(query)
-        self.connection.commit()
+    @classmethod
+    def _create_indexes_query(cls, table_name: str) -> str:
+        statements = [
+            f"CREATE INDEX IF NOT EXISTS idx_{table_name}_{suffix} ON {table_name} {columns};"
+            for suffix, columns in cls.INDEXES.items()
+        ]
+        statements += [
+            f"CREATE INDEX IF NOT EXISTS idx_{table_name}_refs_{suffix} ON {table_name}_refs {columns};"
+            for suffix, columns in cls.REFS_INDEXES.items()
+        ]
+        return "\n".join(statements)
+
+    def _create_table(self, indexes: bool = True):
+        self._execute(self._create_table_query(self.table_name, self.dimension))
+
+        if indexes:
+            self.create_indexes()
+
+    def create_indexes(self):
+        """
+        Create the secondary indexes of the table if they don't exist yet.
+        :return:
+        """
+        self._execute(self._create_indexes_query(self.table_name))
 
     def _install_extension(self):
         query = "CREATE EXTENSION IF NOT EXISTS vector;"
-        self.cursor.execute(query)
-        self.connection.commit()
+        self._execute(query)
 
 
     def list_tables(self) -> list[str]:
@@ -93,8 +182,7 @@ class VectorStorage:
         :return: List of table names.
         """
         query = "SELECT table_name FROM information_schema.tables WHERE table_schema='public';"
-        self.cursor.execute(query)
-        tables = self.cursor.fetchall()
+        tables = self._fetchall(query)
         return [table[0] for table in tables]
 
     def delete_table(self) -> bool:
@@ -102,11 +190,26 @@ class VectorStorage:
         Drop the table from the database. Removing all data.
         :return:
         """
-        query = f"DROP TABLE IF EXISTS {self.table_name};"
-        self.cursor.execute(query)
-        self.connection.commit()
+        query = f"DROP TABLE IF EXISTS {self.refs_table_name}; DROP TABLE IF EXISTS {self.table_name};"
+        self._execute(query)
         return True
 
+    @staticmethod
+    def normalized_content(content: str) -> str:
+        """
+        Content of a chunk without differences in whitespace and case, near duplicates have to match in it.
+        """
+        return " ".join(content.split()).casefold()
+
+    @staticmethod
+    def content_hash(content: str) -> str:
+        """
+        Hash used to recognize chunks with identical content.
+        :param content: Text content of the chunk.
+        :return: Hex digest of the content.
+        """
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
     def insert(self, vector: Vector):
         """
         Insert a new vector into the database.
@@ -118,21 +221,21 @@ class VectorStorage:
         :return:
         """
         query = f"""
-                INSERT INTO {self.table_name} (embedding, file_name, file_position, content, metadata)
-                VALUES (%s, %s, %s, %s, %s);
+                INSERT INTO {self.table_name} (embedding, file_name, file_position, content, content_hash, metadata)
+                VALUES (%s, %s, %s, %s, %s, %s);
                 """
 
-        self.cursor.execute(
+        self._execute(
             query,
             (
                 vector,
                 vector.file_name,
                 vector.file_position,
                 vector.content,
+                self.content_hash(vector.content),
                 json.dumps(vector.metadata),
             ),
         )
-        self.connection.commit()
 
     def batch_insert(
         self,
@@ -155,8 +258,8 @@ class VectorStorage:
 
         query = f"""
             INSERT INTO {self.table_name} 
-            (embedding, file_name, file_position, content, metadata)
-            VALUES (%s, %s, %s, %s, %s)
+            (embedding, file_name, file_position, content, content_hash, metadata)
+            VALUES (%s, %s, %s, %s, %s, %s)
         """
 
         # Prepare data tuples in correct order
@@ -166,6 +269,7 @@ class VectorStorage:
                 entry.file_name,
                 entry.file_position,
                 entry.content,
+                self.content_hash(entry.content),
                 json.dumps(entry.metadata),
             )
             for entry in entries
@@ -177,10 +281,87 @@ class VectorStorage:
         ) as pbar:
             for i in range(0, len(data), batch_size):
                 batch = data[i : i + batch_size]
-                execute_batch(self.cursor, query, batch, page_size=page_size)
+                with self.connection.cursor() as cursor:
+                    execute_batch(cursor, query, batch, page_size=page_size)
                 pbar.update(len(batch))
                 self.connection.commit()
 
+    def batch_insert_references(self, references: list[tuple[int, Vector]]):
+        """
+        Record additional occurrences of already stored chunks. The referenced chunk provides the content and embedding,
+        the reference only keeps where in which file the chunk appeared again.
+
+        :param references: Pairs of (id of the stored chunk, occurrence), only file_name, file_position and metadata of the occurrence are used.
+        """
+        if not references:
+            return
+
+        query = f"""
+            INSERT INTO {self.refs_table_name}
+            (vector_id, file_name, file_position, metadata)
+            VALUES (%s, %s, %s, %s)
+        """
+
+        data = [
+            (vector_id, entry.file_name, entry.file_position, json.dumps(entry.metadata))
+            for vector_id, entry in references
+        ]
+
+        with self.connection.cursor() as cursor:
+            execute_batch(cursor, query, data, page_size=500)
+        self.connection.commit()
+
+    def find_by_hashes(self, hashes: list[str]) -> dict[str, int]:
+        """
+        Look up stored chunks by the hash of their content, see :meth:`content_hash`.
+        :param hashes: Content hashes to look for.
+        :return: Mapping of the found hashes to the id of the stored chunk.
+        """
+        if not hashes:
+            return {}
+
+        query = f"""
+                SELECT DISTINCT ON (content_hash) content_hash, id
+                FROM {self.table_name}
+                WHERE content_hash = ANY(%s)
+                ORDER BY content_hash, id;
+                """
+
+        rows = self._fetchall(query, (list(set(hashes)),))
+        return {content_hash: vector_id for content_hash, vector_id in rows}
+
+    def find_near_duplicates(self, vectors: list[list[float]], contents: list[str], max_distance: float) -> dict[int, int]:
+        """
+        Find stored chunks that are nearly identical to the given chunks, in a single query. A stored chunk is only a
+        near duplicate if its content is the same as well, apart from whitespace and case, see :meth:`normalized_content`,
+        as a reference shows the content of the stored chunk.
+        :param vectors: Embeddings of the chunks to check.
+        :param contents: Contents of the chunks to check.
+        :param max_distance: Maximum cosine distance for two chunks to be considered duplicates.
+        :return: Mapping of the index of every chunk with a near duplicate to the id of its closest stored chunk.
+        """
+        if not vectors:
+            return {}
+
+        query = f"""
+                SELECT candidate.position, nearest.id, nearest.content
+                FROM unnest(%s::text[]) WITH ORDINALITY AS candidate (embedding, position)
+                CROSS JOIN LATERAL (
+                    SELECT id, content, embedding <=> candidate.embedding::vector AS distance
+                    FROM {self.table_name}
+                    ORDER BY distance
+                    LIMIT 1
+                ) AS nearest
+                WHERE nearest.distance <= %s;
+                """
+
+        rows = self._fetchall(query, ([json.dumps(list(v)) for v in vectors], max_distance))
+        return {
+            position - 1: vector_id
+            for position, vector_id, content in rows
+            if self.normalized_content(content) == self.normalized_content(contents[position - 1])
+        }
+
     def query(
         self,
         vector: list[float],
@@ -189,68 +370,269 @@ class VectorStorage:
             "l2", "inner_product", "cosine", "l1", "hamming", "jaccard"
         ] = "cosine",
     ) -> list[Vector]:
+        """
+        Find the n closest chunks to the given vector. Occurrences stored as references are returned with their own
+        file and position, each of them counts towards n.
+        :param vector: The vector to search for.
+        :param n: Number of results to return.
+        :param distance: Distance function to order by.
+        :return: List of closest chunks.
+        """
+        results = self._fetchall(self._search_query(self.table_name, distance), (vector, n, n))
 
-        dic = {
-            "l2": "<->",
-            "inner_product": "<#>",
-            "cosine": "<=>",
-            "l1": "<+>",
-            "hamming": "<~>",
-            "jaccard": "<%>",
-        }
+        vectors = [self._parse(result) for result in results]
 
-        symbol = dic[distance]
+        return vectors
 
-        query = f"""
-                SELECT id, embedding, file_name, file_position, content, metadata, updated_at, embedding {symbol} %s::vector as distance
-                FROM {self.table_name}
-                ORDER BY distance
+    @classmethod
+    def _search_query(cls, table_name: str, distance: str) -> str:
+        # All occurrences of a chunk are equally close, so the n closest are among those of the n closest stored chunks
+        return f"""
+                WITH nearest AS (
+                    SELECT id, embedding, file_name, file_position, content, metadata, updated_at,
+                           embedding {cls.DISTANCE_OPERATORS[distance]} %s::vector AS distance
+                    FROM {table_name}
+                    ORDER BY distance
+                    LIMIT %s
+                )
+                SELECT id, embedding, file_name, file_position, content, metadata, updated_at, distance
+                FROM nearest
+                UNION ALL
+                SELECT nearest.id, nearest.embedding, ref.file_name, ref.file_position, nearest.content, ref.metadata, ref.updated_at, nearest.distance
+                FROM nearest
+                JOIN {table_name}_refs AS ref ON ref.vector_id = nearest.id
+                ORDER BY distance, id
                 LIMIT %s;
                 """
 
-        self.cursor.execute(query, (vector, n))
-        results = self.cursor.fetchall()
+    @staticmethod
+    def _neighbours_query(table_name: str) -> str:
+        # Windows are taken around every occurrence of the hits, references in them show the content they point at
+        return f"""
+                WITH occurrence AS (
+                    SELECT id AS vector_id, file_name, file_position, metadata, updated_at
+                    FROM {table_name}
+                    UNION ALL
+                    SELECT vector_id, file_name, file_position, metadata, updated_at
+                    FROM {table_name}_refs
+                )
+                SELECT stored.id, stored.embedding, neighbour.file_name, neighbour.file_position, stored.content, neighbour.metadata, neighbour.updated_at
+                FROM occurrence AS neighbour
+                JOIN {table_name} AS stored ON stored.id = neighbour.vector_id
+                WHERE EXISTS (
+                    SELECT 1
+                    FROM occurrence AS hit
+                    WHERE hit.vector_id = ANY(%s)
+                      AND hit.file_name = neighbour.file_name
+                      AND neighbour.file_position BETWEEN hit.file_position - %s AND hit.file_position + %s
+                )
+                ORDER BY neighbour.file_name, neighbour.file_position;
+                """
 
-        vectors = [self._parse(result) for result in results]
+    def get_neighbours(self, ids: list[int], k: int = 1) -> list[list[Vector]]:
+        """
+        Fetch the chunks surrounding each of the given chunks (up to k positions before and after them in the same file) in a single query.
+        Overlapping or touching windows from the same file are merged, so every chunk is returned only once.
 
-        return vectors
+        :param ids: IDs of the chunks to expand, ordered by relevance.
+        :param k: How many neighbouring chunks to include on each side.
+        :return: List of windows, each window is a list of consecutive chunks from one file. Windows are ordered by the most relevant id they contain.
+        """
+        if not ids:
+            return []
 
-    def get_file(self, file_name: str) -> list[Vector]:
-        query = f"""
-                SELECT *
-                FROM {self.table_name}
+        results = self._fetchall(self._neighbours_query(self.table_name), (list(ids), k, k))
+
+        return self._merge_windows([self._parse(result) for result in results], ids)
+
+    @staticmethod
+    def _data_version_query(table_name: str) -> str:
+        # Write counters of the table and its references, a swapped in table has a different relid
+        return f"""
+                SELECT coalesce(string_agg(relid || ':' || (n_tup_ins + n_tup_upd + n_tup_del), ',' ORDER BY relname), '')
+                FROM pg_stat_user_tables
+                WHERE relname IN (lower('{table_name}'), lower('{table_name}_refs'));
+                """
+
+    def data_version(self) -> str:
+        """
+        Get a cheap fingerprint of the stored data, it changes whenever files are embedded, deleted or the table is rebuilt.
+        Based on PostgreSQL statistics, so a change can take a moment to show.
+        :return: Opaque version string.
+        """
+        # Statistics are read once per transaction, every read ending its transaction makes the next call see new writes
+        return self._fetchall(self._data_version_query(self.table_name))[0][0]
+
+    @staticmethod
+    def _get_file_query(table_name: str) -> str:
+        return f"""
+                SELECT id, embedding, file_name, file_position, content, metadata, updated_at
+                FROM {table_name}
                 WHERE file_name = %s
+                UNION ALL
+                SELECT stored.id, stored.embedding, ref.file_name, ref.file_position, stored.content, ref.metadata, ref.updated_at
+                FROM {table_name}_refs AS ref
+                JOIN {table_name} AS stored ON stored.id = ref.vector_id
+                WHERE ref.file_name = %s
+                ORDER BY file_position;
                 """
 
-        self.cursor.execute(query, (file_name,))
-        results = self.cursor.fetchall()
+    @staticmethod
+    def _delete_file_queries(table_name: str) -> list[str]:
+        # Chunks of the file that other files reference are handed over to one of those references instead of being deleted
+        return [
+            f"""
+                WITH promoted AS (
+                    SELECT DISTINCT ON (ref.vector_id) ref.id, ref.vector_id, ref.file_name, ref.file_position, ref.metadata, ref.updated_at
+                    FROM {table_name}_refs AS ref
+                    JOIN {table_name} AS stored ON stored.id = ref.vector_id
+                    WHERE stored.file_name = %(file_name)s AND ref.file_name <> %(file_name)s
+                    ORDER BY ref.vector_id, ref.id
+                ), handed_over AS (
+                    UPDATE {table_name} AS stored
+                    SET file_name = promoted.file_name,
+                        file_position = promoted.file_position,
+                        metadata = promoted.metadata,
+                        updated_at = promoted.updated_at
+                    FROM promoted
+                    WHERE stored.id = promoted.vector_id
+                    RETURNING promoted.id
+                )
+                DELETE FROM {table_name}_refs
+                WHERE id IN (SELECT id FROM handed_over) OR file_name = %(file_name)s;
+                """,
+            f"""
+                DELETE FROM {table_name}
+                WHERE file_name = %(file_name)s;
+                """,
+        ]
+
+    def get_file(self, file_name: str) -> list[Vector]:
+        """
+        Get all chunks of a file, including the ones stored only as references to identical chunks of other files.
+        :param file_name: Name of the file.
+        :return: Chunks ordered by their position in the file.
+        """
+        results = self._fetchall(self._get_file_query(self.table_name), (file_name, file_name))
 
         vectors = [self._parse(result) for result in results]
 
         return vectors
 
     def delete_file(self, file_name: str) -> bool:
-        query = f"""
-                DELETE FROM {self.table_name}
-                WHERE file_name = %s
-                """
-
-        self.cursor.execute(query, (file_name,))
-        self.connection.commit()
+        self._execute("\n".join(self._delete_file_queries(self.table_name)), {"file_name": file_name})
 
         return True
 
 
+    def create_shadow(self) -> "VectorStorage":
+        """
+        Create an empty shadow table next to the live one, to be filled and then put in place with :meth:`swap`.
+        Any leftover shadow table from an interrupted rebuild is dropped. The shadow table only has the content hash
+        index, that chunks are looked up by while loading, the other secondary indexes are built by :meth:`swap` once
+        the bulk load is done.
+
+        :return: VectorStorage working on the shadow table, sharing this storage's connection.
+        """
+        cls = self.__class__
+        shadow = cls.__new__(cls)
+        shadow.connection = self.connection
+        shadow.table_name = f"{self.table_name}_shadow"
+        shadow.dimension = self.dimension
+
+        shadow._execute(f"DROP TABLE IF EXISTS {shadow.refs_table_name}; DROP TABLE IF EXISTS {shadow.table_name};")
+        shadow._create_table(indexes=False)
+        shadow._execute(f"CREATE INDEX IF NOT EXISTS idx_{shadow.table_name}_hash ON {shadow.table_name} {cls.INDEXES['hash']};")
+
+        return shadow
+
+    def swap(self, shadow: "VectorStorage") -> bool:
+        """
+        Atomically replace the live table with the shadow table and drop the old data.
+        Readers see either the old or the new table, never an empty or partially filled one.
+        The renames wait at most :attr:`SWAP_LOCK_TIMEOUT` for running reads, so new reads never queue up behind them
+        for long, and are retried up to :attr:`SWAP_ATTEMPTS` times.
+
+        :param shadow: Storage returned by :meth:`create_shadow`, it should not be used afterwards.
+        :return:
+        """
+        shadow.create_indexes()
+
+        old_name = f"{self.table_name}_old"
+        statements = [
+            f"SET LOCAL lock_timeout = '{self.SWAP_LOCK_TIMEOUT}';",
+            f"DROP TABLE IF EXISTS {old_name}_refs;",
+            f"DROP TABLE IF EXISTS {old_name};",
+        ]
+        statements += self._rename_statements(self.table_name, old_name)
+        statements += self._rename_statements(shadow.table_name, self.table_name)
+        statements += [f"DROP TABLE {old_name}_refs;", f"DROP TABLE {old_name};"]
+
+        # psycopg2 runs everything up to the commit in a single transaction, so the renames become visible together
+        for attempt in range(self.SWAP_ATTEMPTS):
+            try:
+                with self.connection.cursor() as cursor:
+                    for statement in statements:
+                        cursor.execute(statement)
+                self.connection.commit()
+                return True
+            except psycopg2.errors.LockNotAvailable:
+                self.connection.rollback()
+                if attempt + 1 == self.SWAP_ATTEMPTS:
+                    raise
+                print(f"Table {self.table_name} is busy, retrying the swap ({attempt + 1}/{self.SWAP_ATTEMPTS})")
+                time.sleep(1)
+            except Exception:
+                self.connection.rollback()
+                raise
+
     def clear_table(self):
         """
         Clear all data from the table.
         :return:
         """
-        query = f"DELETE FROM {self.table_name};"
-        self.cursor.execute(query)
-        self.connection.commit()
+        query = f"DELETE FROM {self.refs_table_name}; DELETE FROM {self.table_name};"
+        self._execute(query)
         return True
 
+    @classmethod
+    def _rename_statements(cls, table_name: str, new_name: str) -> list[str]:
+        """
+        Statements renaming a table, its references table and all of their indexes.
+        """
+        statements = [
+            f"ALTER TABLE IF EXISTS {table_name} RENAME TO {new_name};",
+            f"ALTER TABLE IF EXISTS {table_name}_refs RENAME TO {new_name}_refs;",
+        ]
+        statements += [
+            f"ALTER INDEX IF EXISTS idx_{table_name}_{suffix} RENAME TO idx_{new_name}_{suffix};"
+            for suffix in cls.INDEXES
+        ]
+        statements += [
+            f"ALTER INDEX IF EXISTS idx_{table_name}_refs_{suffix} RENAME TO idx_{new_name}_refs_{suffix};"
+            for suffix in cls.REFS_INDEXES
+        ]
+        return statements
+
+    @staticmethod
+    def _merge_windows(vectors: list[Vector], ids: list[int]) -> list[list[Vector]]:
+        """
+        Split vectors sorted by file name and position into runs of consecutive chunks, ordered by the rank of the ids they contain.
+        """
+        windows = []
+        for vector in vectors:
+            if (
+                windows
+                and windows[-1][-1].file_name == vector.file_name
+                and windows[-1][-1].file_position + 1 >= vector.file_position
+            ):
+                windows[-1].append(vector)
+            else:
+                windows.append([vector])
+
+        rank = {vector_id: i for i, vector_id in reversed(list(enumerate(ids)))}
+        return sorted(windows, key=lambda window: min(rank.get(v.id, len(ids)) for v in window))
+
     @staticmethod
     def _parse(result) -> Vector:
         return Vector(
@@ -261,4 +643,5 @@ class VectorStorage:
             content=result[4],
             metadata=result[5],
             updated_at=result[6],
+            distance=result[7] if len(result) > 7 else None,
         )
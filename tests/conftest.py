@@ -0,0 +1,173 @@
+"""
+Fixtures running the pipeline against the stub API of :mod:`src.routines.stub_routine` and an in-memory vector storage,
+so no model provider, network access or PostgreSQL is needed.
+"""
+from collections import Counter
+from dataclasses import dataclass
+
+import numpy as np
+import pytest
+from aiohttp.test_utils import TestServer
+
+from src.document_parsing import Chunk
+from src.models.agents import Agents
+from src.models.llmodel import LLModel
+from src.models.os_embedding import OAEmbedding
+from src.models.qna_pipline import QAPipeline
+from src.routines.stub_routine import create_stub_app
+from src.vectordb.vector import Vector
+from src.vectordb.vector_storage import VectorStorage
+
+DIMENSION = 16
+FAST = {"distribution": "fixed", "value": 0.01}
+
+
+class MemoryVectorStorage:
+    """
+    The read side of :class:`AsyncVectorStorage` over a list of vectors, the chunks of one file are its positions in order.
+    """
+
+    table_name = "memory"
+
+    def __init__(self, vectors: list[Vector]):
+        self.vectors = vectors
+        self.opened = False
+        for index, vector in enumerate(self.vectors):
+            vector.id = index + 1
+
+    async def open(self):
+        self.opened = True
+
+    async def close(self):
+        self.opened = False
+
+    async def query(self, vector: list[float], n: int = 10) -> list[Vector]:
+        matrix = np.array([v.vector for v in self.vectors])
+        distances = 1 - matrix @ np.array(vector) / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(vector))
+        return [
+            Vector(**{**self.vectors[i].__dict__, "distance": float(distances[i])}) for i in np.argsort(distances)[:n]
+        ]
+
+    async def get_neighbours(self, ids: list[int], k: int = 1) -> list[list[Vector]]:
+        hits = [v for v in self.vectors if v.id in ids]
+        window = [
+            v for v in self.vectors
+            if any(v.file_name == h.file_name and abs(v.file_position - h.file_position) <= k for h in hits)
+        ]
+        return VectorStorage._merge_windows(window, ids)
+
+    async def data_version(self) -> str:
+        return str(len(self.vectors))
+
+
+class WordEmbedding:
+    """
+    Embeds texts by the letters they contain, so texts differing only in punctuation are near duplicates.
+    """
+
+    def embed(self, texts: list[str]) -> list[np.ndarray]:
+        return [
+            np.array([text.lower().count(letter) for letter in "abcdefghijklmnopqrstuvwxyz"], dtype=np.float32) + 1
+            for text in texts
+        ]
+
+
+class FakeVectorStorage:
+    """
+    The write side of :class:`VectorStorage` used by the embedding routine, keeping rows and references in lists.
+    A shadow is another empty instance, swapping it in takes over its rows.
+    """
+
+    def __init__(self):
+        self.vectors: list[Vector] = []
+        self.references: list[tuple[int, Chunk]] = []
+
+    def find_by_hashes(self, hashes: list[str]) -> dict[str, int]:
+        return {
+            VectorStorage.content_hash(v.content): v.id for v in self.vectors if VectorStorage.content_hash(v.content) in hashes
+        }
+
+    def find_near_duplicates(self, vectors: list[list[float]], contents: list[str], max_distance: float) -> dict[int, int]:
+        duplicates = {}
+        for index, (vector, content) in enumerate(zip(vectors, contents)):
+            for stored in self.vectors:
+                distance = 1 - np.dot(vector, stored.vector) / (np.linalg.norm(vector) * np.linalg.norm(stored.vector))
+                same = VectorStorage.normalized_content(stored.content) == VectorStorage.normalized_content(content)
+                if distance <= max_distance and same:
+                    duplicates[index] = stored.id
+                    break
+        return duplicates
+
+    def batch_insert(self, vectors: list[Vector]):
+        for vector in vectors:
+            vector.id = len(self.vectors) + 1
+            self.vectors.append(vector)
+
+    def batch_insert_references(self, references: list[tuple[int, Chunk]]):
+        self.references.extend(references)
+
+    def create_shadow(self) -> "FakeVectorStorage":
+        return FakeVectorStorage()
+
+    def swap(self, shadow: "FakeVectorStorage"):
+        self.vectors, self.references = shadow.vectors, shadow.references
+
+
+def documents(count: int = 20) -> list[Vector]:
+    rng = np.random.default_rng(0)
+    return [
+        Vector(
+            vector=rng.normal(size=DIMENSION).tolist(),
+            file_name=f"doc{i // 5}.md",
+            file_position=i % 5,
+            content=f"Passage {i} of the stub documents.",
+            metadata={},
+        )
+        for i in range(count)
+    ]
+
+
+@dataclass
+class Stub:
+    url: str
+    # Settings of the running stub, changes apply to the requests sent after them
+    settings: dict
+    # Number of times every request was sent, keyed by (purpose, hash of the request)
+    attempts: Counter
+
+
+@pytest.fixture
+async def stub():
+    """
+    Start a stub API with fast fixed latencies, every test gets its own so their attempt counters do not mix.
+    """
+    app = create_stub_app(latency=FAST, embedding_latency=FAST, token_delay=0, dimension=DIMENSION, completion_tokens=[20, 40])
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    yield Stub(url=str(server.make_url("/v1")), settings=app["settings"], attempts=app["attempts"])
+    await server.close()
+
+
+def make_model(url: str, **kwargs) -> LLModel:
+    return LLModel(model_name="stub", api_key="stub", endpoint=url, input_cost=1.0, output_cost=4.0, **kwargs)
+
+
+def make_pipeline(url: str, model_options: dict = None, **kwargs) -> QAPipeline:
+    """
+    Build a pipeline whose models all talk to the stub at ``url``.
+    :param model_options: Extra arguments of every :class:`LLModel`.
+    :param kwargs: Extra arguments of the :class:`QAPipeline`.
+    """
+    model_options = model_options or {}
+    agents = Agents(
+        main_model=make_model(url, **model_options),
+        main_researcher_model=make_model(url, **model_options),
+        query_researcher_model=make_model(url, **model_options),
+    )
+    embedding_model = OAEmbedding(model_name="stub-embedding", api_key="stub", dimension=DIMENSION, endpoint=url)
+    return QAPipeline(
+        agents=agents,
+        embedding_model=embedding_model,
+        vector_storage=MemoryVectorStorage(documents()),
+        **kwargs,
+    )
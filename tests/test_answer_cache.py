@@ -0,0 +1,51 @@
+import numpy as np
+
+from src.models.request_context import RequestContext
+from tests.conftest import make_pipeline
+
+
+class MemoryAnswerCache:
+    """
+    :class:`AnswerCacheStorage` over a list of entries, lookups compare the cosine similarity of the query embeddings.
+    """
+
+    table_name = "answer_cache"
+
+    def __init__(self):
+        self.entries: list[tuple[str, np.ndarray, dict, list[str]]] = []
+
+    def lookup(self, vector: list[float], min_similarity: float):
+        vector = np.asarray(vector) / np.linalg.norm(vector)
+        for _, stored, result, _ in self.entries:
+            if float(stored @ vector) >= min_similarity:
+                return result
+        return None
+
+    def save(self, query_text: str, vector: list[float], result: dict, file_names: list[str]):
+        self.entries.append((query_text, np.asarray(vector) / np.linalg.norm(vector), result, file_names))
+
+
+async def test_repeated_query_answered_from_cache(stub):
+    stub.settings["true_probability"] = 0.0
+    cache = MemoryAnswerCache()
+    pipeline = make_pipeline(stub.url, max_iterations=2, answer_cache=cache)
+
+    first = await pipeline.arun("What is in the documents?")
+    second = await pipeline.arun("What is in the documents?")
+
+    assert [query for query, *_ in cache.entries] == ["What is in the documents?"]
+    assert cache.entries[0][3] == [c.file_name for c in first.used_context]
+    assert not first.cached and second.cached
+    assert second.final_answer == first.final_answer
+    assert set(second.usage.by_stage()) == {"answer_cache"}
+
+
+async def test_answer_cut_short_is_not_cached(stub):
+    stub.settings["true_probability"] = 0.0
+    cache = MemoryAnswerCache()
+    pipeline = make_pipeline(stub.url, max_iterations=20, answer_cache=cache)
+
+    result = await pipeline.arun("What is in the documents?", request=RequestContext(max_cost=0.0005))
+
+    assert result.stop_reason == "cost"
+    assert cache.entries == []
@@ -0,0 +1,70 @@
+import pytest
+
+from src.vectordb.async_pool import create_pool
+from src.vectordb.async_vector_storage import AsyncVectorStorage
+from src.vectordb.vector_storage import VectorStorage
+
+ROWS = [
+    (1, "[1,0]", "doc.md", 0, "First", {}, None, 0.1),
+    (2, "[0,1]", "doc.md", 1, "Second", {}, None, 0.2),
+    (3, "[1,1]", "doc.md", 4, "Third", {}, None, 0.3),
+]
+
+
+class Recorder:
+    """
+    Stands in for the database, remembering every query and answering all of them with the same rows.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def fetchall(self, query: str, params: tuple = None) -> list[tuple]:
+        self.calls.append((query, params))
+        return ROWS
+
+    async def afetchall(self, query: str, params: tuple = None) -> list[tuple]:
+        return self.fetchall(query, params)
+
+
+def storages() -> tuple[VectorStorage, AsyncVectorStorage, Recorder, Recorder]:
+    sync_recorder, async_recorder = Recorder(), Recorder()
+
+    # The sync storage connects in its constructor, so it is built without it. The async pool only connects once opened
+    sync_storage = VectorStorage.__new__(VectorStorage)
+    sync_storage.table_name = "docs"
+    sync_storage._fetchall = sync_recorder.fetchall
+
+    async_storage = AsyncVectorStorage("docs", 2, connection_string="postgresql://localhost/docs")
+    async_storage._fetchall = async_recorder.afetchall
+    return sync_storage, async_storage, sync_recorder, async_recorder
+
+
+def test_pool_needs_connection_details():
+    with pytest.raises(ValueError):
+        create_pool(host="localhost", port=5432)
+
+    pool = create_pool(host="localhost", port=5432, user="user", password="secret", database="docs", max_size=3)
+    assert "dbname=docs" in pool.conninfo
+    assert (pool.min_size, pool.max_size, pool.closed) == (1, 3, True)
+
+
+async def test_query_matches_sync_storage():
+    sync_storage, async_storage, sync_recorder, async_recorder = storages()
+
+    results = await async_storage.query([1.0, 0.0], n=3)
+
+    assert results == sync_storage.query([1.0, 0.0], n=3)
+    assert async_recorder.calls == sync_recorder.calls
+    assert [v.distance for v in results] == [0.1, 0.2, 0.3]
+
+
+async def test_neighbours_match_sync_storage():
+    sync_storage, async_storage, sync_recorder, async_recorder = storages()
+
+    windows = await async_storage.get_neighbours([3, 1], k=1)
+
+    assert windows == sync_storage.get_neighbours([3, 1], k=1)
+    assert async_recorder.calls == sync_recorder.calls
+    assert [[v.id for v in window] for window in windows] == [[3], [1, 2]]
+    assert await async_storage.get_neighbours([]) == []
@@ -0,0 +1,35 @@
+import asyncio
+
+from src.models import clients
+
+
+def test_models_share_client_per_endpoint():
+    client = clients.get_client("http://shared/v1", "key")
+
+    assert clients.get_client("http://shared/v1", "key") is client
+    assert clients.get_client("http://shared/v1", "other key") is not client
+    assert clients.get_client("http://other/v1", "key") is not client
+
+
+def test_options_reuse_connection_pool():
+    client = clients.get_client("http://options/v1", "key")
+
+    copy = clients.get_client("http://options/v1", "key", timeout=5, max_retries=0)
+
+    assert copy is not client
+    assert copy is clients.get_client("http://options/v1", "key", timeout=5, max_retries=0)
+    assert copy.timeout == 5 and copy.max_retries == 0
+    assert copy._client is client._client
+
+
+async def test_async_clients_per_event_loop():
+    client = clients.get_async_client("http://async/v1", "key")
+
+    assert clients.get_async_client("http://async/v1", "key") is client
+    assert clients.get_async_client("http://async/v1", "key", timeout=5)._client is client._client
+
+    async def in_other_loop():
+        return clients.get_async_client("http://async/v1", "key")
+
+    # A client is bound to the loop it was created in, another loop gets its own
+    assert await asyncio.to_thread(asyncio.run, in_other_loop()) is not client
@@ -0,0 +1,84 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from src.models.embedding_model import EmbeddingModel
+from src.models.usage import UsageLedger
+
+
+class CountingEmbedding(EmbeddingModel):
+    """
+    Embeds texts by their length and remembers every batch it was called with, texts containing "bad" fail.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.model_name = "counting"
+        self.batches = []
+
+    def embed(self, data, instruction=None):
+        self.batches.append(list(data))
+        if any("bad" in text for text in data):
+            raise ValueError("bad text")
+        return [np.array([len(text), 1.0]) for text in data]
+
+    def tokenize(self, data):
+        return data.split()
+
+    def metadata(self):
+        return "counting"
+
+    def get_dimension(self):
+        return 2
+
+    def max_tokens(self):
+        return 512
+
+
+async def test_concurrent_queries_share_one_call():
+    model = CountingEmbedding()
+    ledger = UsageLedger()
+
+    vectors = await asyncio.gather(*(model.aembed_query("q" * i, ledger=ledger, stage="retrieval") for i in range(1, 6)))
+
+    assert model.batches == [["q", "qq", "qqq", "qqqq", "qqqqq"]]
+    assert [v[0] for v in vectors] == [1, 2, 3, 4, 5]
+    assert ledger.by_stage()["retrieval"].calls == 5
+
+
+async def test_batches_are_capped():
+    model = CountingEmbedding()
+    model.max_query_batch = 2
+
+    await asyncio.gather(*(model.aembed_query(str(i)) for i in range(5)))
+
+    assert [len(batch) for batch in model.batches] == [2, 2, 1]
+
+
+async def test_recent_queries_are_cached():
+    model = CountingEmbedding()
+    model.query_cache_size = 2
+
+    await model.aembed_query("a")
+    await model.aembed_query("a")
+    await model.aembed_query("a", instruction="other")
+    await model.aembed_query("b")
+    await model.aembed_query("a")
+
+    assert model.batches == [["a"], ["a"], ["b"], ["a"]]
+
+
+async def test_failing_query_does_not_fail_batch():
+    model = CountingEmbedding()
+
+    good, bad = await asyncio.gather(model.aembed_query("good"), model.aembed_query("bad"), return_exceptions=True)
+
+    assert good[0] == 4
+    assert isinstance(bad, ValueError)
+    assert model.batches == [["good", "bad"], ["good"], ["bad"]]
+
+
+async def test_single_failing_query_raises():
+    with pytest.raises(ValueError):
+        await CountingEmbedding().aembed_query("bad")
@@ -0,0 +1,54 @@
+from src.document_parsing import Chunk
+from src.routines.embedding_routine import embedding_routine
+from src.vectordb.vector import Vector
+from tests.conftest import FakeVectorStorage, WordEmbedding
+
+
+class FileChunker:
+    """
+    Makes one chunk of every document, naming the file it comes from.
+    """
+
+    def chunk(self, document) -> list[Chunk]:
+        return [Chunk(content=f"Content of {document.file_name}", file_name=document.file_name, file_position=0, metadata={})]
+
+
+class LiveStorage(FakeVectorStorage):
+    """
+    Fails if the routine writes to the live table while its shadow is filled.
+    """
+
+    def __init__(self, vectors: list[Vector]):
+        super().__init__()
+        self.shadow = None
+        self.batch_insert(vectors)
+
+    def create_shadow(self) -> FakeVectorStorage:
+        self.shadow = FakeVectorStorage()
+        return self.shadow
+
+    def batch_insert(self, vectors: list[Vector]):
+        assert self.shadow is None, "live table written during the rebuild"
+        super().batch_insert(vectors)
+
+
+class AnswerCache:
+    cleared = False
+
+    def clear_table(self) -> bool:
+        self.cleared = True
+        return True
+
+
+def test_create_rebuilds_in_shadow_and_swaps(tmp_path):
+    for name in ("a.md", "b.md"):
+        (tmp_path / name).write_text(f"# {name}\n\nText.")
+    (tmp_path / "notes.txt").write_text("Not markdown.")
+    storage = LiveStorage([Vector(vector=[1.0], file_name="old.md", file_position=0, content="Old", metadata={})])
+    cache = AnswerCache()
+
+    embedding_routine(str(tmp_path), FileChunker(), WordEmbedding(), storage, mode="create", answer_cache=cache)
+
+    assert sorted(v.file_name for v in storage.vectors) == ["a.md", "b.md"]
+    assert storage.vectors is storage.shadow.vectors
+    assert cache.cleared
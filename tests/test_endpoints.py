@@ -0,0 +1,84 @@
+import socket
+
+import httpx
+import openai
+import pytest
+
+from src.models.endpoints import Endpoint, LatencyTracker, backoff_delay, retry_after
+from tests.conftest import make_model
+
+
+def closed_url() -> str:
+    """
+    URL of a local port nothing listens on, requests to it fail to connect right away.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}/v1"
+
+
+def rate_limit_error(headers: dict) -> openai.RateLimitError:
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "http://stub/v1/chat/completions"))
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def test_quantile_needs_min_samples():
+    tracker = LatencyTracker(min_samples=3)
+
+    tracker.record(1.0)
+    tracker.record(2.0)
+    assert tracker.quantile(0.5) is None
+
+    tracker.record(3.0)
+    assert tracker.quantile(0.5) == 2.0
+
+
+def test_quantile_of_recent_window():
+    tracker = LatencyTracker(window=10, min_samples=1)
+
+    for seconds in range(100):
+        tracker.record(float(seconds))
+
+    assert tracker.quantile(0) == 90.0
+    assert tracker.quantile(0.5) == 95.0
+    assert tracker.quantile(0.95) == 99.0
+    assert tracker.quantile(1) == 99.0
+
+
+def test_backoff_delay_is_capped():
+    delays = [backoff_delay(attempt, base=0.5, cap=3) for attempt in range(10) for _ in range(20)]
+
+    assert all(0 <= delay <= 3 for delay in delays)
+    assert max(backoff_delay(0, base=0.5) for _ in range(20)) <= 0.5
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({"retry-after-ms": "1500"}, 1.5),
+        ({"retry-after": "2"}, 2.0),
+        ({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}, None),
+        ({}, None),
+    ],
+)
+def test_retry_after(headers, expected):
+    assert retry_after(rate_limit_error(headers)) == expected
+
+
+async def test_failover_to_fallback(stub):
+    model = make_model(
+        closed_url(), fallbacks=[Endpoint(stub.url, "stub", "stub")], max_retries=1, retry_backoff=0.01, timeout=5
+    )
+
+    response = await model.agenerate_response("Where does this go?")
+
+    assert response
+    assert len(model.latency.samples) == 1
+
+
+async def test_no_failover_without_retries(stub):
+    model = make_model(closed_url(), fallbacks=[Endpoint(stub.url, "stub", "stub")], max_retries=0, timeout=5)
+
+    with pytest.raises(openai.APIConnectionError):
+        await model.agenerate_response("Where does this go?")
@@ -0,0 +1,63 @@
+import json
+
+from src.models.json_stream import JsonArrayStream
+
+RESPONSE = {
+    "satisfied": False,
+    "confidence": 0.4,
+    "questions": [
+        {"question_text": "What is in {doc} \"1\"?", "tags": ["a", "b"]},
+        {"question_text": "Why, [and] how?", "tags": []},
+    ],
+    "note": "done",
+}
+
+
+def stream(text: str, size: int) -> tuple[JsonArrayStream, list[list]]:
+    parser = JsonArrayStream("questions")
+    return parser, [parser.feed(text[i:i + size]) for i in range(0, len(text), size)]
+
+
+def test_items_as_they_complete():
+    text = json.dumps(RESPONSE)
+    first_end = text.index('"b"]}') + len('"b"]}')
+
+    parser = JsonArrayStream("questions")
+
+    assert parser.feed(text[:first_end - 1]) == []
+    assert parser.feed(text[first_end - 1:first_end]) == [RESPONSE["questions"][0]]
+    assert parser.feed(text[first_end:]) == [RESPONSE["questions"][1]]
+
+
+def test_any_split_yields_all_items():
+    text = json.dumps(RESPONSE, indent=2)
+
+    for size in (1, 2, 7, len(text)):
+        parser, parts = stream(text, size)
+
+        assert [item for part in parts for item in part] == RESPONSE["questions"]
+        assert parser.fields == {"satisfied": False, "confidence": 0.4, "note": "done"}
+
+
+def test_fields_before_array_are_known_before_items():
+    text = json.dumps(RESPONSE)
+    parser = JsonArrayStream("questions")
+
+    parser.feed(text[:text.index("[")])
+
+    assert parser.fields == {"satisfied": False, "confidence": 0.4}
+
+
+def test_scalar_items_and_other_arrays():
+    text = '{"other": [1, 2], "questions": ["a,b", 3, null], "nested": {"questions": [4]}}'
+
+    _, parts = stream(text, 3)
+
+    assert [item for part in parts for item in part] == ["a,b", 3, None]
+
+
+def test_incomplete_stream():
+    parser = JsonArrayStream("questions")
+
+    assert parser.feed('{"satisfied": true, "questions": [{"question_text": "Cut') == []
+    assert parser.fields == {"satisfied": True}
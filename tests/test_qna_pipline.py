@@ -0,0 +1,204 @@
+import asyncio
+import time
+
+from src.models.qna_pipline import FINAL_ANSWER_SECONDS, QAPipelineResult
+from src.models.request_context import RequestContext
+from src.models.structured_output.questions import Questions
+from tests.conftest import MemoryVectorStorage, documents, make_model, make_pipeline
+
+
+async def test_streamed_calls_record_latency(stub):
+    model = make_model(stub.url)
+
+    async for _ in model.astream_response("What is in the documents?"):
+        pass
+
+    assert len(model.latency.samples) == 1
+
+
+async def test_final_answer_reserve_is_share_of_short_deadline(stub):
+    pipeline = make_pipeline(stub.url)
+
+    assert pipeline._final_answer_time(RequestContext.with_timeout(0.5)) < 0.5
+    assert pipeline._final_answer_time(RequestContext.with_timeout(600)) == FINAL_ANSWER_SECONDS
+
+
+async def test_short_time_limit_still_researches(stub):
+    stub.settings["true_probability"] = 0.0
+    stub.settings["latency"] = {"distribution": "fixed", "value": 0.02}
+
+    result = await make_pipeline(stub.url, max_iterations=20, time_limit=0.5).arun("What is in the documents?")
+
+    assert result.iterations >= 1
+    assert result.stop_reason == "deadline"
+    assert result.final_answer
+
+
+async def test_deadline_stops_research(stub):
+    stub.settings["true_probability"] = 0.0
+    stub.settings["latency"] = {"distribution": "fixed", "value": 0.1}
+    pipeline = make_pipeline(stub.url, max_iterations=20)
+
+    started = time.monotonic()
+    result = await pipeline.arun("What is in the documents?", request=RequestContext.with_timeout(1.0))
+
+    assert result.stop_reason == "deadline"
+    assert result.iterations < 20
+    assert result.final_answer
+    # The final answer is one more call after research stopped
+    assert time.monotonic() - started < 1.5
+
+
+async def test_cost_ceiling_stops_research(stub):
+    stub.settings["true_probability"] = 0.0
+    stub.settings["completion_tokens"] = [200, 400]
+    pipeline = make_pipeline(stub.url, max_iterations=20, cost_limit=0.01)
+
+    result = await pipeline.arun("What is in the documents?")
+
+    assert result.stop_reason == "cost"
+    assert result.iterations < 20
+    assert result.final_answer
+    assert result.cost <= 0.01
+
+
+async def test_final_answer_is_cut_at_cost_ceiling(stub):
+    stub.settings["true_probability"] = 1.0
+    stub.settings["completion_tokens"] = [2000, 2000]
+    pipeline = make_pipeline(stub.url, cost_limit=0.005)
+
+    result = await pipeline.arun("What is in the documents?", on_token=lambda delta: None)
+
+    final = [r for r in result.usage.records if r.stage == "final_answer"]
+    assert len(final) == 1
+    # Uncut it would be about 3000 tokens
+    assert final[0].completion_tokens < 1000
+    assert result.cost <= 0.005
+
+
+async def test_calls_get_remaining_deadline_as_timeout(stub):
+    pipeline = make_pipeline(stub.url)
+    request = RequestContext.with_timeout(30)
+
+    assert 29 < pipeline._call_timeout(request) <= 30
+    assert pipeline._call_timeout(RequestContext()) is None
+    # Past the deadline the final answer still gets the time reserved for it
+    late = RequestContext(created=time.monotonic() - 3, deadline=time.monotonic() - 1)
+    assert pipeline._call_timeout(late) == pipeline._final_answer_time(late) > 0
+
+
+async def test_request_storage_is_used_without_changing_pipeline(stub):
+    pipeline = make_pipeline(stub.url, max_iterations=1, speculative_retrieval=3)
+    request_storage = MemoryVectorStorage(documents())
+    request_storage.table_name = "request"
+    before = dict(vars(pipeline))
+
+    first, second = await asyncio.gather(
+        pipeline.arun("What is in the documents?", request=RequestContext(vector_storage=request_storage)),
+        pipeline.arun("What is in the documents?"),
+    )
+
+    assert first.final_answer and second.final_answer
+    assert vars(pipeline) == before
+    assert {r.model for r in first.usage.records if r.stage == "speculative_retrieval"} == {"request"}
+    assert {r.model for r in second.usage.records if r.stage == "speculative_retrieval"} == {"memory"}
+
+
+def test_cached_result_without_confidence_loads():
+    cached = {
+        "terms": {},
+        "satisfactions": [{"satisfied_reason": "Enough.", "satisfied": True, "reasoning": "None.", "questions": []}],
+        "questions": {},
+        "used_context": [],
+        "iterations": 1,
+        "cost": 0.01,
+        "final_answer": "Answer.",
+    }
+
+    result = QAPipelineResult.from_dict(cached)
+
+    assert result.satisfactions[0].confidence is None
+    assert Questions.model_json_schema()["required"] == list(Questions.model_fields)
+
+
+async def test_confident_researcher_gets_draft(stub):
+    stub.settings["true_probability"] = 0.0
+
+    result = await make_pipeline(stub.url, max_iterations=3, draft_confidence=0.0).arun("What is in the documents?")
+
+    assert result.final_answer
+    assert "draft_answer" in {r.stage for r in result.usage.records}
+
+
+async def test_raw_query_passages_reach_first_researcher(stub):
+    stub.settings["true_probability"] = 1.0
+    pipeline = make_pipeline(stub.url, max_iterations=2, speculative_retrieval=3)
+
+    result = await pipeline.arun("What is in the documents?")
+
+    stages = result.usage.by_stage()
+    assert "speculative_retrieval" in stages
+    assert "research" not in stages
+    assert len(result.used_context) == 3
+
+
+async def test_fast_path_answers_in_one_call(stub):
+    stub.settings["true_probability"] = 1.0
+    pipeline = make_pipeline(stub.url, max_iterations=2, fast_path_similarity=-1.0)
+
+    result = await pipeline.arun("What is in the documents?")
+
+    assert set(result.usage.by_stage()) == {"speculative_retrieval_embedding", "speculative_retrieval", "fast_path"}
+    assert result.final_answer
+    assert result.iterations == 0
+
+
+async def test_insufficient_fast_answer_is_researched(stub):
+    stub.settings["true_probability"] = 0.0
+    pipeline = make_pipeline(stub.url, max_iterations=1, fast_path_similarity=-1.0)
+
+    result = await pipeline.arun("What is in the documents?")
+
+    stages = result.usage.by_stage()
+    assert {"fast_path", "research", "final_answer"} <= set(stages)
+
+
+async def test_fast_path_needs_similar_passages(stub):
+    pipeline = make_pipeline(stub.url, max_iterations=1, fast_path_similarity=1.0)
+
+    result = await pipeline.arun("What is in the documents?")
+
+    assert "fast_path" not in result.usage.by_stage()
+
+
+async def test_hits_are_expanded_with_neighbours(stub):
+    stub.settings["true_probability"] = 1.0
+    plain = await make_pipeline(stub.url, speculative_retrieval=2).arun("What is in the documents?")
+    expanded = await make_pipeline(stub.url, speculative_retrieval=2, context_window=1).arun("What is in the documents?")
+
+    hits = {(d.file_name, d.file_position) for d in plain.used_context}
+    used = {(d.file_name, d.file_position) for d in expanded.used_context}
+    assert hits < used
+    assert all(any(f == file and abs(p - position) <= 1 for file, position in hits) for f, p in used)
+    assert "context_expansion" in expanded.usage.by_stage()
+
+
+async def test_concurrent_queries_share_pipeline(stub):
+    stub.settings["true_probability"] = 0.0
+    pipeline = make_pipeline(stub.url, max_iterations=2)
+    queries = [f"What is in document {i}?" for i in range(4)]
+
+    results = await asyncio.gather(*(pipeline.arun(query) for query in queries))
+
+    assert all(result.final_answer for result in results)
+    assert len({id(result.usage) for result in results}) == len(queries)
+    assert all(result.cost == result.usage.total_cost() for result in results)
+
+
+async def test_run_without_event_loop(stub):
+    pipeline = make_pipeline(stub.url, max_iterations=1)
+
+    # The blocking wrapper runs its own event loop, so it is called from a thread without one
+    result = await asyncio.to_thread(pipeline.run, "What is in the documents?")
+
+    assert result.final_answer
@@ -0,0 +1,77 @@
+import time
+
+from src.models import question_memo
+from src.models.question_memo import QuestionMemo, normalize_question
+from tests.conftest import make_pipeline
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def test_normalize_question():
+    assert normalize_question("  What's the DEADLINE?! ") == normalize_question("what s the deadline")
+
+
+def test_lookup_by_text_or_similar_embedding():
+    memo = QuestionMemo(min_similarity=0.95)
+    memo.save("What is the deadline?", vector=[1.0, 0.0], answer="Friday.")
+    memo.save("Who signs?", answer="The board.")
+
+    assert memo.lookup("what is the deadline").answer == "Friday."
+    assert memo.lookup("When is it due?", vector=[0.99, 0.05]).answer == "Friday."
+    assert memo.lookup("Who pays?", vector=[0.6, 0.8]) is None
+    assert memo.lookup("who signs").answer == "The board."
+
+
+def test_oldest_entries_forgotten():
+    memo = QuestionMemo(max_entries=2)
+
+    memo.save("First?", vector=[1.0, 0.0], answer="1")
+    memo.save("Second?", answer="2")
+    memo.save("Third?", answer="3")
+
+    assert memo.lookup("First?", vector=[1.0, 0.0]) is None
+    assert [memo.lookup(q).answer for q in ("Second?", "Third?")] == ["2", "3"]
+
+
+def test_entries_expire():
+    memo = QuestionMemo(ttl=0.05)
+    memo.save("Question?", vector=[1.0, 0.0], answer="Answer.")
+
+    assert memo.lookup("Question?") is not None
+    time.sleep(0.06)
+    assert memo.lookup("Question?", vector=[1.0, 0.0]) is None
+
+
+def test_changed_data_clears_memo(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(question_memo, "time", clock)
+    memo = QuestionMemo(version_check_interval=60)
+    memo.save("Question?", answer="Answer.")
+
+    assert memo.version_due()
+    memo.check_version("1")
+    assert not memo.version_due()
+    assert memo.lookup("Question?") is not None
+
+    clock.now += 60
+    assert memo.version_due()
+    memo.check_version("2")
+    assert memo.lookup("Question?") is None
+
+
+async def test_repeated_query_reuses_research(stub):
+    stub.settings["true_probability"] = 0.0
+    pipeline = make_pipeline(stub.url, max_iterations=2, question_memo=QuestionMemo())
+
+    first = await pipeline.arun("What is in the documents?")
+    second = await pipeline.arun("What is in the documents?")
+
+    assert first.usage.by_stage()["research"].calls > 0
+    assert "research" not in second.usage.by_stage()
+    assert second.questions == first.questions
@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from src.models import rate_limiter
+from src.models.rate_limiter import RateLimiter, _Waiter
+
+
+class Clock:
+    """
+    Stands in for the time module of the limiter, time only passes when the test advances it.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    return clock
+
+
+def queue(limiter: RateLimiter, tokens: int = 0) -> _Waiter:
+    waiter = _Waiter(tokens)
+    limiter._queue.append(waiter)
+    return waiter
+
+
+def test_request_bucket_allows_burst_then_refills(clock):
+    limiter = RateLimiter(requests_per_minute=60)
+
+    assert [limiter.acquire() for _ in range(60)] == [0] * 60
+
+    waiter = queue(limiter)
+    assert limiter._try_grant(waiter) == pytest.approx(1)
+
+    clock.now += 0.75
+    assert limiter._try_grant(waiter) == pytest.approx(0.25)
+    clock.now += 0.25
+    assert limiter._try_grant(waiter) == 0
+
+
+def test_token_bucket_waits_for_missing_tokens(clock):
+    limiter = RateLimiter(tokens_per_minute=6000)
+
+    limiter.acquire(5950)
+    waiter = queue(limiter, 100)
+
+    assert limiter._try_grant(waiter) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert limiter._try_grant(waiter) == 0
+    assert limiter._tokens == pytest.approx(0)
+
+
+def test_oversized_request_waits_for_full_bucket(clock):
+    limiter = RateLimiter(tokens_per_minute=600)
+    limiter.acquire(300)
+    waiter = queue(limiter, 6000)
+
+    clock.now += 20
+    assert limiter._try_grant(waiter) != 0
+    clock.now += 10
+    assert limiter._try_grant(waiter) == 0
+
+
+def test_release_corrects_token_estimate(clock):
+    limiter = RateLimiter(tokens_per_minute=600)
+
+    limiter.acquire(500)
+    limiter.release(500, used_tokens=100)
+
+    assert limiter._tokens == pytest.approx(500)
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_callers_served_in_order(clock):
+    limiter = RateLimiter(requests_per_minute=1)
+    limiter.acquire()
+    first, second = queue(limiter), queue(limiter)
+
+    clock.now += 60
+    assert limiter._try_grant(second) == RateLimiter.MAX_SLEEP
+    assert limiter._try_grant(first) == 0
+    assert limiter._try_grant(second) != 0
+
+
+def test_rate_limited_blocks_until_retry_after(clock):
+    limiter = RateLimiter(max_in_flight=5)
+    limiter.rate_limited(retry_after=0.5)
+    waiter = queue(limiter)
+
+    assert limiter._try_grant(waiter) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert limiter._try_grant(waiter) == 0
+    assert limiter.stats()["rate_limited"] == 1
+
+
+async def test_release_wakes_waiting_request():
+    limiter = RateLimiter(max_in_flight=1)
+    await limiter.aacquire()
+
+    waiting = asyncio.create_task(limiter.aacquire())
+    await asyncio.sleep(0.05)
+    assert not waiting.done()
+    assert limiter.stats()["queue_depth"] == 1
+
+    limiter.release()
+    waited = await asyncio.wait_for(waiting, RateLimiter.MAX_SLEEP / 2)
+
+    assert waited >= 0.05
+    assert limiter.stats()["in_flight"] == 1
+    assert limiter.stats()["granted"] == 2
+
+
+async def test_cancelled_request_leaves_queue():
+    limiter = RateLimiter(max_in_flight=1)
+    await limiter.aacquire()
+
+    waiting = asyncio.create_task(limiter.aacquire())
+    await asyncio.sleep(0.05)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+
+    assert limiter.stats()["queue_depth"] == 0
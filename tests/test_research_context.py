@@ -0,0 +1,67 @@
+import tiktoken
+
+from src.models.research_context import ResearchContext
+from tests.conftest import make_pipeline
+
+
+class WordEncoding:
+    """
+    Stands in for a tiktoken encoding, every word is one token.
+    """
+
+    def encode(self, text: str) -> list[str]:
+        return text.split(" ")
+
+    def decode(self, tokens: list[str]) -> str:
+        return " ".join(tokens)
+
+
+def offline(monkeypatch):
+    def get_encoding(name):
+        raise AssertionError(f"Encoding {name} loaded, it may have to be downloaded")
+
+    monkeypatch.setattr(tiktoken, "get_encoding", get_encoding)
+
+
+def test_no_encoding_without_budget(monkeypatch):
+    offline(monkeypatch)
+    context = ResearchContext(global_prompt="Global")
+
+    context.add_iteration({"What?": "That. " * 100})
+
+    assert context.tokens() > 100
+    assert context.render("Query").startswith("Global Context: Global\n\nQuery")
+
+
+async def test_pipeline_without_budget_runs_offline(stub, monkeypatch):
+    offline(monkeypatch)
+
+    result = await make_pipeline(stub.url, max_iterations=2).arun("What is in the documents?")
+
+    assert result.final_answer
+
+
+async def test_compact_truncates_oldest_answers(monkeypatch):
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: WordEncoding())
+    context = ResearchContext(token_budget=300)
+
+    context.add_iteration({"First?": "old " * 200})
+    context.add_iteration({"Second?": "new " * 100})
+    await context.compact()
+
+    assert context.tokens() <= 300
+    assert context.segments[0].tokens <= ResearchContext.MIN_ANSWER_TOKENS
+    assert context.segments[1].text.count("new") == 100
+
+
+def test_iterations_only_append_to_prompt(monkeypatch):
+    offline(monkeypatch)
+    context = ResearchContext(global_prompt="Global")
+
+    prompts = [context.render("Query")]
+    context.add_passages("Passage")
+    prompts.append(context.render("Query"))
+    context.add_iteration({"What?": "That."})
+    prompts.append(context.render("Query"))
+
+    assert all(later.startswith(earlier) for earlier, later in zip(prompts, prompts[1:]))
@@ -0,0 +1,76 @@
+from pydantic import BaseModel
+
+from src.models import response_cache
+from src.models.response_cache import ResponseCache
+from tests.conftest import make_model
+
+
+class Answer(BaseModel):
+    text: str
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+def test_key_covers_request():
+    key = ResponseCache.key("model", "system", "prompt")
+
+    assert key == ResponseCache.key("model", "system", "prompt", [])
+    assert key != ResponseCache.key("model", "other system", "prompt")
+    assert key != ResponseCache.key("model", "system", "prompt", ["http://image"])
+    assert key != ResponseCache.key("model", "system", "prompt", structure=Answer)
+
+
+def test_entries_expire(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    cache = ResponseCache(str(tmp_path / "cache" / "responses.db"), ttl=60)
+
+    cache.set("key", "content", '{"total_tokens": 3}')
+    clock.now += 59
+    assert cache.get("key") == ("content", '{"total_tokens": 3}')
+
+    clock.now += 2
+    assert cache.get("key") is None
+
+
+def test_least_recently_used_evicted(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    cache = ResponseCache(str(tmp_path / "responses.db"), max_entries=2)
+
+    for key in ("a", "b"):
+        cache.set(key, key)
+        clock.now += 1
+    cache.get("a")
+    clock.now += 1
+    cache.set("c", "c")
+
+    assert [cache.get(key) for key in ("a", "b", "c")] == [("a", None), None, ("c", None)]
+
+
+async def test_model_answers_repeated_request_from_cache(stub, tmp_path):
+    model = make_model(stub.url, cache=ResponseCache(str(tmp_path / "responses.db")))
+
+    first = await model.agenerate_response("What is cached?")
+    sent = sum(stub.attempts.values())
+    second = await model.agenerate_response("What is cached?")
+
+    assert second == first
+    assert sum(stub.attempts.values()) == sent
+    assert model.usage.total_tokens > 0
+
+
+async def test_cut_response_not_cached(stub, tmp_path):
+    model = make_model(stub.url, cache=ResponseCache(str(tmp_path / "responses.db")))
+
+    await model.agenerate_response("What is cut?", max_tokens=2)
+    sent = sum(stub.attempts.values())
+    await model.agenerate_response("What is cut?", max_tokens=2)
+
+    assert sum(stub.attempts.values()) == sent + 1
@@ -0,0 +1,54 @@
+import pytest
+
+from src.models.retrieval import claim, claim_windows, embedding_matrix, maximal_marginal_relevance
+from src.vectordb.vector import Vector
+
+
+def vector(id: int, embedding=None) -> Vector:
+    return Vector(vector=embedding or [1.0, 0.0], file_name="doc.md", file_position=id, content=str(id), metadata={}, id=id)
+
+
+def test_embedding_matrix_parses_pgvector_text():
+    matrix = embedding_matrix([vector(1, "[3,4]"), vector(2, [0.0, 0.0])])
+
+    assert matrix.tolist() == [pytest.approx([0.6, 0.8]), [0.0, 0.0]]
+
+
+def test_mmr_skips_near_copies():
+    candidates = [vector(1, [1.0, 0.0]), vector(2, [0.99, 0.01]), vector(3, [0.6, 0.8])]
+
+    selected = maximal_marginal_relevance([1.0, 0.0], candidates, k=2, lambda_mult=0.3)
+
+    assert [v.id for v in selected] == [1, 3]
+
+
+def test_mmr_with_full_relevance_keeps_ranking():
+    candidates = [vector(1, [0.6, 0.8]), vector(2, [1.0, 0.0]), vector(3, [0.99, 0.01])]
+
+    selected = maximal_marginal_relevance([1.0, 0.0], candidates, k=3, lambda_mult=1)
+
+    assert [v.id for v in selected] == [2, 3, 1]
+
+
+def test_claim_gives_chunks_to_first_question():
+    claimed = set()
+
+    first = claim([vector(1), vector(2)], claimed)
+    second = claim([vector(2), vector(3)], claimed)
+    third = claim([vector(3), vector(1)], claimed)
+
+    assert [v.id for v in first] == [1, 2]
+    assert [v.id for v in second] == [3]
+    # A question is never left without context
+    assert [v.id for v in third] == [3]
+    assert claimed == {1, 2, 3}
+
+
+def test_claim_windows_keeps_hits():
+    claimed = {2, 5}
+    windows = [[vector(1), vector(2), vector(3)], [vector(5)]]
+
+    kept = claim_windows(windows, [vector(2)], claimed)
+
+    assert [[v.id for v in window] for window in kept] == [[1, 2, 3]]
+    assert claimed == {1, 2, 3, 5}
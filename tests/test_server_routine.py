@@ -0,0 +1,76 @@
+import json
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from src.routines.server_routine import create_app
+from tests.conftest import MemoryVectorStorage, documents, make_pipeline
+
+
+def events(body: str) -> list[tuple[str, object]]:
+    parsed = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        parsed.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return parsed
+
+
+async def client(stub, **kwargs) -> TestClient:
+    app = create_app(make_pipeline(stub.url, max_iterations=2), **kwargs)
+    test_client = TestClient(TestServer(app))
+    await test_client.start_server()
+    return test_client
+
+
+async def test_query_returns_result(stub):
+    test_client = await client(stub)
+    try:
+        response = await test_client.post("/query", json={"query": "What is in the documents?", "iterations": 1})
+        result = await response.json()
+    finally:
+        await test_client.close()
+
+    assert response.status == 200
+    assert result["final_answer"]
+    assert result["iterations"] <= 1
+    assert "final_answer" in result["usage"]
+
+
+async def test_stream_sends_tokens_then_result(stub):
+    test_client = await client(stub)
+    try:
+        response = await test_client.post("/query/stream", json={"query": "What is in the documents?"})
+        body = await response.text()
+    finally:
+        await test_client.close()
+
+    assert response.headers["Content-Type"] == "text/event-stream"
+    parsed = events(body)
+    tokens = [data for event, data in parsed if event == "token"]
+    assert tokens and [event for event, _ in parsed[len(tokens):]] == ["result"]
+    assert "".join(tokens).strip() == parsed[-1][1]["final_answer"]
+
+
+async def test_missing_query_is_rejected(stub):
+    test_client = await client(stub)
+    try:
+        plain = await test_client.post("/query", json={})
+        stream = await test_client.post("/query/stream", json={"question": "?"})
+    finally:
+        await test_client.close()
+
+    assert (plain.status, stream.status) == (400, 400)
+
+
+async def test_requests_use_server_storage(stub):
+    stub.settings["true_probability"] = 0.0
+    storage = MemoryVectorStorage(documents(5))
+    test_client = await client(stub, async_vector_storage=storage)
+    try:
+        assert storage.opened
+        response = await test_client.post("/query", json={"query": "What is in the documents?"})
+        result = await response.json()
+    finally:
+        await test_client.close()
+
+    assert not storage.opened
+    assert {c["file_name"] for c in result["used_context"]} == {"doc0.md"}
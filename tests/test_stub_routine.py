@@ -0,0 +1,50 @@
+import openai
+import pytest
+
+from src.models.structured_output.questions import Questions
+from tests.conftest import make_model, make_pipeline
+
+
+async def test_same_request_gets_same_response(stub):
+    model = make_model(stub.url)
+
+    first = await model.agenerate_response("What is in the documents?")
+    second = await model.agenerate_response("What is in the documents?")
+
+    assert first and first == second
+
+
+async def test_structured_output_matches_schema(stub):
+    stub.settings["min_items"] = stub.settings["max_items"] = 2
+
+    questions = await make_model(stub.url).agenerate_response("What is in the documents?", structure=Questions)
+
+    assert isinstance(questions, Questions)
+    assert len(questions.questions) == 2
+
+
+async def test_streamed_response_has_usage(stub):
+    model = make_model(stub.url)
+
+    parts = [part async for part in model.astream_response("What is in the documents?")]
+
+    assert len(parts) > 1
+    assert model.get_last_usage().completion_tokens == len("".join(parts)) // 4
+
+
+async def test_failing_requests_are_retried_and_raised(stub):
+    stub.settings["error_rate"] = 1.0
+    model = make_model(stub.url, max_retries=2, retry_backoff=0)
+
+    with pytest.raises(openai.InternalServerError):
+        await model.agenerate_response("What is in the documents?")
+
+    assert sum(stub.attempts.values()) == 3
+
+
+async def test_pipeline_answers_from_stub(stub):
+    result = await make_pipeline(stub.url, max_iterations=2).arun("What is in the documents?")
+
+    assert result.final_answer
+    assert result.cost > 0
+    assert {r.stage for r in result.usage.records} >= {"question_generation", "final_answer"}
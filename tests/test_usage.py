@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from openai.types import CompletionUsage
+
+from src.models.usage import UsageLedger, UsageRecord
+from tests.conftest import make_model, make_pipeline
+
+
+def test_ledger_aggregates_by_stage():
+    ledger = UsageLedger()
+
+    ledger.record(UsageRecord("a", "research", prompt_tokens=10, completion_tokens=2, latency=1.0, cost=0.5))
+    ledger.record(UsageRecord("a", "final_answer", prompt_tokens=20, completion_tokens=5, latency=2.0, cost=1.0))
+    ledger.record(UsageRecord("b", "research", prompt_tokens=30, cached_tokens=8, latency=3.0, cost=0.25))
+
+    stages = ledger.to_dict()
+    assert list(stages) == ["research", "final_answer"]
+    assert stages["research"] == {
+        "calls": 2,
+        "prompt_tokens": 40,
+        "completion_tokens": 2,
+        "cached_tokens": 8,
+        "cost": 0.75,
+        "total_latency": 4.0,
+        "max_latency": 3.0,
+    }
+    assert ledger.total_cost() == 1.75
+
+
+async def test_ledger_is_safe_across_tasks_and_threads():
+    ledger = UsageLedger()
+
+    def record_many():
+        for _ in range(500):
+            ledger.record(UsageRecord("a", "research", cost=1))
+
+    await asyncio.gather(*(asyncio.to_thread(record_many) for _ in range(4)))
+
+    assert ledger.by_stage()["research"].calls == 2000
+
+
+def test_cached_input_is_billed_at_its_own_price():
+    model = make_model("http://stub/v1", cached_input_cost=0.5)
+    usage = CompletionUsage.model_validate(
+        {"prompt_tokens": 1_000_000, "completion_tokens": 0, "total_tokens": 1_000_000,
+         "prompt_tokens_details": {"cached_tokens": 600_000}}
+    )
+
+    assert model.cost_of(usage) == pytest.approx(0.4 * 1.0 + 0.6 * 0.5)
+
+
+async def test_pipeline_records_every_call(stub):
+    stub.settings["true_probability"] = 0.0
+
+    result = await make_pipeline(stub.url, max_iterations=2).arun("What is in the documents?")
+
+    stages = result.usage.by_stage()
+    assert {"question_generation", "retrieval_embedding", "research", "final_answer"} <= set(stages)
+    assert result.usage.total_cost() == pytest.approx(result.cost)
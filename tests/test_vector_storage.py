@@ -0,0 +1,75 @@
+from src.document_parsing import Chunk
+from src.routines.embedding_routine import _store_chunks
+from src.vectordb.vector import Vector
+from src.vectordb.vector_storage import VectorStorage
+from tests.conftest import FakeVectorStorage, WordEmbedding
+
+
+def chunks(*contents: str, file_name: str = "doc.md") -> list[Chunk]:
+    return [Chunk(content=content, file_name=file_name, file_position=i, metadata={}) for i, content in enumerate(contents)]
+
+
+def window(*positions: int, file_name: str = "doc.md") -> list[Vector]:
+    return [
+        Vector(vector=[], file_name=file_name, file_position=p, content=str(p), metadata={}, id=p + 1) for p in positions
+    ]
+
+
+def test_normalized_content():
+    assert VectorStorage.normalized_content("  The cat\n\tSAT. ") == "the cat sat."
+    assert VectorStorage.normalized_content("The cat sat.") != VectorStorage.normalized_content("The cat sat!")
+
+
+def test_merge_windows_joins_consecutive_chunks():
+    vectors = window(0, 1, 2, 5, 6) + window(2, file_name="other.md")
+
+    windows = VectorStorage._merge_windows(vectors, [6, 3, 1])
+
+    assert [[v.file_position for v in w] for w in windows] == [[5, 6], [0, 1, 2], [2]]
+
+
+def test_merge_windows_orders_by_best_rank():
+    vectors = window(0, 1, 4, 5)
+
+    windows = VectorStorage._merge_windows(vectors, [5, 1, 2])
+
+    assert [[v.id for v in w] for w in windows] == [[5, 6], [1, 2]]
+
+
+def test_store_chunks_merges_only_same_text():
+    storage = FakeVectorStorage()
+
+    _store_chunks(
+        chunks("The cat sat.", "the  CAT sat.", "The cat sat!", "The cat sat."),
+        WordEmbedding(),
+        storage,
+        near_duplicate_distance=0.01,
+    )
+
+    assert [v.content for v in storage.vectors] == ["The cat sat.", "The cat sat!"]
+    assert [(vector_id, chunk.file_position) for vector_id, chunk in storage.references] == [(1, 1), (1, 3)]
+
+
+def test_store_chunks_references_stored_near_duplicates():
+    storage = FakeVectorStorage()
+    _store_chunks(chunks("The cat sat."), WordEmbedding(), storage, near_duplicate_distance=0.01)
+
+    _store_chunks(chunks("THE CAT SAT.", "The cat sat!", file_name="other.md"), WordEmbedding(), storage, near_duplicate_distance=0.01)
+
+    assert [v.content for v in storage.vectors] == ["The cat sat.", "The cat sat!"]
+    assert [(vector_id, chunk.file_name) for vector_id, chunk in storage.references] == [(1, "other.md")]
+
+
+def test_store_chunks_without_distance_keeps_variants():
+    storage = FakeVectorStorage()
+
+    _store_chunks(chunks("The cat sat.", "the cat sat.", "The cat sat."), WordEmbedding(), storage)
+
+    assert [v.content for v in storage.vectors] == ["The cat sat.", "the cat sat."]
+    assert [(vector_id, chunk.file_position) for vector_id, chunk in storage.references] == [(1, 2)]
+
+
+def test_search_and_neighbour_queries_resolve_references():
+    for query in (VectorStorage._search_query("docs", "cosine"), VectorStorage._neighbours_query("docs")):
+        assert "docs_refs" in query
+        assert "vector_id" in query
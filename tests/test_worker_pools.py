@@ -0,0 +1,86 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.models import worker_pools
+from src.models.worker_pools import WorkerPool
+
+
+async def test_pool_bounds_concurrent_jobs():
+    pool = WorkerPool("test", max_workers=2)
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def job(index):
+        with lock:
+            running.append(index)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(index)
+        return index
+
+    results = await asyncio.gather(*(pool.run(job, i) for i in range(6)))
+
+    assert results == list(range(6))
+    assert max(peak) == 2
+    stats = pool.stats()
+    assert (stats["completed"], stats["queued"], stats["active"]) == (6, 0, 0)
+    assert stats["max_wait"] >= 0.05
+
+
+async def test_pool_does_not_block_event_loop():
+    pool = WorkerPool("test", max_workers=1)
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    ticker = asyncio.create_task(tick())
+    await pool.run(time.sleep, 0.1)
+    ticker.cancel()
+
+    assert ticks >= 5
+
+
+async def test_errors_reach_caller():
+    pool = WorkerPool("test", max_workers=1)
+
+    def fail():
+        raise ValueError("broken")
+
+    with pytest.raises(ValueError, match="broken"):
+        await pool.run(fail)
+    assert pool.stats()["completed"] == 1
+
+
+async def test_cancelled_job_is_dropped_before_start():
+    pool = WorkerPool("test", max_workers=1)
+    started = []
+
+    blocking = asyncio.ensure_future(pool.run(time.sleep, 0.1))
+    queued = asyncio.ensure_future(pool.run(started.append, 1))
+    await asyncio.sleep(0.01)
+    queued.cancel()
+    await blocking
+
+    assert started == []
+    assert pool.stats()["queued"] == 0
+
+
+def test_pools_are_shared_and_configured(monkeypatch):
+    monkeypatch.setattr(worker_pools, "_pools", {})
+    monkeypatch.setattr(worker_pools, "_sizes", dict(worker_pools._sizes))
+
+    worker_pools.configure(storage=3, embedding=None)
+
+    assert worker_pools.get(worker_pools.STORAGE) is worker_pools.get(worker_pools.STORAGE)
+    assert worker_pools.get(worker_pools.STORAGE).max_workers == 3
+    assert worker_pools.get(worker_pools.EMBEDDING).max_workers == 4
+    assert set(worker_pools.stats()) == {worker_pools.STORAGE, worker_pools.EMBEDDING}